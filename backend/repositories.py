@@ -0,0 +1,766 @@
+"""
+Repository backends for the core collections.
+
+Handlers in server.py reach the master and stock collections through
+`repos` (and `report_repos` for report reads) rather than the Motor
+databases. MotorRepositories hands out the Motor collections unchanged.
+MemoryRepositories keeps every collection in process and answers the part of
+the MongoDB query, update and aggregation language server.py uses, so tests
+and perf experiments run without a mongod. Anything outside that part raises
+OperationFailure, as an older server would, which callers probing for server
+features already handle.
+"""
+
+from pymongo import InsertOne, UpdateOne, UpdateMany, DeleteOne, DeleteMany, ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+from bson import ObjectId
+from typing import List, Optional, Dict, Any, Iterable
+from datetime import datetime, timezone
+import itertools
+import re
+
+REPOSITORY_COLLECTIONS = ["items", "item_categories", "stock_balance", "number_series", "counters", "stock_movements"]
+
+class MotorRepositories:
+    def __init__(self, database):
+        self.database = database
+        for name in REPOSITORY_COLLECTIONS:
+            setattr(self, name, database[name])
+
+    async def supports_transactions(self) -> bool:
+        """Multi-document transactions need a replica set or mongos"""
+        hello = await self.database.client.admin.command("hello")
+        return bool(hello.get('setName') or hello.get('msg') == "isdbgrid")
+
+    async def start_session(self):
+        return await self.database.client.start_session()
+
+# ============ Memory Backend ============
+
+# Cross-type comparison order, after BSON: null < numbers < strings < objects < arrays < ids < bools < dates
+BSON_TYPE_RANKS = [(type(None), 1), (bool, 8), ((int, float), 2), (str, 3), (dict, 4), (list, 5),
+                   (ObjectId, 7), (datetime, 9)]
+
+def bson_datetime(value: datetime) -> datetime:
+    """A datetime as BSON stores it: UTC (naive values are taken as UTC) at millisecond precision"""
+    value = value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+def bson_document(value: Any) -> Any:
+    """Copy of a document about to be stored, with its datetimes normalised like the server does"""
+    if isinstance(value, dict):
+        return {key: bson_document(v) for key, v in value.items()}
+    if isinstance(value, list):
+        return [bson_document(v) for v in value]
+    if isinstance(value, datetime):
+        return bson_datetime(value)
+    return value
+
+def bson_sort_key(value):
+    if value is None:
+        return (1, 0)
+    if isinstance(value, datetime):
+        return (9, bson_datetime(value))
+    for kind, rank in BSON_TYPE_RANKS:
+        if isinstance(value, kind):
+            return (rank, value) if rank not in (4, 5) else (rank, str(value))
+    return (10, str(value))
+
+def path_values(doc: Any, path: str) -> List[Any]:
+    """Values at a dotted path for matching; arrays of documents are walked element-wise"""
+    values = [doc]
+    for part in path.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    found.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit():
+                    if int(part) < len(value):
+                        found.append(value[int(part)])
+                else:
+                    found.extend(element[part] for element in value if isinstance(element, dict) and part in element)
+        values = found
+    return values
+
+def get_path(doc: Dict[str, Any], path: str, default: Any = None) -> Any:
+    """Value at a dotted path for expressions; `a.b` over an array of documents gives the array of b"""
+    value: Any = doc
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            if part not in value:
+                return default
+            value = value[part]
+        elif isinstance(value, list):
+            value = [element[part] for element in value if isinstance(element, dict) and part in element]
+        else:
+            return default
+    return value
+
+def set_path(doc: Dict[str, Any], path: str, value: Any):
+    *parents, last = path.split('.')
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+def unset_path(doc: Dict[str, Any], path: str):
+    *parents, last = path.split('.')
+    for part in parents:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(last, None)
+
+def clone_document(value: Any) -> Any:
+    """Copy of a stored document; much cheaper than deepcopy since leaves are immutable BSON values"""
+    if isinstance(value, dict):
+        return {key: clone_document(v) for key, v in value.items()}
+    if isinstance(value, list):
+        return [clone_document(v) for v in value]
+    return value
+
+def values_equal(value: Any, target: Any) -> bool:
+    if isinstance(target, datetime):
+        return isinstance(value, datetime) and bson_datetime(value) == bson_datetime(target)
+    if value == target:
+        return isinstance(value, bool) == isinstance(target, bool)
+    return isinstance(target, re.Pattern) and isinstance(value, str) and bool(target.search(value))
+
+def compare_values(values: List[Any], target: Any, test) -> bool:
+    """Range operators only compare values of the same BSON type, array elements included"""
+    candidates = values + [element for value in values if isinstance(value, list) for element in value]
+    rank = bson_sort_key(target)[0]
+    return any(bson_sort_key(value)[0] == rank and test(bson_sort_key(value), bson_sort_key(target))
+               for value in candidates)
+
+BSON_TYPE_ALIASES = {
+    "double": float, "string": str, "object": dict, "array": list, "objectId": ObjectId, "bool": bool,
+    "date": datetime, "null": type(None), "int": int, "long": int, "number": (int, float),
+}
+
+def type_matches(values: List[Any], aliases: Any) -> bool:
+    """$type; like the server, array elements are tested as well as the array itself"""
+    candidates = values + [element for value in values if isinstance(value, list) for element in value]
+    for alias in aliases if isinstance(aliases, list) else [aliases]:
+        if alias not in BSON_TYPE_ALIASES:
+            raise OperationFailure(f"Unknown type name alias: {alias}", code=2)
+        kind = BSON_TYPE_ALIASES[alias]
+        if any(isinstance(value, kind) and (kind is bool or not isinstance(value, bool)) for value in candidates):
+            return True
+    return False
+
+def field_matches(values: List[Any], condition: Any) -> bool:
+    if not (isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition)):
+        if condition is None and not values:
+            return True
+        return any(values_equal(value, condition) or
+                   (isinstance(value, list) and any(values_equal(element, condition) for element in value))
+                   for value in values)
+    for op, target in condition.items():
+        if op == "$eq":
+            matched = field_matches(values, target)
+        elif op == "$ne":
+            matched = not field_matches(values, target)
+        elif op == "$in" and isinstance(target, frozenset):
+            matched = any(value in target if isinstance(value, str) else
+                          isinstance(value, list) and any(isinstance(e, str) and e in target for e in value)
+                          for value in values)
+        elif op == "$in":
+            matched = any(field_matches(values, t) for t in target)
+        elif op == "$nin":
+            matched = not any(field_matches(values, t) for t in target)
+        elif op == "$gt":
+            matched = compare_values(values, target, lambda a, b: a > b)
+        elif op == "$gte":
+            matched = compare_values(values, target, lambda a, b: a >= b)
+        elif op == "$lt":
+            matched = compare_values(values, target, lambda a, b: a < b)
+        elif op == "$lte":
+            matched = compare_values(values, target, lambda a, b: a <= b)
+        elif op == "$exists":
+            matched = bool(values) == bool(target)
+        elif op == "$type":
+            matched = type_matches(values, target)
+        elif op == "$all":
+            matched = all(field_matches(values, t) for t in target)
+        elif op == "$regex":
+            flags = re.IGNORECASE if 'i' in condition.get('$options', '') else 0
+            pattern = target if isinstance(target, re.Pattern) else re.compile(target, flags)
+            matched = field_matches(values, pattern)
+        elif op == "$options":
+            continue
+        elif op == "$size":
+            matched = any(isinstance(value, list) and len(value) == target for value in values)
+        elif op == "$not":
+            matched = not field_matches(values, target)
+        else:
+            raise OperationFailure(f"unknown operator: {op}", code=2)
+        if not matched:
+            return False
+    return True
+
+def compile_query(query: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The query with each all-string $in list as a set, so a scan tests membership once per document"""
+    compiled = {}
+    for key, condition in (query or {}).items():
+        if key in ("$and", "$or", "$nor"):
+            condition = [compile_query(q) for q in condition]
+        elif isinstance(condition, dict) and isinstance(condition.get("$in"), list) and \
+                condition["$in"] and all(isinstance(t, str) for t in condition["$in"]):
+            condition = {**condition, "$in": frozenset(condition["$in"])}
+        compiled[key] = condition
+    return compiled
+
+def document_matches(doc: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            matched = all(document_matches(doc, q) for q in condition)
+        elif key == "$or":
+            matched = any(document_matches(doc, q) for q in condition)
+        elif key == "$nor":
+            matched = not any(document_matches(doc, q) for q in condition)
+        elif key == "$expr":
+            matched = bool(evaluate_expression(condition, doc))
+        elif key.startswith('$'):
+            raise OperationFailure(f"unknown top level operator: {key}", code=2)
+        else:
+            matched = field_matches(path_values(doc, key), condition)
+        if not matched:
+            return False
+    return True
+
+def numeric_total(value: Any) -> float:
+    if isinstance(value, list):
+        return sum(v for v in value if isinstance(v, (int, float)) and not isinstance(v, bool))
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+EXPRESSION_COMPARISONS = {
+    "$eq": lambda a, b: a == b, "$ne": lambda a, b: a != b,
+    "$lt": lambda a, b: a < b, "$lte": lambda a, b: a <= b,
+    "$gt": lambda a, b: a > b, "$gte": lambda a, b: a >= b,
+}
+
+def evaluate_expression(expr: Any, doc: Dict[str, Any], variables: Optional[Dict[str, Any]] = None) -> Any:
+    variables = variables or {}
+    if isinstance(expr, str) and expr.startswith("$$"):
+        name, _, path = expr[2:].partition('.')
+        value = doc if name == "ROOT" else variables.get(name)
+        return get_path(value, path) if path else value
+    if isinstance(expr, str) and expr.startswith("$"):
+        return get_path(doc, expr[1:])
+    if isinstance(expr, list):
+        return [evaluate_expression(e, doc, variables) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) != 1 or not next(iter(expr)).startswith('$'):
+        return {key: evaluate_expression(value, doc, variables) for key, value in expr.items()}
+
+    op, args = next(iter(expr.items()))
+    if op == "$literal":
+        return args
+    if op == "$filter":
+        name = args.get('as', 'this')
+        source = evaluate_expression(args['input'], doc, variables) or []
+        return [element for element in source
+                if evaluate_expression(args['cond'], doc, {**variables, name: element})]
+    values = evaluate_expression(args, doc, variables)
+    if op == "$sum":
+        return sum(numeric_total(v) for v in values) if isinstance(args, list) else numeric_total(values)
+    if op in EXPRESSION_COMPARISONS:
+        return EXPRESSION_COMPARISONS[op](bson_sort_key(values[0]), bson_sort_key(values[1]))
+    if op == "$and":
+        return all(values)
+    if op == "$or":
+        return any(values)
+    if op == "$not":
+        return not (values[0] if isinstance(args, list) else values)
+    if op == "$ifNull":
+        return next((v for v in values[:-1] if v is not None), values[-1])
+    if op == "$add":
+        return sum(values)
+    if op == "$subtract":
+        return values[0] - values[1]
+    if op == "$size":
+        return len(values[0] if isinstance(args, list) else values)
+    if op == "$concatArrays":
+        return [element for value in values for element in value]
+    if op == "$slice":
+        array, *bounds = values
+        if len(bounds) == 1:
+            return array[:bounds[0]] if bounds[0] >= 0 else array[bounds[0]:]
+        return array[bounds[0]:bounds[0] + bounds[1]]
+    raise OperationFailure(f"Unrecognized expression '{op}'", code=168)
+
+def project_document(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Inclusion or exclusion projection; non-flag values are computed expressions"""
+    if not projection:
+        return doc
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if any(not isinstance(v, (bool, int)) or v for v in fields.values()) or (not fields and projection["_id"]):
+        projected = {"_id": doc["_id"]} if projection.get("_id", 1) and "_id" in doc else {}
+        for key, spec in fields.items():
+            if isinstance(spec, (bool, int)):
+                values = path_values(doc, key)
+                if values:
+                    set_path(projected, key, values[0])
+            else:
+                set_path(projected, key, evaluate_expression(spec, doc))
+        return projected
+    projected = dict(doc)
+    for key, flag in projection.items():
+        if not flag:
+            top = key.split('.')[0]
+            if top != key and isinstance(projected.get(top), dict):
+                projected[top] = clone_document(projected[top])
+            unset_path(projected, key)
+    return projected
+
+def sort_documents(docs: List[Dict[str, Any]], spec: List[tuple]) -> List[Dict[str, Any]]:
+    # Stable sorts from the last key to the first give the combined order
+    for key, direction in reversed(spec):
+        docs = sorted(docs, key=lambda doc: bson_sort_key(get_path(doc, key)), reverse=direction < 0)
+    return docs
+
+def normalise_sort(key_or_list, direction=None) -> List[tuple]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return list(key_or_list)
+
+def upsert_seed(query: Dict[str, Any]) -> Dict[str, Any]:
+    """Equality fields of a filter, which an upsert copies into the new document"""
+    seed: Dict[str, Any] = {}
+    for key, condition in query.items():
+        if key == "$and":
+            for part in condition:
+                seed.update(upsert_seed(part))
+        elif key.startswith('$'):
+            continue
+        elif isinstance(condition, dict) and any(k.startswith('$') for k in condition):
+            if "$eq" in condition:
+                set_path(seed, key, condition["$eq"])
+        else:
+            set_path(seed, key, condition)
+    return seed
+
+class MemoryCursor:
+    """Lazy result set; sort, skip and limit apply in that order whatever order they were chained in"""
+    def __init__(self, run, sort=None, skip: int = 0, limit: int = 0):
+        self.run = run
+        self.sort_spec = normalise_sort(sort) if sort else None
+        self.skip_count = skip
+        self.limit_count = limit
+        self.results: Optional[List[Dict[str, Any]]] = None
+        self.position = 0
+
+    def sort(self, key_or_list, direction=None):
+        self.sort_spec = normalise_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count: int):
+        self.skip_count = count
+        return self
+
+    def limit(self, count: int):
+        self.limit_count = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def rows(self) -> List[Dict[str, Any]]:
+        if self.results is None:
+            self.results = self.run(self.sort_spec, self.skip_count, self.limit_count)
+        return self.results
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        rows = self.rows()
+        end = len(rows) if length is None else min(len(rows), self.position + length)
+        batch, self.position = rows[self.position:end], end
+        return batch
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        rows = self.rows()
+        if self.position >= len(rows):
+            raise StopAsyncIteration
+        self.position += 1
+        return rows[self.position - 1]
+
+class MemoryCollection:
+    """One collection held in memory, with unique indexes enforced"""
+    def __init__(self, name: str, repositories: "MemoryRepositories"):
+        self.name = name
+        self.repositories = repositories
+        self.docs: Dict[Any, Dict[str, Any]] = {}
+        self.unique: Dict[tuple, Dict[tuple, Any]] = {}
+        self.indexes: Dict[str, Dict[str, Any]] = {"_id_": {"key": [("_id", 1)]}}
+
+    # ---- indexes ----
+    def index_key(self, fields: tuple, doc: Dict[str, Any]) -> tuple:
+        return tuple(repr(get_path(doc, field)) for field in fields)
+
+    def check_unique(self, doc: Dict[str, Any], ignore_id: Any = None):
+        for fields, entries in self.unique.items():
+            owner = entries.get(self.index_key(fields, doc))
+            if owner is not None and owner != ignore_id:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name} index: {'_'.join(fields)}", 11000
+                )
+
+    def index_add(self, doc: Dict[str, Any]):
+        for fields, entries in self.unique.items():
+            entries[self.index_key(fields, doc)] = doc["_id"]
+
+    def index_remove(self, doc: Dict[str, Any]):
+        for fields, entries in self.unique.items():
+            entries.pop(self.index_key(fields, doc), None)
+
+    def add_unique(self, fields: tuple):
+        entries: Dict[tuple, Any] = {}
+        for doc in self.docs.values():
+            key = self.index_key(fields, doc)
+            if key in entries:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name}", 11000)
+            entries[key] = doc["_id"]
+        self.unique[fields] = entries
+
+    async def create_index(self, keys, unique: bool = False, **kwargs) -> str:
+        keys = normalise_sort(keys)
+        fields = tuple(key for key, _ in keys)
+        if unique and fields not in self.unique:
+            self.add_unique(fields)
+        name = "_".join(f"{key}_{direction}" for key, direction in keys)
+        self.indexes[name] = {"key": keys, **({"unique": True} if fields in self.unique else {})}
+        return name
+
+    async def index_information(self) -> Dict[str, Any]:
+        return {name: dict(index) for name, index in self.indexes.items()}
+
+    # ---- reads ----
+    def select(self, query: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if query and "_id" in query and not isinstance(query["_id"], dict):
+            doc = self.docs.get(query["_id"])
+            return [doc] if doc and document_matches(doc, query) else []
+        # String equality or $in on every field of a unique index is a point lookup, like an index seek
+        for fields, entries in self.unique.items():
+            keys = self.point_keys(query, fields)
+            if keys is not None:
+                owners = dict.fromkeys(entries.get(key) for key in keys)
+                docs = [self.docs[owner] for owner in owners if owner is not None]
+                return [doc for doc in docs if document_matches(doc, query)]
+        query = compile_query(query)
+        return [doc for doc in self.docs.values() if document_matches(doc, query)]
+
+    def point_keys(self, query: Optional[Dict[str, Any]], fields: tuple) -> Optional[List[tuple]]:
+        choices = []
+        for field in fields:
+            condition = (query or {}).get(field)
+            if isinstance(condition, dict) and list(condition) == ["$in"]:
+                condition = condition["$in"]
+            values = condition if isinstance(condition, list) else [condition]
+            if not all(isinstance(value, str) for value in values):
+                return None
+            choices.append([repr(value) for value in values])
+        return list(itertools.product(*choices))
+
+    def find(self, filter: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None,
+             sort=None, skip: int = 0, limit: int = 0, session=None, **kwargs) -> MemoryCursor:
+        def run(sort_spec, skip_count, limit_count):
+            docs = self.select(filter)
+            if sort_spec:
+                docs = sort_documents(docs, sort_spec)
+            docs = docs[skip_count:skip_count + limit_count if limit_count else None]
+            return [clone_document(project_document(doc, projection)) for doc in docs]
+        return MemoryCursor(run, sort, skip, limit)
+
+    async def find_one(self, filter: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None,
+                       sort=None, session=None, **kwargs) -> Optional[Dict[str, Any]]:
+        rows = await self.find(filter, projection, sort=sort, limit=1).to_list(1)
+        return rows[0] if rows else None
+
+    async def count_documents(self, filter: Dict[str, Any], session=None, **kwargs) -> int:
+        return len(self.select(filter))
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], session=None, **kwargs) -> MemoryCursor:
+        return MemoryCursor(lambda *_: [clone_document(doc) for doc in self.run_pipeline(pipeline)])
+
+    def run_pipeline(self, pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        docs = list(self.docs.values())
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if name == "$match":
+                spec = compile_query(spec)
+                docs = [doc for doc in docs if document_matches(doc, spec)]
+            elif name in ("$set", "$addFields"):
+                docs = [self.add_fields(doc, spec) for doc in docs]
+            elif name == "$project":
+                docs = [project_document(doc, spec) for doc in docs]
+            elif name == "$unset":
+                docs = [project_document(doc, {field: 0 for field in ([spec] if isinstance(spec, str) else spec)})
+                        for doc in docs]
+            elif name == "$sort":
+                docs = sort_documents(docs, normalise_sort(spec))
+            elif name == "$skip":
+                docs = docs[spec:]
+            elif name == "$limit":
+                docs = docs[:spec]
+            elif name == "$group":
+                docs = self.group(docs, spec)
+            elif name == "$lookup" and "localField" in spec:
+                docs = self.lookup(docs, spec)
+            else:
+                raise OperationFailure(f"Unrecognized pipeline stage name: '{name}'", code=40324)
+        return docs
+
+    def add_fields(self, doc: Dict[str, Any], spec: Dict[str, Any]) -> Dict[str, Any]:
+        updated = dict(doc)
+        for field, expr in spec.items():
+            top = field.split('.')[0]
+            if top != field and isinstance(updated.get(top), dict):
+                updated[top] = clone_document(updated[top])
+            set_path(updated, field, evaluate_expression(expr, doc))
+        return updated
+
+    def lookup(self, docs: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Equality $lookup, joined through a map of the foreign collection built once per stage"""
+        foreign_by_key: Dict[str, Dict[Any, Dict[str, Any]]] = {}
+        for foreign in self.repositories[spec['from']].docs.values():
+            values = get_path(foreign, spec['foreignField'])
+            for value in values if isinstance(values, list) else [values]:
+                foreign_by_key.setdefault(repr(value), {})[foreign["_id"]] = foreign
+        joined = []
+        for doc in docs:
+            values = get_path(doc, spec['localField'])
+            matches: Dict[Any, Dict[str, Any]] = {}
+            for value in values if isinstance(values, list) else [values]:
+                matches.update(foreign_by_key.get(repr(value), {}))
+            joined.append({**doc, spec['as']: [clone_document(match) for match in matches.values()]})
+        return joined
+
+    def group(self, docs: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+        groups: Dict[str, Dict[str, Any]] = {}
+        for doc in docs:
+            group_id = evaluate_expression(spec["_id"], doc)
+            row = groups.setdefault(repr(group_id), {"_id": group_id})
+            for field, accumulator in spec.items():
+                if field == "_id":
+                    continue
+                (op, expr), = accumulator.items()
+                value = evaluate_expression(expr, doc)
+                if op == "$sum":
+                    row[field] = row.get(field, 0) + (value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0)
+                elif op == "$first":
+                    row.setdefault(field, value)
+                elif op == "$last":
+                    row[field] = value
+                elif op in ("$min", "$max"):
+                    if value is not None and (field not in row or
+                                              (bson_sort_key(value) < bson_sort_key(row[field])) == (op == "$min")):
+                        row[field] = value
+                elif op == "$push":
+                    row.setdefault(field, []).append(value)
+                else:
+                    raise OperationFailure(f"unknown group operator '{op}'", code=15952)
+        return list(groups.values())
+
+    # ---- writes ----
+    def store(self, doc: Dict[str, Any]) -> Any:
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_", 11000)
+        stored = bson_document(doc)
+        self.check_unique(stored)
+        self.docs[doc["_id"]] = stored
+        self.index_add(stored)
+        return doc["_id"]
+
+    async def insert_one(self, document: Dict[str, Any], session=None, **kwargs) -> InsertOneResult:
+        return InsertOneResult(self.store(document), True)
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True, session=None, **kwargs) -> InsertManyResult:
+        result = await self.bulk_write([InsertOne(doc) for doc in documents], ordered=ordered)
+        return InsertManyResult([doc["_id"] for doc in documents if "_id" in doc], result.acknowledged)
+
+    def apply_update(self, doc: Dict[str, Any], update: Any, inserting: bool) -> Dict[str, Any]:
+        if isinstance(update, list):
+            updated = doc
+            for stage in update:
+                (name, spec), = stage.items()
+                if name in ("$set", "$addFields"):
+                    updated = self.add_fields(updated, spec)
+                elif name in ("$unset", "$project"):
+                    updated = self.run_stage_on(updated, stage)
+                else:
+                    raise OperationFailure(f"'{name}' is not allowed in an update pipeline", code=72)
+            return {**updated, "_id": doc["_id"]}
+        if not update or not all(op.startswith('$') for op in update):
+            raise ValueError("update only works with $ operators")
+        updated = clone_document(doc)
+        for op, fields in update.items():
+            for path, value in fields.items():
+                if op == "$set" or (op == "$setOnInsert" and inserting):
+                    set_path(updated, path, clone_document(value))
+                elif op == "$unset":
+                    unset_path(updated, path)
+                elif op == "$inc":
+                    set_path(updated, path, (get_path(updated, path) or 0) + value)
+                elif op == "$setOnInsert":
+                    continue
+                else:
+                    raise OperationFailure(f"Unknown modifier: {op}", code=9)
+        return updated
+
+    def run_stage_on(self, doc: Dict[str, Any], stage: Dict[str, Any]) -> Dict[str, Any]:
+        saved, self.docs = self.docs, {doc["_id"]: doc}
+        try:
+            return self.run_pipeline([stage])[0]
+        finally:
+            self.docs = saved
+
+    def replace_stored(self, old: Dict[str, Any], new: Dict[str, Any]):
+        new = bson_document(new)
+        self.index_remove(old)
+        try:
+            self.check_unique(new, ignore_id=old["_id"])
+        except DuplicateKeyError:
+            self.index_add(old)
+            raise
+        self.docs[old["_id"]] = new
+        self.index_add(new)
+
+    def update_documents(self, filter: Dict[str, Any], update: Any, upsert: bool, many: bool,
+                         sort=None) -> Dict[str, Any]:
+        """Apply one update op; returns the raw result plus the before/after of the first document"""
+        matches = self.select(filter)
+        if sort:
+            matches = sort_documents(matches, normalise_sort(sort))
+        if not many:
+            matches = matches[:1]
+        raw: Dict[str, Any] = {"n": len(matches), "nModified": 0, "before": None, "after": None}
+        for doc in matches:
+            updated = self.apply_update(doc, update, inserting=False)
+            if raw["before"] is None:
+                raw["before"], raw["after"] = doc, updated
+            if updated != doc:
+                self.replace_stored(doc, updated)
+                raw["nModified"] += 1
+        if not matches and upsert:
+            seed = upsert_seed(filter)
+            new_doc = self.apply_update({**seed, "_id": seed.get("_id", ObjectId())}, update, inserting=True)
+            self.store(new_doc)
+            raw.update(n=1, upserted=new_doc["_id"], after=new_doc)
+        return raw
+
+    async def update_one(self, filter: Dict[str, Any], update: Any, upsert: bool = False, session=None, **kwargs) -> UpdateResult:
+        raw = self.update_documents(filter, update, upsert, many=False)
+        return UpdateResult({key: raw[key] for key in ("n", "nModified", "upserted") if key in raw}, True)
+
+    async def update_many(self, filter: Dict[str, Any], update: Any, upsert: bool = False, session=None, **kwargs) -> UpdateResult:
+        raw = self.update_documents(filter, update, upsert, many=True)
+        return UpdateResult({key: raw[key] for key in ("n", "nModified", "upserted") if key in raw}, True)
+
+    async def find_one_and_update(self, filter: Dict[str, Any], update: Any, projection: Optional[Dict[str, Any]] = None,
+                                  sort=None, upsert: bool = False, return_document: bool = ReturnDocument.BEFORE,
+                                  session=None, **kwargs) -> Optional[Dict[str, Any]]:
+        raw = self.update_documents(filter, update, upsert, many=False, sort=sort)
+        doc = raw["after"] if return_document == ReturnDocument.AFTER else raw["before"]
+        return clone_document(project_document(doc, projection)) if doc else None
+
+    async def find_one_and_delete(self, filter: Dict[str, Any], projection: Optional[Dict[str, Any]] = None,
+                                  sort=None, session=None, **kwargs) -> Optional[Dict[str, Any]]:
+        matches = self.select(filter)
+        if sort:
+            matches = sort_documents(matches, normalise_sort(sort))
+        if not matches:
+            return None
+        self.remove(matches[0])
+        return clone_document(project_document(matches[0], projection))
+
+    def remove(self, doc: Dict[str, Any]):
+        self.index_remove(doc)
+        del self.docs[doc["_id"]]
+
+    async def delete_one(self, filter: Dict[str, Any], session=None, **kwargs) -> DeleteResult:
+        matches = self.select(filter)[:1]
+        for doc in matches:
+            self.remove(doc)
+        return DeleteResult({"n": len(matches)}, True)
+
+    async def delete_many(self, filter: Dict[str, Any], session=None, **kwargs) -> DeleteResult:
+        matches = self.select(filter)
+        for doc in matches:
+            self.remove(doc)
+        return DeleteResult({"n": len(matches)}, True)
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True, session=None, **kwargs) -> BulkWriteResult:
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+                  "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self.store(request._doc)
+                    result["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany)):
+                    raw = self.update_documents(request._filter, request._doc, request._upsert,
+                                                many=isinstance(request, UpdateMany))
+                    if "upserted" in raw:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": index, "_id": raw["upserted"]})
+                    else:
+                        result["nMatched"] += raw["n"]
+                        result["nModified"] += raw["nModified"]
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    deleted = await (self.delete_many if isinstance(request, DeleteMany) else self.delete_one)(request._filter)
+                    result["nRemoved"] += deleted.deleted_count
+                else:
+                    raise TypeError(f"{request!r} is not a valid request")
+            except DuplicateKeyError as exc:
+                result["writeErrors"].append({"index": index, "code": 11000, "errmsg": str(exc), "op": request})
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+class MemoryRepositories:
+    """Every collection in process memory, created on first use like the server does
+
+    Also stands in for the Motor database (`database[name]`, `database.name`),
+    so routes that still go to `db` directly run against the same store. The
+    given index specs declare which unique indexes each collection enforces.
+    """
+    def __init__(self, index_specs: Iterable[Dict[str, Any]] = (), name: str = "memory"):
+        self.name = name
+        self.collections: Dict[str, MemoryCollection] = {}
+        self.unique_indexes: Dict[str, List[tuple]] = {}
+        for spec in index_specs:
+            if spec.get('unique'):
+                self.unique_indexes.setdefault(spec['collection'], []).append(tuple(k for k, _ in spec['keys']))
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self.collections:
+            collection = MemoryCollection(name, self)
+            for fields in self.unique_indexes.get(name, []):
+                collection.add_unique(fields)
+            self.collections[name] = collection
+        return self.collections[name]
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    async def list_collection_names(self) -> List[str]:
+        return list(self.collections)
+
+    async def supports_transactions(self) -> bool:
+        return False
+
+    async def start_session(self):
+        raise OperationFailure("Memory repositories do not support sessions")
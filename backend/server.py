@@ -1,26 +1,129 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, UploadFile, File, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import ResponseValidationError
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, UpdateMany, ReturnDocument, monitoring
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
+from bson import json_util
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, TypeAdapter, ValidationError, model_validator
+from typing import Annotated, List, Optional, Dict, Any
 import uuid
+import json
+import base64
+import csv
+import io
+import asyncio
+import re
+import time
+import bisect
+import heapq
+import threading
+from itertools import islice
+from contextvars import ContextVar
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 from enum import Enum
+from repositories import REPOSITORY_COLLECTIONS, MotorRepositories, MemoryRepositories
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# pymongo fixes a client's event listeners when the client is built, so the
+# clients get this forwarder; the Query Profiler registers on it further down
+class CommandListeners(monitoring.CommandListener):
+    def __init__(self):
+        self.listeners: List[monitoring.CommandListener] = []
+
+    def started(self, event):
+        for listener in self.listeners:
+            listener.started(event)
+
+    def succeeded(self, event):
+        for listener in self.listeners:
+            listener.succeeded(event)
+
+    def failed(self, event):
+        for listener in self.listeners:
+            listener.failed(event)
+
+command_listeners = CommandListeners()
+
 # MongoDB connection
+# Pool, timeout, compression and read preference settings come from MONGO_*
+# env vars. Reports and exports read through their own client (own pool,
+# secondary-preferred by default, optionally another server via
+# MONGO_REPORT_URL) so long scans do not hold connections postings need;
+# MONGO_REPORT_* overrides any setting for that client alone.
+MONGO_OPTION_ENV = {
+    "MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MIN_POOL_SIZE": ("minPoolSize", int),
+    "MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int),
+    "SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int),
+    "WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),
+    "COMPRESSORS": ("compressors", str),  # e.g. "zstd,snappy,zlib"; zstd/snappy need their extras installed
+    "READ_PREFERENCE": ("readPreference", str),
+}
+
+def mongo_client_options(prefix: str = "MONGO", **defaults) -> Dict[str, Any]:
+    """<prefix>_* env vars, then the given defaults, then the shared MONGO_* env vars"""
+    options = {"tz_aware": True, "event_listeners": [command_listeners], **defaults}
+    for name, (option, cast) in MONGO_OPTION_ENV.items():
+        value = os.environ.get(f"{prefix}_{name}")
+        if value is None and option not in defaults:
+            value = os.environ.get(f"MONGO_{name}")
+        if value:
+            options[option] = cast(value)
+    return options
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, **mongo_client_options())
 db = client[os.environ['DB_NAME']]
+report_client = AsyncIOMotorClient(
+    os.environ.get('MONGO_REPORT_URL', mongo_url),
+    **mongo_client_options("MONGO_REPORT", readPreference="secondaryPreferred", maxPoolSize=20)
+)
+report_db = report_client[os.environ['DB_NAME']]
+
+# ============ Repositories ============
+# Handlers reach the core master and stock collections through `repos` (and
+# `report_repos` for report reads); the backends live in repositories.py.
+# use_memory_backend() moves every collection into process memory, so tests
+# and perf experiments run without a mongod.
+
+repos = MotorRepositories(db)
+report_repos = MotorRepositories(report_db)
+
+def use_repositories(primary, reports=None):
+    """Point the repository layer at another backend"""
+    global repos, report_repos
+    repos = primary
+    report_repos = reports or primary
+    transaction_support['supported'] = None
+    ledger_window_support['supported'] = None
+    number_leases.clear()
+    number_lease_locks.clear()
+    invalidate_uom_cache()
+    invalidate_category_cache()
+    category_code_info.clear()
+
+def use_memory_backend() -> MemoryRepositories:
+    """Serve every collection, repository or not, from a fresh in-memory store"""
+    global db, report_db
+    memory = MemoryRepositories(index_specs(), name=os.environ['DB_NAME'])
+    db = report_db = memory
+    use_repositories(memory)
+    return memory
 
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
@@ -28,6 +131,8 @@ JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24
 
 security = HTTPBearer()
+# Authentication is disabled, so routes that record who acted take the user only when a token is sent
+optional_security = HTTPBearer(auto_error=False)
 
 # Create the main app
 app = FastAPI(title="ERP Inventory Management System")
@@ -196,11 +301,16 @@ class UOMMaster(BaseModel):
     is_base_unit: bool = False
     base_uom_id: Optional[str] = None
     base_uom_name: Optional[str] = None
-    conversion_factor: float = 1.0
-    conversions: Optional[Dict[str, float]] = None
+    conversion_factor: float = Field(default=1.0, gt=0)
+    conversions: Optional[Dict[str, Annotated[float, Field(gt=0)]]] = None
     status: str = "Active"
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class UOMConversion(BaseModel):
+    qty: float
+    from_uom_id: str
+    to_uom_id: str
+
 class SupplierMaster(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -322,6 +432,21 @@ class QualityCheck(BaseModel):
     remarks: Optional[str] = None
 
 # ============ Inventory Models ============
+def require_item_or_lines(document: BaseModel, fields: List[str]):
+    """Single-line documents carry the item on the header; multi-line ones list `items`"""
+    if not document.items and any(getattr(document, field) is None for field in fields):
+        raise ValueError(f"Either {', '.join(fields)} or items is required")
+    return document
+
+class GRNItem(BaseModel):
+    item_id: str
+    item_name: str
+    qty: float
+    uom: str
+    uom_id: Optional[str] = None
+    base_qty: Optional[float] = None
+    base_uom: Optional[str] = None
+
 class GRN(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -330,13 +455,14 @@ class GRN(BaseModel):
     po_no: str
     supplier_id: str
     supplier_name: str
-    item_id: str
-    item_name: str
-    qty: float
-    uom: str
+    item_id: Optional[str] = None
+    item_name: Optional[str] = None
+    qty: Optional[float] = None
+    uom: Optional[str] = None
     uom_id: Optional[str] = None
     base_qty: Optional[float] = None  # Converted to base UOM
     base_uom: Optional[str] = None
+    items: List[GRNItem] = Field(default_factory=list)
     warehouse_id: str
     invoice_no: Optional[str] = None
     invoice_date: Optional[datetime] = None
@@ -344,22 +470,39 @@ class GRN(BaseModel):
     status: str = "Pending QC"
     received_by: str
     received_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    
+    @model_validator(mode="after")
+    def check_lines(self):
+        return require_item_or_lines(self, ["item_id", "item_name", "qty", "uom"])
+
+class StockInwardItem(BaseModel):
+    item_id: str
+    item_name: str
+    qty: float
+    uom: str
+    bin_location_id: Optional[str] = None
+    batch_no: Optional[str] = None
 
 class StockInward(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     inward_no: str
     qc_id: str
-    item_id: str
-    item_name: str
-    qty: float
-    uom: str
+    item_id: Optional[str] = None
+    item_name: Optional[str] = None
+    qty: Optional[float] = None
+    uom: Optional[str] = None
+    items: List[StockInwardItem] = Field(default_factory=list)
     warehouse_id: str
     bin_location_id: Optional[str] = None
     batch_no: Optional[str] = None
     status: str = "Completed"
     created_by: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    
+    @model_validator(mode="after")
+    def check_lines(self):
+        return require_item_or_lines(self, ["item_id", "item_name", "qty", "uom"])
 
 class StockTransfer(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -379,23 +522,38 @@ class StockTransfer(BaseModel):
     approved_by: Optional[str] = None
     approved_at: Optional[datetime] = None
 
+class IssueItem(BaseModel):
+    item_id: str
+    item_name: str
+    qty: float
+    uom: str
+    uom_id: Optional[str] = None
+    base_qty: Optional[float] = None
+    base_uom: Optional[str] = None
+    remarks: Optional[str] = None
+
 class IssueToDepartment(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     issue_no: str
     department: str
-    item_id: str
-    item_name: str
-    qty: float
-    uom: str
+    item_id: Optional[str] = None
+    item_name: Optional[str] = None
+    qty: Optional[float] = None
+    uom: Optional[str] = None
     uom_id: Optional[str] = None
     base_qty: Optional[float] = None
     base_uom: Optional[str] = None
+    items: List[IssueItem] = Field(default_factory=list)
     warehouse_id: str
     warehouse_name: str
     issued_by: str
     issued_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     remarks: Optional[str] = None
+    
+    @model_validator(mode="after")
+    def check_lines(self):
+        return require_item_or_lines(self, ["item_id", "item_name", "qty", "uom"])
 
 class ReturnFromDepartment(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -416,15 +574,23 @@ class ReturnFromDepartment(BaseModel):
     returned_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     remarks: Optional[str] = None
 
+class StockAdjustmentItem(BaseModel):
+    item_id: str
+    item_name: str
+    adjustment_qty: float
+    uom: str
+    remarks: Optional[str] = None
+
 class StockAdjustment(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     adjustment_no: str
-    item_id: str
-    item_name: str
+    item_id: Optional[str] = None
+    item_name: Optional[str] = None
     warehouse_id: str
-    adjustment_qty: float
-    uom: str
+    adjustment_qty: Optional[float] = None
+    uom: Optional[str] = None
+    items: List[StockAdjustmentItem] = Field(default_factory=list)
     reason: StockAdjustmentReason
     status: ApprovalStatus = ApprovalStatus.PENDING
     created_by: str
@@ -432,6 +598,10 @@ class StockAdjustment(BaseModel):
     approved_by: Optional[str] = None
     approved_at: Optional[datetime] = None
     remarks: Optional[str] = None
+    
+    @model_validator(mode="after")
+    def check_lines(self):
+        return require_item_or_lines(self, ["item_id", "item_name", "adjustment_qty", "uom"])
 
 # ============ Stock Balance Model ============
 class StockBalance(BaseModel):
@@ -445,6 +615,20 @@ class StockBalance(BaseModel):
     uom: str
     last_updated: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# ============ Stock Movement Model ============
+class StockMovement(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    txn_type: str  # OPENING, INWARD, ISSUE, RETURN
+    txn_id: Optional[str] = None
+    txn_no: Optional[str] = None
+    item_id: str
+    item_name: str
+    warehouse_id: str
+    qty: float  # Signed: receipts positive, issues negative
+    uom: str
+    posted_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
 # ============ Settings Models ============
 class ApprovalFlow(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -488,83 +672,1162 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-async def get_next_number(series_type: str) -> str:
-    series = await db.number_series.find_one({"series_type": series_type})
-    if not series:
-        series = {"series_type": series_type, "prefix": series_type[:3].upper(), "current_number": 0, "padding": 4}
-        await db.number_series.insert_one(series)
-    
-    next_num = series['current_number'] + 1
-    await db.number_series.update_one(
-        {"series_type": series_type},
-        {"$set": {"current_number": next_num}}
-    )
-    return f"{series['prefix']}{str(next_num).zfill(series['padding'])}"
+async def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> Optional[Dict]:
+    if credentials is None:
+        return None
+    return await get_current_user(credentials)
+
+# Numbers are leased from number_series in blocks with one atomic $inc, then
+# handed out from memory. A block size above 1 removes the database round trip
+# from most postings at the cost of gaps when a worker restarts mid-block.
+NUMBER_SERIES_BLOCK_SIZE = int(os.environ.get('NUMBER_SERIES_BLOCK_SIZE', '1'))
+number_leases: Dict[str, Dict[str, Any]] = {}
+number_lease_locks: Dict[str, asyncio.Lock] = {}
+
+async def lease_number_block(series_type: str, size: int) -> Dict[str, Any]:
+    update = {
+        "$inc": {"current_number": size},
+        "$setOnInsert": {"id": str(uuid.uuid4()), "prefix": series_type[:3].upper(), "padding": 4}
+    }
+    try:
+        series = await repos.number_series.find_one_and_update(
+            {"series_type": series_type}, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Another worker created the series first; the retry takes the update path
+        series = await repos.number_series.find_one_and_update(
+            {"series_type": series_type}, update, return_document=ReturnDocument.AFTER
+        )
+    return {
+        "next": series['current_number'] - size + 1,
+        "last": series['current_number'],
+        "prefix": series['prefix'],
+        "padding": series['padding'],
+    }
 
-async def convert_uom(qty: float, from_uom_id: str, to_uom_id: str) -> float:
-    """Convert quantity from one UOM to another using conversion factors"""
+async def get_next_number(series_type: str) -> str:
+    lock = number_lease_locks.setdefault(series_type, asyncio.Lock())
+    async with lock:
+        lease = number_leases.get(series_type)
+        if not lease or lease['next'] > lease['last']:
+            lease = number_leases[series_type] = await lease_number_block(series_type, NUMBER_SERIES_BLOCK_SIZE)
+        next_num = lease['next']
+        lease['next'] += 1
+    return f"{lease['prefix']}{str(next_num).zfill(lease['padding'])}"
+
+# UOM conversion matrix: every UOM's factor to every other UOM of the same
+# uom_category, rebuilt from one read of the uoms collection after a UOM write.
+uom_cache: Dict[str, Any] = {"version": 0, "loaded_version": -1, "units": {}, "matrix": {}}
+
+def invalidate_uom_cache():
+    uom_cache['version'] += 1
+
+def positive_factor(value: Any) -> Optional[float]:
+    """A stored factor usable for division, or None for a missing, zero or negative one"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+        return value
+    return None
+
+def build_uom_matrix(uoms: List[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Factors via the base unit, overridden by any explicit `conversions` (keyed by id or name).
+    Units without a positive factor are left out, so only conversions involving them fail."""
+    by_category: Dict[str, List[Dict[str, Any]]] = {}
+    for uom in uoms:
+        by_category.setdefault(uom.get('uom_category'), []).append(uom)
+    matrix = {}
+    for category, members in by_category.items():
+        base = {uom['id']: positive_factor(uom.get('conversion_factor', 1.0)) for uom in members}
+        factors = {
+            a: {b: base[a] / base[b] for b in base if base[b]}
+            for a in base if base[a]
+        }
+        for a in members:
+            explicit = a.get('conversions') or {}
+            for b in members:
+                factor = positive_factor(explicit.get(b['id'], explicit.get(b.get('uom_name'))))
+                if factor and a['id'] != b['id']:
+                    factors.setdefault(a['id'], {})[b['id']] = factor
+                    factors.setdefault(b['id'], {})[a['id']] = 1 / factor
+        matrix[category] = factors
+    return matrix
+
+async def get_uom_matrix() -> Dict[str, Any]:
+    version = uom_cache['version']
+    if uom_cache['loaded_version'] != version:
+        uoms = await db.uoms.find({}, {
+            "_id": 0, "id": 1, "uom_name": 1, "uom_category": 1, "conversion_factor": 1,
+            "conversions": 1, "decimal_precision": 1
+        }).to_list(None)
+        uom_cache['units'] = {uom['id']: uom for uom in uoms}
+        uom_cache['matrix'] = build_uom_matrix(uoms)
+        uom_cache['loaded_version'] = version
+    return uom_cache
+
+def convert_with_matrix(cache: Dict[str, Any], qty: float, from_uom_id: str, to_uom_id: str) -> float:
     if from_uom_id == to_uom_id:
         return qty
-    
-    from_uom = await db.uoms.find_one({"id": from_uom_id})
-    to_uom = await db.uoms.find_one({"id": to_uom_id})
-    
+    from_uom = cache['units'].get(from_uom_id)
+    to_uom = cache['units'].get(to_uom_id)
     if not from_uom or not to_uom:
         return qty
-    
-    # Check if UOMs are in same category
     if from_uom.get('uom_category') != to_uom.get('uom_category'):
         raise HTTPException(status_code=400, detail="Cannot convert between different UOM categories")
-    
-    # Convert to base unit first, then to target unit
-    qty_in_base = qty * from_uom.get('conversion_factor', 1.0)
-    converted_qty = qty_in_base / to_uom.get('conversion_factor', 1.0)
-    
-    return round(converted_qty, to_uom.get('decimal_precision', 2))
+    factor = cache['matrix'][from_uom.get('uom_category')].get(from_uom_id, {}).get(to_uom_id)
+    if factor is None:
+        raise HTTPException(status_code=400, detail="UOM has no valid conversion factor")
+    return round(qty * factor, to_uom.get('decimal_precision', 2))
 
-async def get_item_type_code(item_type: str) -> str:
+async def convert_uom(qty: float, from_uom_id: str, to_uom_id: str) -> float:
+    """Convert quantity from one UOM to another using conversion factors"""
+    return convert_with_matrix(await get_uom_matrix(), qty, from_uom_id, to_uom_id)
+
+ITEM_TYPE_CODES = {
+    "FABRIC": "FAB",
+    "RM": "RM",  # Raw Materials (Trims)
+    "FG": "FG",  # Finished Goods
+    "PACKING": "PKG",
+    "CONSUMABLE": "CNS",
+    "GENERAL": "GEN",
+    "ACCESSORY": "ACC"
+}
+
+def get_item_type_code(item_type: str) -> str:
     """Get the type code prefix for item code generation"""
-    type_code_mapping = {
-        "FABRIC": "FAB",
-        "RM": "RM",  # Raw Materials (Trims)
-        "FG": "FG",  # Finished Goods
-        "PACKING": "PKG",
-        "CONSUMABLE": "CNS",
-        "GENERAL": "GEN",
-        "ACCESSORY": "ACC"
-    }
-    return type_code_mapping.get(item_type, "GEN")
+    return ITEM_TYPE_CODES.get(item_type, "GEN")
 
-async def generate_next_item_code(category_id: str) -> str:
-    """Generate next item code based on category and item type
+# category_id -> code prefix parts and inherited fields; cleared on every category write
+category_code_info: Dict[str, Dict[str, Any]] = {}
+
+async def get_category_code_info(category_id: str) -> Optional[Dict[str, Any]]:
+    """Cached lookup of what item codes and item docs inherit from a category"""
+    info = category_code_info.get(category_id)
+    if info is None:
+        category = await repos.item_categories.find_one(
+            {"id": category_id}, {"_id": 0, "item_type": 1, "name": 1, "category_short_code": 1, "code": 1, "allowed_uoms": 1}
+        )
+        if not category:
+            return None
+        item_type = category.get('item_type', 'GENERAL')
+        info = category_code_info[category_id] = {
+            "item_type": item_type,
+            "name": category.get('name', ''),
+            "type_code": get_item_type_code(item_type),
+            "category_short_code": category.get('category_short_code') or category.get('code', 'GEN'),
+            "allowed_uoms": category.get('allowed_uoms') or [],
+        }
+    return info
+
+async def reserve_item_codes(category_id: str, count: int = 1) -> List[str]:
+    """Atomically reserve `count` consecutive item codes for a category
     Format: <TypeCode>-<CategoryShortCode>-<RunningNumber>
     Example: RM-LBL-0045, CNS-NDL-0102
     """
-    # Get category details
-    category = await db.item_categories.find_one({"id": category_id}, {"_id": 0})
-    if not category:
+    info = await get_category_code_info(category_id)
+    if not info:
         raise HTTPException(status_code=404, detail="Category not found")
     
-    item_type = category.get('item_type', 'GENERAL')
-    category_short_code = category.get('category_short_code') or category.get('code', 'GEN')
+    counter_key = f"item_code_{category_id}"
+    try:
+        counter = await repos.counters.find_one_and_update(
+            {"key": counter_key}, {"$inc": {"value": count}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        counter = await repos.counters.find_one_and_update(
+            {"key": counter_key}, {"$inc": {"value": count}}, return_document=ReturnDocument.AFTER
+        )
+    first = counter['value'] - count + 1
+    prefix = f"{info['type_code']}-{info['category_short_code']}-"
+    return [f"{prefix}{str(n).zfill(4)}" for n in range(first, counter['value'] + 1)]
+
+async def generate_next_item_code(category_id: str) -> str:
+    """Generate next item code based on category and item type"""
+    return (await reserve_item_codes(category_id, 1))[0]
+
+# ============ Stock Movement Ledger ============
+# Every posting appends an immutable row to stock_movements; stock_balance is
+# the read model kept alongside it. stock_snapshots hold per (item, warehouse)
+# totals up to `as_of`, rolled forward periodically, so a balance can be
+# rebuilt from its snapshot plus only the movements posted after it.
+
+STOCK_SNAPSHOT_SECONDS = int(os.environ.get('STOCK_SNAPSHOT_SECONDS', '600'))
+# Movements younger than this are left for the next run so in-flight postings are not skipped
+STOCK_SNAPSHOT_LAG_SECONDS = 60
+STOCK_SNAPSHOT_STATE_KEY = "stock_snapshot_as_of"
+
+# Whether the deployment runs multi-document transactions (replica set or mongos)
+transaction_support: Dict[str, Optional[bool]] = {"supported": None}
+
+async def supports_transactions() -> bool:
+    if transaction_support['supported'] is None:
+        try:
+            transaction_support['supported'] = await repos.supports_transactions()
+        except Exception:
+            transaction_support['supported'] = False
+    return transaction_support['supported']
+
+def document_stock_lines(document: BaseModel, qty_field: str = "qty", sign: int = 1) -> List[Dict[str, Any]]:
+    """Signed stock lines a document posts: its `items`, or the single header line"""
+    rows = getattr(document, 'items', None) or [document]
+    return [{
+        "item_id": row.item_id, "item_name": row.item_name, "warehouse_id": document.warehouse_id,
+        "qty": sign * getattr(row, qty_field), "uom": row.uom
+    } for row in rows]
+
+def stock_balance_op(line: Dict[str, Any], now: datetime, upsert: bool = True) -> UpdateOne:
+    """Conditional $inc for one (item, warehouse) delta
+    
+    Outgoing deltas only match while the balance covers them, so the
+    insufficient-stock check and the decrement cannot interleave with another
+    posting. Incoming deltas upsert the balance row.
+    """
+    key = {"item_id": line['item_id'], "warehouse_id": line['warehouse_id']}
+    if line['qty'] < 0:
+        return UpdateOne({**key, "qty": {"$gte": -line['qty']}},
+                         {"$inc": {"qty": line['qty']}, "$set": {"last_updated": now}})
+    update = {"$inc": {"qty": line['qty']}, "$set": {"last_updated": now}}
+    if upsert:
+        update["$setOnInsert"] = {"id": str(uuid.uuid4()), "item_name": line['item_name'],
+                                  "warehouse_name": "", "uom": line['uom']}
+    return UpdateOne(key, update, upsert=upsert)
+
+async def write_stock_balances(deltas: List[Dict[str, Any]], session=None) -> List[Any]:
+    """Apply per-pair deltas with one bulk_write; returns the _ids of upserted rows
     
-    # Get type code prefix
-    type_code = await get_item_type_code(item_type)
+    Raises 400 when an outgoing delta found too little stock. Callers only pass
+    outgoing deltas inside a transaction, where raising rolls the others back.
+    """
+    now = datetime.now(timezone.utc)
+    ops = [stock_balance_op(line, now) for line in deltas]
+    try:
+        result = await repos.stock_balance.bulk_write(ops, ordered=False, session=session)
+        upserted = list(result.upserted_ids.values())
+        applied = result.matched_count + result.upserted_count
+    except BulkWriteError as exc:
+        errors = exc.details.get('writeErrors', [])
+        if session is not None or any(error.get('code') != 11000 for error in errors):
+            raise
+        # Concurrent postings created these rows first; apply them as plain increments
+        retry = await repos.stock_balance.bulk_write(
+            [stock_balance_op(deltas[error['index']], now, upsert=False) for error in errors], ordered=False
+        )
+        upserted = [item['_id'] for item in exc.details.get('upserted', [])]
+        applied = exc.details.get('nMatched', 0) + len(upserted) + retry.matched_count
+    if applied < len(ops):
+        raise HTTPException(status_code=400, detail="Insufficient stock")
+    return upserted
+
+async def name_new_balance_rows(row_ids: List[Any]):
+    """Fill warehouse_name on balance rows created by an upsert"""
+    rows = await repos.stock_balance.find({"_id": {"$in": row_ids}}, {"_id": 1, "warehouse_id": 1}).to_list(None)
+    warehouse_ids = list({row['warehouse_id'] for row in rows})
+    warehouses = await db.warehouses.find(
+        {"id": {"$in": warehouse_ids}}, {"_id": 0, "id": 1, "warehouse_name": 1}
+    ).to_list(None)
+    ops = [
+        UpdateMany({"_id": {"$in": row_ids}, "warehouse_id": warehouse['id']},
+                   {"$set": {"warehouse_name": warehouse['warehouse_name']}})
+        for warehouse in warehouses
+    ]
+    if ops:
+        await repos.stock_balance.bulk_write(ops, ordered=False)
+
+async def post_stock_document(collection, doc: Dict[str, Any], txn_type: str, txn_no: Optional[str],
+                              lines: List[Dict[str, Any]]) -> List[StockMovement]:
+    """Post a whole document: its row, one ledger row per line and the balance deltas
     
-    # Get next running number for this category
-    counter_key = f"item_code_{category_id}"
-    counter = await db.counters.find_one({"key": counter_key})
+    Lines are folded into one delta per (item, warehouse) and written with a
+    single bulk_write, so the number of round trips does not grow with the
+    line count. When the document takes stock out and the deployment supports
+    transactions, the three writes commit together. Otherwise (receipts, or a
+    standalone server) the outgoing deltas are applied one by one, and if any
+    later write fails the balance changes and ledger rows already written are
+    undone, so the ledger and balances still agree.
+    """
+    deltas: Dict[tuple, Dict[str, Any]] = {}
+    for line in lines:
+        key = (line['item_id'], line['warehouse_id'])
+        if key in deltas:
+            deltas[key]['qty'] += line['qty']
+        else:
+            deltas[key] = dict(line)
+    outgoing = [delta for delta in deltas.values() if delta['qty'] < 0]
+    incoming = [delta for delta in deltas.values() if delta['qty'] > 0]
+    
+    movements = [StockMovement(
+        txn_type=txn_type, txn_id=doc['id'], txn_no=txn_no, item_id=line['item_id'], item_name=line['item_name'],
+        warehouse_id=line['warehouse_id'], qty=line['qty'], uom=line['uom']
+    ) for line in lines]
+    movement_docs = [movement.model_dump() for movement in movements]
     
-    if not counter:
-        next_num = 1
-        await db.counters.insert_one({"key": counter_key, "value": 1})
+    async def write(session=None):
+        upserted = await write_stock_balances(outgoing + incoming, session)
+        await repos.stock_movements.insert_many(movement_docs, session=session)
+        await collection.insert_one(doc, session=session)
+        return upserted
+    
+    if outgoing and await supports_transactions():
+        async with await repos.start_session() as session:
+            upserted = await session.with_transaction(write)
     else:
-        next_num = counter['value'] + 1
-        await db.counters.update_one({"key": counter_key}, {"$set": {"value": next_num}})
+        now = datetime.now(timezone.utc)
+        applied = []
+        ledger_started = False
+        try:
+            for delta in outgoing:
+                result = await repos.stock_balance.bulk_write([stock_balance_op(delta, now)])
+                if result.matched_count == 0:
+                    raise HTTPException(status_code=400, detail="Insufficient stock")
+                applied.append(delta)
+            upserted = await write_stock_balances(incoming) if incoming else []
+            applied += incoming
+            ledger_started = True
+            await repos.stock_movements.insert_many(movement_docs)
+            await collection.insert_one(doc)
+        except BaseException:
+            # Whatever stopped the posting (stock, a failed write, cancellation), undo what was written
+            if applied:
+                await repos.stock_balance.bulk_write([
+                    UpdateOne({"item_id": delta['item_id'], "warehouse_id": delta['warehouse_id']},
+                              {"$inc": {"qty": -delta['qty']}})
+                    for delta in applied
+                ])
+            if ledger_started:
+                # insert_many stops at the failing row, leaving the ones before it
+                await repos.stock_movements.delete_many({"id": {"$in": [row['id'] for row in movement_docs]}})
+            raise
     
-    # Format: TYPE-SHORTCODE-0001
-    item_code = f"{type_code}-{category_short_code}-{str(next_num).zfill(4)}"
-    return item_code
+    if upserted:
+        await name_new_balance_rows(upserted)
+    await refresh_items_low_stock(list({line['item_id'] for line in lines}))
+    return movements
+
+async def derive_stock_qty(item_id: str, warehouse_id: str) -> float:
+    """Snapshot qty plus the movements posted after it"""
+    snapshot = await db.stock_snapshots.find_one({"item_id": item_id, "warehouse_id": warehouse_id}, {"_id": 0})
+    match: Dict[str, Any] = {"item_id": item_id, "warehouse_id": warehouse_id}
+    if snapshot:
+        match["posted_at"] = {"$gt": snapshot['as_of']}
+    totals = await repos.stock_movements.aggregate([
+        {"$match": match},
+        {"$group": {"_id": None, "qty": {"$sum": "$qty"}}}
+    ]).to_list(1)
+    return (snapshot['qty'] if snapshot else 0) + (totals[0]['qty'] if totals else 0)
+
+async def rebuild_stock_balance(item_id: str, warehouse_id: str) -> float:
+    qty = await derive_stock_qty(item_id, warehouse_id)
+    result = await repos.stock_balance.update_one(
+        {"item_id": item_id, "warehouse_id": warehouse_id},
+        {"$set": {"qty": qty, "last_updated": datetime.now(timezone.utc)}}
+    )
+    if result.matched_count == 0:
+        last = await repos.stock_movements.find_one(
+            {"item_id": item_id, "warehouse_id": warehouse_id}, {"_id": 0}, sort=[("posted_at", -1)]
+        )
+        if last:
+            warehouse = await db.warehouses.find_one({"id": warehouse_id}, {"_id": 0, "warehouse_name": 1})
+            await repos.stock_balance.insert_one({
+                "id": str(uuid.uuid4()),
+                "item_id": item_id,
+                "item_name": last['item_name'],
+                "warehouse_id": warehouse_id,
+                "warehouse_name": warehouse['warehouse_name'] if warehouse else "",
+                "qty": qty,
+                "uom": last['uom'],
+                "last_updated": datetime.now(timezone.utc)
+            })
+    await refresh_items_low_stock([item_id])
+    return qty
+
+async def roll_stock_snapshots():
+    """Fold movements posted since the previous run into the per-pair snapshots"""
+    state = await repos.counters.find_one({"key": STOCK_SNAPSHOT_STATE_KEY}, {"_id": 0})
+    since = state['value'] if state else None
+    # A run that died between its snapshot writes and the watermark update left some
+    # pairs ahead of the watermark; finish its window first so none is when the next starts
+    latest = await db.stock_snapshots.find_one({}, {"_id": 0, "as_of": 1}, sort=[("as_of", -1)])
+    if latest and (since is None or latest['as_of'] > since):
+        await roll_stock_window(since, latest['as_of'])
+        since = latest['as_of']
+    await roll_stock_window(since, datetime.now(timezone.utc) - timedelta(seconds=STOCK_SNAPSHOT_LAG_SECONDS))
+
+async def roll_stock_window(since: Optional[datetime], as_of: datetime):
+    """Add the movements in (since, as_of] to the snapshots, then move the watermark to as_of"""
+    window: Dict[str, Any] = {"$lte": as_of}
+    if since:
+        window["$gt"] = since
+    # Only snapshots still at or before `since` take the $inc. For a pair an interrupted
+    # run already rolled, the upsert hits the unique (item, warehouse) key and is skipped
+    not_rolled = {"as_of": {"$lte": since}} if since else {"as_of": {"$exists": False}}
+    
+    ops = []
+    totals = repos.stock_movements.aggregate([
+        {"$match": {"posted_at": window}},
+        {"$group": {"_id": {"item_id": "$item_id", "warehouse_id": "$warehouse_id"}, "qty": {"$sum": "$qty"}}}
+    ], allowDiskUse=True)
+    async for total in totals:
+        ops.append(UpdateOne(
+            {**total['_id'], **not_rolled},
+            {"$inc": {"qty": total['qty']}, "$set": {"as_of": as_of}},
+            upsert=True
+        ))
+        if len(ops) >= 1000:
+            await write_snapshot_batch(ops)
+            ops = []
+    if ops:
+        await write_snapshot_batch(ops)
+    await repos.counters.update_one({"key": STOCK_SNAPSHOT_STATE_KEY}, {"$set": {"value": as_of}}, upsert=True)
+
+async def write_snapshot_batch(ops: List[UpdateOne]):
+    try:
+        await db.stock_snapshots.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # Duplicate keys mean the pair was already rolled past this window
+        if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+            raise
+
+async def stock_snapshot_loop():
+    await datetime_migration_done.wait()
+    while True:
+        await asyncio.sleep(STOCK_SNAPSHOT_SECONDS)
+        try:
+            await roll_stock_snapshots()
+        except Exception as e:
+            logger.error(f"Stock snapshot roll-up failed: {e}")
+
+async def ensure_stock_ledger():
+    """Seed OPENING movements for balances that predate the ledger"""
+    if await repos.stock_movements.find_one({}, {"_id": 1}):
+        return
+    
+    posted_at = datetime.now(timezone.utc)
+    batch = []
+    async for stock in repos.stock_balance.find({"qty": {"$ne": 0}}, {"_id": 0}):
+        batch.append({
+            "id": str(uuid.uuid4()),
+            "txn_type": "OPENING",
+            "txn_id": None,
+            "txn_no": None,
+            "item_id": stock['item_id'],
+            "item_name": stock.get('item_name', ''),
+            "warehouse_id": stock['warehouse_id'],
+            "qty": stock['qty'],
+            "uom": stock.get('uom', ''),
+            "posted_at": posted_at
+        })
+        if len(batch) >= 1000:
+            await repos.stock_movements.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await repos.stock_movements.insert_many(batch, ordered=False)
+
+# ============ Report Filters ============
+# Transaction registers share one filter engine: a date range on the
+# document's timestamp plus equality filters, all pushed into the query; the
+# selective ones are backed by (field, timestamp, id) indexes so keyset pages
+# stay index-ordered.
+# item_id matches the header of single-line documents and any line of
+# multi-line ones.
+
+REPORT_FILTERS: Dict[str, Dict[str, Any]] = {
+    "issues": {"date_field": "issued_at", "fields": ["department", "warehouse_id"], "lines": True},
+    "returns": {"date_field": "returned_at", "fields": ["department", "warehouse_id", "condition"], "lines": False},
+    "grn": {"date_field": "received_at", "fields": ["supplier_id", "po_id", "warehouse_id", "status"], "lines": True},
+    "adjustments": {"date_field": "created_at", "fields": ["warehouse_id", "reason", "status"], "lines": True},
+}
+
+# Filters selective enough to lead a (field, timestamp, id) index. The others
+# (status, condition, reason, department, ...) match only a few values, so an
+# index led by them would cost every posting a write and save little; they are
+# applied on top of the (timestamp, id) pagination index instead.
+REPORT_INDEXED_FIELDS = ["warehouse_id", "item_id"]
+
+def report_date_range(start_date: Optional[str], end_date: Optional[str]) -> Dict[str, datetime]:
+    """Range filter on a stored timestamp from ISO date/datetime query params
+    
+    A bare end date includes that whole day.
+    """
+    bounds = {}
+    for name, value in (("start_date", start_date), ("end_date", end_date)):
+        if not value:
+            continue
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"{name} must be an ISO date or datetime")
+        parsed = parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+        if name == "start_date":
+            bounds["$gte"] = parsed
+        elif len(value) == 10:
+            bounds["$lt"] = parsed + timedelta(days=1)
+        else:
+            bounds["$lte"] = parsed
+    return bounds
+
+def report_query(collection: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                 item_id: Optional[str] = None, **filters: Optional[str]) -> Dict[str, Any]:
+    spec = REPORT_FILTERS[collection]
+    query: Dict[str, Any] = {field: value for field, value in filters.items() if value is not None}
+    if item_id:
+        query.update({"$or": [{"item_id": item_id}, {"items.item_id": item_id}]} if spec['lines'] else {"item_id": item_id})
+    date_range = report_date_range(start_date, end_date)
+    if date_range:
+        query[spec['date_field']] = date_range
+    return query
+
+# ============ Stock Ledger Report ============
+# Opening balance per (item, warehouse) is the sum of movements before the
+# range; the running balance inside it comes from $setWindowFields over the
+# (item_id, warehouse_id, posted_at) index and rows are streamed as they come.
+
+STOCK_LEDGER_COLUMNS = ["item_id", "item_name", "warehouse_id", "posted_at", "txn_type", "txn_no",
+                        "in_qty", "out_qty", "balance"]
+
+# $setWindowFields needs MongoDB 5.0; older servers get the running sum in Python
+ledger_window_support: Dict[str, Optional[bool]] = {"supported": None}
+
+async def stock_opening_balances(query: Dict[str, Any], before: Optional[datetime]) -> Dict[tuple, Dict[str, Any]]:
+    if not before:
+        return {}
+    totals = await report_repos.stock_movements.aggregate([
+        {"$match": {**query, "posted_at": {"$lt": before}}},
+        # Posting order, so $last picks the name on the latest movement
+        {"$sort": {"posted_at": 1, "id": 1}},
+        {"$group": {
+            "_id": {"item_id": "$item_id", "warehouse_id": "$warehouse_id"},
+            "item_name": {"$last": "$item_name"},
+            "qty": {"$sum": "$qty"}
+        }}
+    ], allowDiskUse=True).to_list(None)
+    return {(t['_id']['item_id'], t['_id']['warehouse_id']): t for t in totals}
+
+def stock_opening_row(pair: tuple, opening: Dict[tuple, Dict[str, Any]], posted_at: Optional[datetime], item_name: str):
+    return {
+        "item_id": pair[0], "item_name": item_name, "warehouse_id": pair[1], "posted_at": posted_at,
+        "txn_type": "OPENING_BALANCE", "txn_no": None, "in_qty": 0, "out_qty": 0,
+        "balance": opening[pair]['qty'] if pair in opening else 0
+    }
+
+async def stock_ledger_rows(query: Dict[str, Any], opening: Dict[tuple, Dict[str, Any]], start: Optional[datetime]):
+    """Yield an opening row then each movement with its running balance, per (item, warehouse)"""
+    running_balance = {"$setWindowFields": {
+        "partitionBy": {"item_id": "$item_id", "warehouse_id": "$warehouse_id"},
+        "sortBy": {"posted_at": 1, "id": 1},
+        "output": {"running_qty": {"$sum": "$qty", "window": {"documents": ["unbounded", "current"]}}}
+    }}
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"item_id": 1, "warehouse_id": 1, "posted_at": 1, "id": 1}},
+        running_balance,
+        {"$sort": {"item_id": 1, "warehouse_id": 1, "posted_at": 1, "id": 1}},
+        {"$project": {"_id": 0}}
+    ]
+    if ledger_window_support['supported'] is None:
+        # The stage is validated even when no document reaches it, so the probe reads nothing
+        try:
+            await report_repos.stock_movements.aggregate([{"$match": {"_id": None}}, running_balance]).to_list(1)
+            ledger_window_support['supported'] = True
+        except OperationFailure:
+            ledger_window_support['supported'] = False
+    in_database = ledger_window_support['supported']
+    if not in_database:
+        pipeline = [stage for stage in pipeline if stage is not running_balance]
+    
+    seen = set()
+    pair, running = None, 0
+    async for movement in report_repos.stock_movements.aggregate(pipeline, allowDiskUse=True, batchSize=EXPORT_BATCH_SIZE):
+        current = (movement['item_id'], movement['warehouse_id'])
+        if current != pair:
+            pair, running = current, 0
+            seen.add(pair)
+            yield stock_opening_row(pair, opening, start, movement['item_name'])
+        running = movement['running_qty'] if in_database else running + movement['qty']
+        qty = movement['qty']
+        yield {
+            "item_id": movement['item_id'], "item_name": movement['item_name'],
+            "warehouse_id": movement['warehouse_id'], "posted_at": movement['posted_at'],
+            "txn_type": movement['txn_type'], "txn_no": movement.get('txn_no'),
+            "in_qty": qty if qty > 0 else 0, "out_qty": -qty if qty < 0 else 0,
+            "balance": (opening[pair]['qty'] if pair in opening else 0) + running
+        }
+    # Pairs with stock but no movement inside the range still get their opening line
+    for other in sorted(set(opening) - seen):
+        yield stock_opening_row(other, opening, start, opening[other]['item_name'])
+
+# ============ Datetime Migration ============
+# Timestamps used to be stored as ISO strings and are now written as BSON
+# dates. Old rows are converted in the background, a batch at a time in _id
+# order, while the app keeps serving; until then the response models still
+# parse any string they meet.
+
+DATETIME_MIGRATION_BATCH_SIZE = 500
+
+# collection -> datetime fields; "parent.child" is a field inside an array of sub-documents
+DATETIME_FIELDS: Dict[str, List[str]] = {
+    "users": ["created_at"],
+    "item_categories": ["created_at"],
+    "items": ["created_at", "updated_at"],
+    "uoms": ["created_at"],
+    "suppliers": ["created_at"],
+    "warehouses": ["created_at"],
+    "bin_locations": ["created_at"],
+    "tax_hsn": ["created_at"],
+    "purchase_indents": ["created_at", "approved_at", "items.required_date"],
+    "purchase_orders": ["created_at", "approved_at"],
+    "quality_checks": ["inspected_at"],
+    "grn": ["received_at", "invoice_date"],
+    "stock_inward": ["created_at"],
+    "stock_transfer": ["created_at", "approved_at"],
+    "issues": ["issued_at"],
+    "returns": ["returned_at"],
+    "adjustments": ["created_at", "approved_at"],
+    "stock_balance": ["last_updated"],
+    "stock_movements": ["posted_at"],
+    "stock_snapshots": ["as_of"],
+    "dashboard_stats": ["reconciled_at"],
+    "counters": ["value"],  # the stock snapshot watermark; code counters are numeric
+}
+
+# Snapshot roll-ups compare as_of against posted_at, so they wait for the migration
+datetime_migration_done = asyncio.Event()
+
+def parse_stored_datetime(value: str):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed
+
+async def migrate_collection_datetimes(collection: str, fields: List[str]) -> int:
+    query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    projection = {field.split('.')[0]: 1 for field in fields}
+    last_id, converted = None, 0
+    while True:
+        batch_query = {"$and": [query, {"_id": {"$gt": last_id}}]} if last_id is not None else query
+        docs = await db[collection].find(batch_query, projection).sort("_id", 1) \
+            .limit(DATETIME_MIGRATION_BATCH_SIZE).to_list(DATETIME_MIGRATION_BATCH_SIZE)
+        if not docs:
+            return converted
+        last_id = docs[-1]['_id']
+        ops = []
+        for doc in docs:
+            # Match on the old values so a concurrent write to the row is never overwritten
+            match, updates = {"_id": doc['_id']}, {}
+            for field in fields:
+                if '.' in field:
+                    parent, child = field.split('.', 1)
+                    rows = doc.get(parent)
+                    if isinstance(rows, list) and any(isinstance(row, dict) and isinstance(row.get(child), str) for row in rows):
+                        match[parent] = rows
+                        updates[parent] = [
+                            {**row, child: parse_stored_datetime(row[child])}
+                            if isinstance(row, dict) and isinstance(row.get(child), str) else row
+                            for row in rows
+                        ]
+                elif isinstance(doc.get(field), str):
+                    match[field] = doc[field]
+                    updates[field] = parse_stored_datetime(doc[field])
+            ops.append(UpdateOne(match, {"$set": updates}))
+        result = await db[collection].bulk_write(ops, ordered=False)
+        converted += result.modified_count
+
+async def migrate_datetimes():
+    try:
+        for collection, fields in DATETIME_FIELDS.items():
+            converted = await migrate_collection_datetimes(collection, fields)
+            if converted:
+                logger.info(f"Converted {converted} {collection} rows to BSON datetimes")
+    except Exception as e:
+        logger.error(f"Datetime migration failed: {e}")
+    finally:
+        datetime_migration_done.set()
+
+# ============ Category Tree Index ============
+# Every category stores its materialized path in `ancestors` (root first, direct
+# parent last). Descendants of X are simply {"ancestors": X}, which is served by
+# a multikey index, so subtree checks and updates never scan the whole tree.
+
+async def get_category_ancestors(parent_id: Optional[str]) -> List[str]:
+    """Return the materialized path for a child of `parent_id`"""
+    if not parent_id:
+        return []
+    parent = await repos.item_categories.find_one({"id": parent_id}, {"_id": 0, "ancestors": 1})
+    if not parent:
+        return []
+    return parent.get('ancestors', []) + [parent_id]
+
+async def get_category_path(category_id: str, ancestors: List[str]) -> str:
+    """Build the 'Root > Child > Leaf' display path with one indexed query"""
+    ids = ancestors + [category_id]
+    docs = await repos.item_categories.find(
+        {"id": {"$in": ids}}, {"_id": 0, "id": 1, "name": 1, "category_name": 1}
+    ).to_list(len(ids))
+    names = {d['id']: d.get('category_name', d.get('name', '')) for d in docs}
+    return " > ".join(names[i] for i in ids if i in names)
+
+async def rebase_category_subtree(category_id: str, old_ancestors: List[str], new_ancestors: List[str], item_type: Optional[str] = None):
+    """Rewrite the materialized path of every descendant after a move"""
+    update: Dict[str, Any] = {
+        "ancestors": {"$concatArrays": [
+            new_ancestors,
+            {"$slice": ["$ancestors", len(old_ancestors), {"$size": "$ancestors"}]}
+        ]}
+    }
+    if item_type:
+        update["item_type"] = item_type
+        update["inventory_type"] = item_type
+    await repos.item_categories.update_many(
+        {"ancestors": category_id},
+        [{"$set": update}, {"$set": {"level": {"$size": "$ancestors"}}}]
+    )
+
+async def ensure_category_tree_index():
+    """Backfill `ancestors` for categories written before the tree index"""
+    if not await repos.item_categories.find_one({"ancestors": {"$exists": False}}, {"_id": 1}):
+        return
+
+    parents = {}
+    async for cat in repos.item_categories.find({}, {"_id": 0, "id": 1, "parent_category": 1}):
+        parents[cat['id']] = cat.get('parent_category')
+
+    ops = []
+    for cat_id in parents:
+        ancestors = []
+        parent_id = parents[cat_id]
+        while parent_id and parent_id in parents and parent_id not in ancestors and parent_id != cat_id:
+            ancestors.insert(0, parent_id)
+            parent_id = parents[parent_id]
+        ops.append(UpdateOne({"id": cat_id}, {"$set": {"ancestors": ancestors, "level": len(ancestors)}}))
+        if len(ops) >= 1000:
+            await repos.item_categories.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await repos.item_categories.bulk_write(ops, ordered=False)
+    invalidate_category_cache()
+    logger.info(f"Backfilled category tree index for {len(parents)} categories")
+
+# ============ Item Search Index ============
+# Items carry `search_tokens`: every prefix of every word of item_name and
+# item_code, plus prefixes of the full code. A search is then an $all match on
+# a multikey index instead of an unanchored, case-insensitive $regex scan.
+# Matching is by word prefix ("cott" finds "Cotton Tape"), not arbitrary infix.
+
+SEARCH_MAX_PREFIX = 20
+SEARCH_CANDIDATES = 200
+ITEM_PROJECTION = {"_id": 0, "search_tokens": 0, "low_stock_alert": 0}
+
+def tokenize_search_text(text: str) -> List[str]:
+    return [w for w in re.split(r'[^0-9a-z]+', (text or '').lower()) if w]
+
+def build_search_tokens(item_name: str, item_code: str) -> List[str]:
+    words = tokenize_search_text(item_name) + tokenize_search_text(item_code)
+    code = (item_code or '').lower()
+    if code:
+        words.append(code)
+    tokens = set()
+    for word in words:
+        for i in range(1, min(len(word), SEARCH_MAX_PREFIX) + 1):
+            tokens.add(word[:i])
+    return sorted(tokens)
+
+def rank_search_hit(item: Dict[str, Any], q: str) -> tuple:
+    code = (item.get('item_code') or '').lower()
+    name = (item.get('item_name') or '').lower()
+    if code == q:
+        tier = 0
+    elif code.startswith(q):
+        tier = 1
+    elif name.startswith(q):
+        tier = 2
+    else:
+        tier = 3
+    return (tier, code, name)
+
+async def ensure_item_search_index():
+    """Backfill search tokens for items written before them"""
+    ops = []
+    async for item in repos.items.find({"search_tokens": {"$exists": False}}, {"_id": 0, "id": 1, "item_name": 1, "item_code": 1}):
+        tokens = build_search_tokens(item.get('item_name'), item.get('item_code'))
+        ops.append(UpdateOne({"id": item['id']}, {"$set": {"search_tokens": tokens}}))
+        if len(ops) >= 1000:
+            await repos.items.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await repos.items.bulk_write(ops, ordered=False)
+
+# ============ Dashboard Stats Counters ============
+# /dashboard/stats reads one precomputed document. Write paths adjust its
+# counters with $inc as they go, and a periodic full reconcile corrects any
+# drift (e.g. writes made outside the API). Items carry a `low_stock_alert`
+# flag so the low-stock counter only moves when an item crosses its reorder level.
+
+DASHBOARD_STATS_ID = "global"
+DASHBOARD_RECONCILE_SECONDS = int(os.environ.get('DASHBOARD_RECONCILE_SECONDS', '300'))
+
+# Appends current_stock (sum of stock_balance.qty across warehouses) to item docs
+STOCK_ON_HAND_STAGES = [
+    {"$lookup": {
+        "from": "stock_balance",
+        "localField": "id",
+        "foreignField": "item_id",
+        "as": "balances"
+    }},
+    {"$set": {"current_stock": {"$sum": "$balances.qty"}}},
+    {"$project": {"balances": 0}},
+]
+
+async def bump_dashboard_stat(field: str, delta: int):
+    await db.dashboard_stats.update_one({"id": DASHBOARD_STATS_ID}, {"$inc": {field: delta}}, upsert=True)
+
+async def refresh_items_low_stock(item_ids: List[str]):
+    """Re-evaluate the low-stock flags of some items and move the counter by those that flipped"""
+    items = await repos.items.find(
+        {"id": {"$in": item_ids}}, {"_id": 0, "id": 1, "status": 1, "reorder_level": 1}
+    ).to_list(None)
+    if not items:
+        return
+    totals = await repos.stock_balance.aggregate([
+        {"$match": {"item_id": {"$in": item_ids}}},
+        {"$group": {"_id": "$item_id", "qty": {"$sum": "$qty"}}}
+    ]).to_list(None)
+    stock = {total['_id']: total['qty'] for total in totals}
+    flags = {True: [], False: []}
+    for item in items:
+        is_low = item.get('status') == "Active" and stock.get(item['id'], 0) <= item.get('reorder_level', 0)
+        flags[is_low].append(item['id'])
+    # Conditional writes so concurrent refreshes of the same item count the flip once
+    for is_low, ids in flags.items():
+        if not ids:
+            continue
+        result = await repos.items.update_many(
+            {"id": {"$in": ids}, "low_stock_alert": {"$ne": is_low}},
+            {"$set": {"low_stock_alert": is_low}}
+        )
+        if result.modified_count:
+            await bump_dashboard_stat("low_stock_alerts", result.modified_count if is_low else -result.modified_count)
+
+async def reconcile_dashboard_stats() -> Dict[str, Any]:
+    """Recompute every flag and counter from scratch"""
+    # Only items whose stored flag disagrees with their stock are rewritten
+    ops = []
+    drifted = repos.items.aggregate([
+        *STOCK_ON_HAND_STAGES,
+        {"$project": {"_id": 0, "id": 1, "low_stock_alert": {"$ifNull": ["$low_stock_alert", False]}, "is_low": {"$and": [
+            {"$eq": ["$status", "Active"]},
+            {"$lte": ["$current_stock", {"$ifNull": ["$reorder_level", 0]}]}
+        ]}}},
+        {"$match": {"$expr": {"$ne": ["$low_stock_alert", "$is_low"]}}}
+    ], allowDiskUse=True)
+    async for item in drifted:
+        ops.append(UpdateOne({"id": item['id']}, {"$set": {"low_stock_alert": item['is_low']}}))
+        if len(ops) >= 1000:
+            await repos.items.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await repos.items.bulk_write(ops, ordered=False)
+    
+    stats = {
+        "total_items": await repos.items.count_documents({"status": "Active"}),
+        "total_suppliers": await db.suppliers.count_documents({"status": "Active"}),
+        "pending_pos": await db.purchase_orders.count_documents({"status": ApprovalStatus.PENDING}),
+        "low_stock_alerts": await repos.items.count_documents({"low_stock_alert": True}),
+        "reconciled_at": datetime.now(timezone.utc),
+    }
+    await db.dashboard_stats.update_one({"id": DASHBOARD_STATS_ID}, {"$set": stats}, upsert=True)
+    return stats
+
+async def dashboard_reconcile_loop():
+    while True:
+        try:
+            await reconcile_dashboard_stats()
+        except Exception as e:
+            logger.error(f"Dashboard stats reconcile failed: {e}")
+        await asyncio.sleep(DASHBOARD_RECONCILE_SECONDS)
+
+# ============ Category Tree Cache ============
+# The category tree is read by every item form but written rarely, so the
+# serialized responses are kept in memory. Every write path bumps `version`;
+# the next read rebuilds the cache and clients revalidate via the ETag (the
+# per-process epoch keeps ETags from colliding across restarts).
+
+category_cache: Dict[str, Any] = {"epoch": uuid.uuid4().hex[:8], "version": 0, "loaded_version": -1}
+category_list_adapter = TypeAdapter(List[ItemCategory])
+
+def invalidate_category_cache():
+    category_cache['version'] += 1
+    category_code_info.clear()
+
+async def get_category_cache() -> Dict[str, Any]:
+    version = category_cache['version']
+    if category_cache['loaded_version'] == version:
+        return category_cache
+
+    categories = await repos.item_categories.find({}, {"_id": 0, "ancestors": 0}).to_list(None)
+    parent_ids = {c['parent_category'] for c in categories if c.get('parent_category')}
+
+    leaf = [{**cat, 'is_leaf': cat['id'] not in parent_ids} for cat in categories]
+    snapshot = {
+        "etag": f'W/"categories-{category_cache["epoch"]}-{version}"',
+        "categories_body": category_list_adapter.dump_json(category_list_adapter.validate_python(categories)),
+        "leaf_body": json.dumps(jsonable_encoder(leaf)).encode('utf-8'),
+    }
+    # A write may have landed while we were loading; only publish if it did not
+    if category_cache['version'] == version:
+        category_cache.update(snapshot, loaded_version=version)
+    else:
+        snapshot['etag'] = None
+    return snapshot
+
+def cached_category_response(request: Request, cache: Dict[str, Any], body_key: str) -> Response:
+    etag = cache['etag']
+    if etag and request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    headers = {"ETag": etag} if etag else {}
+    return Response(content=cache[body_key], media_type="application/json", headers=headers)
+
+# ============ Keyset Pagination ============
+# List routes page with an opaque cursor over (sort key, id) instead of a hard
+# to_list(1000) cap. The next cursor is returned in the X-Next-Cursor header so
+# the response body stays a plain list for existing clients.
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 5000
+
+# collection -> sort key used by its list route; (sort key, id) is indexed
+PAGINATED_COLLECTIONS = {
+    "users": "created_at",
+    "items": "created_at",
+    "uoms": "created_at",
+    "suppliers": "created_at",
+    "warehouses": "created_at",
+    "bin_locations": "created_at",
+    "tax_hsn": "created_at",
+    "purchase_indents": "created_at",
+    "purchase_orders": "created_at",
+    "grn": "received_at",
+    "quality_checks": "inspected_at",
+    "stock_inward": "created_at",
+    "stock_transfer": "created_at",
+    "issues": "issued_at",
+    "returns": "returned_at",
+    "adjustments": "created_at",
+    "stock_balance": "id",
+    "stock_movements": "posted_at",
+}
+
+# Ascending sort order of the BSON types rows here can hold; null and missing sort before all of them
+BSON_SORT_ORDER = ["number", "string", "object", "array", "objectId", "bool", "date"]
+
+def bson_type_alias(value: Any) -> str:
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, datetime):
+        return "date"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, list):
+        return "array"
+    return "objectId"
+
+def sorts_after(field: str, value: Any) -> Dict[str, Any]:
+    """Rows whose `field` comes after `value` in an ascending sort, including rows of a later BSON type
+    
+    $gt only matches values of its operand's own type, so a cursor that stopped
+    on a string or null (a timestamp the datetime migration could not parse, or
+    none at all) would otherwise end the listing before the dates.
+    """
+    if value is None:
+        return {field: {"$ne": None}}
+    later = BSON_SORT_ORDER[BSON_SORT_ORDER.index(bson_type_alias(value)) + 1:]
+    if not later:
+        return {field: {"$gt": value}}
+    return {"$or": [{field: {"$gt": value}}, {field: {"$type": later}}]}
+
+def encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+async def find_page(collection, query: Dict[str, Any], response: Response, cursor: Optional[str], limit: int,
+                    sort_key: str = "created_at", projection: Optional[Dict[str, Any]] = None) -> List[Dict]:
+    """Fetch one page of `query` ordered by (sort_key, id) and set X-Next-Cursor"""
+    keys = [sort_key] if sort_key in ("id", "_id") else [sort_key, "id"]
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(keys):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if len(keys) == 1:
+            keyset = {keys[0]: {"$gt": values[0]}}
+        else:
+            keyset = {"$or": [
+                sorts_after(keys[0], values[0]),
+                {keys[0]: values[0], keys[1]: {"$gt": values[1]}}
+            ]}
+        query = {"$and": [query, keyset]} if query else keyset
+
+    if projection is None:
+        projection = {"_id": 0}
+    if "_id" in keys:
+        projection = {k: v for k, v in projection.items() if k != "_id"} or None
+
+    docs = await collection.find(query, projection).sort([(k, 1) for k in keys]).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor([last.get(k) for k in keys])
+    if "_id" in keys:
+        for doc in docs:
+            doc.pop("_id", None)
+    return docs
+
+# ============ Index Registry ============
+# Every index the queries above rely on, declared in one place and ensured in
+# the background at startup. create_index is a no-op when the index already
+# exists, so this runs on every start. A unique index that existing duplicate
+# rows prevent from building is created non-unique and logged instead.
+
+# Collections whose rows are addressed by their `id` field
+ID_COLLECTIONS = [
+    "users", "item_categories", "items", "uoms", "suppliers", "warehouses", "bin_locations", "tax_hsn",
+    "purchase_indents", "purchase_orders", "grn", "quality_checks", "stock_inward", "stock_transfer",
+    "issues", "returns", "adjustments", "stock_balance", "stock_movements", "dashboard_stats",
+]
+
+INDEX_REGISTRY: List[Dict[str, Any]] = [
+    {"collection": "users", "keys": [("email", 1)], "unique": True},
+    {"collection": "item_categories", "keys": [("ancestors", 1)]},
+    {"collection": "item_categories", "keys": [("parent_category", 1)]},
+    {"collection": "items", "keys": [("item_code", 1)], "unique": True},
+    {"collection": "items", "keys": [("search_tokens", 1)]},
+    {"collection": "items", "keys": [("category_id", 1), ("item_name", 1)]},
+    {"collection": "items", "keys": [("category_id", 1), ("created_at", 1), ("id", 1)]},
+    {"collection": "items", "keys": [("item_type", 1), ("is_active", 1), ("created_at", 1), ("id", 1)]},
+    {"collection": "items", "keys": [("is_component", 1), ("is_active", 1), ("created_at", 1), ("id", 1)]},
+    {"collection": "items", "keys": [("is_finished_good", 1), ("is_active", 1), ("created_at", 1), ("id", 1)]},
+    {"collection": "items", "keys": [("low_stock_alert", 1)]},
+    {"collection": "purchase_orders", "keys": [("status", 1), ("created_at", 1), ("id", 1)]},
+    {"collection": "number_series", "keys": [("series_type", 1)], "unique": True},
+    {"collection": "counters", "keys": [("key", 1)], "unique": True},
+    # Serves the per-item balance joins ($lookup on item_id) as well as postings;
+    # uniqueness lets concurrent upserting postings converge on one row
+    {"collection": "stock_balance", "keys": [("item_id", 1), ("warehouse_id", 1)], "unique": True},
+    {"collection": "stock_movements", "keys": [("item_id", 1), ("warehouse_id", 1), ("posted_at", 1)]},
+    {"collection": "stock_snapshots", "keys": [("item_id", 1), ("warehouse_id", 1)], "unique": True},
+    # Finds the as_of of a roll-up that stopped before moving its watermark
+    {"collection": "stock_snapshots", "keys": [("as_of", 1)]},
+]
+
+def index_specs() -> List[Dict[str, Any]]:
+    """The registry plus the id, keyset pagination and report filter indexes derived from their tables"""
+    specs = [{"collection": c, "keys": [("id", 1)], "unique": True} for c in ID_COLLECTIONS] + INDEX_REGISTRY
+    for collection, sort_key in PAGINATED_COLLECTIONS.items():
+        keys = [sort_key] if sort_key == "id" else [sort_key, "id"]
+        specs.append({"collection": collection, "keys": [(k, 1) for k in keys]})
+    for collection, spec in REPORT_FILTERS.items():
+        fields = REPORT_INDEXED_FIELDS + (["items.item_id"] if spec['lines'] else [])
+        for field in fields:
+            specs.append({"collection": collection, "keys": [(field, 1), (spec['date_field'], 1), ("id", 1)]})
+    unique: Dict[tuple, Dict[str, Any]] = {}
+    for spec in specs:
+        key = (spec['collection'], tuple(spec['keys']))
+        if key not in unique or spec.get('unique'):
+            unique[key] = spec
+    return list(unique.values())
+
+async def ensure_index(spec: Dict[str, Any]):
+    collection = db[spec['collection']]
+    try:
+        await collection.create_index(spec['keys'], unique=spec.get('unique', False))
+    except OperationFailure as e:
+        # Only duplicate rows fall back to a plain index; a name or options
+        # conflict (IndexOptionsConflict, IndexKeySpecsConflict) would just fail again
+        if not spec.get('unique') or e.code != 11000:
+            raise
+        logger.error(f"{spec['collection']} has duplicate {[k for k, _ in spec['keys']]} rows, unique index not created: {e}")
+        await collection.create_index(spec['keys'])
+
+async def ensure_index_registry():
+    for spec in index_specs():
+        try:
+            await ensure_index(spec)
+        except Exception as e:
+            logger.error(f"Could not create index {spec['keys']} on {spec['collection']}: {e}")
+
+async def index_report() -> List[Dict[str, Any]]:
+    """Per collection: declared indexes that are missing or not unique, and present ones that are undeclared or unused
+    
+    Usage comes from $indexStats and counts accesses since the server last
+    started; it is omitted when the server or the user's role does not allow it.
+    """
+    declared: Dict[str, set] = {}
+    declared_unique: Dict[str, set] = {}
+    for spec in index_specs():
+        declared.setdefault(spec['collection'], set()).add(tuple(spec['keys']))
+        if spec.get('unique'):
+            declared_unique.setdefault(spec['collection'], set()).add(tuple(spec['keys']))
+    collections = sorted(set(declared) | set(await db.list_collection_names()))
+    
+    report = []
+    for name in collections:
+        info = await db[name].index_information()
+        present = {tuple(index['key']): index_name for index_name, index in info.items()}
+        try:
+            usage = {stat['name']: stat['accesses']['ops'] async for stat in db[name].aggregate([{"$indexStats": {}}])}
+        except OperationFailure:
+            usage = None
+        wanted = declared.get(name, set())
+        report.append({
+            "collection": name,
+            "missing": [[k for k, _ in keys] for keys in sorted(wanted - set(present))],
+            # Declared unique but built without the constraint, i.e. duplicates need cleaning up
+            "not_unique": [[k for k, _ in keys] for keys in sorted(declared_unique.get(name, set()) & set(present))
+                           if not info[present[keys]].get('unique')],
+            "undeclared": sorted(index_name for keys, index_name in present.items()
+                                 if keys not in wanted and index_name != "_id_"),
+            "unused": None if usage is None else sorted(
+                index_name for index_name in present.values() if index_name != "_id_" and not usage.get(index_name)
+            ),
+        })
+    return report
+
+# ============ Fast List Responses ============
+# List routes normally hand rows to FastAPI, which validates them against the
+# response_model and encodes the result again with the json module.
+# FAST_LIST_RESPONSES=true has a TypeAdapter built once per response model
+# validate and encode the page in pydantic-core instead; the JSON is the same,
+# including model defaults and the dropping of fields the model doesn't declare.
+# Routes without a response_model are left to FastAPI's own encoder.
+
+FAST_LIST_RESPONSES = os.environ.get('FAST_LIST_RESPONSES', 'false').lower() == 'true'
+list_adapters: Dict[Any, TypeAdapter] = {}
+
+def list_response(rows: List[Dict[str, Any]], response: Response, model: Any = None):
+    if not FAST_LIST_RESPONSES or model is None:
+        return rows
+    adapter = list_adapters.get(model)
+    if adapter is None:
+        adapter = list_adapters[model] = TypeAdapter(List[model])
+    try:
+        page = adapter.validate_python(rows)
+    except ValidationError as e:
+        raise ResponseValidationError(errors=e.errors(), body=rows)
+    # Carry over headers set on the injected response, e.g. X-Next-Cursor
+    return Response(content=adapter.dump_json(page), media_type="application/json",
+                    headers=dict(response.headers))
 
 # ============ Authentication Routes ============
 # ============ Authentication Routes (DISABLED) ============
@@ -612,77 +1875,50 @@ async def generate_next_item_code(category_id: str) -> str:
 #     return User(**user_doc)
 
 @api_router.get("/users", response_model=List[User])
-async def get_users():
-    users = await db.users.find({}, {"_id": 0, "password_hash": 0}).to_list(1000)
-    for user in users:
-        if isinstance(user['created_at'], str):
-            user['created_at'] = datetime.fromisoformat(user['created_at'])
-    return users
+async def get_users(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    users = await find_page(db.users, {}, response, cursor, limit, "created_at", {"_id": 0, "password_hash": 0})
+    return list_response(users, response, User)
 
 # ============ Item Category Routes ============
 @api_router.post("/masters/item-categories", response_model=ItemCategory)
 async def create_item_category(category: ItemCategory):
     doc = category.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.item_categories.insert_one(doc)
+    doc['ancestors'] = await get_category_ancestors(category.parent_category)
+    await repos.item_categories.insert_one(doc)
+    invalidate_category_cache()
     return category
 
 @api_router.get("/masters/item-categories", response_model=List[ItemCategory])
-async def get_item_categories():
-    categories = await db.item_categories.find({}, {"_id": 0}).to_list(1000)
-    for cat in categories:
-        if isinstance(cat['created_at'], str):
-            cat['created_at'] = datetime.fromisoformat(cat['created_at'])
-    # Debug: Log categories with UOMs
-    cats_with_uoms = [c for c in categories if c.get('allowed_uoms')]
-    if cats_with_uoms:
-        print(f"📤 Backend GET: Found {len(cats_with_uoms)} categories with UOMs")
-        for c in cats_with_uoms[:3]:  # Show first 3
-            print(f"  - {c.get('name')}: allowed_uoms = {c.get('allowed_uoms')}")
-    return categories
+async def get_item_categories(request: Request):
+    cache = await get_category_cache()
+    return cached_category_response(request, cache, 'categories_body')
 
 @api_router.get("/masters/item-categories/leaf-only")
-async def get_leaf_categories():
+async def get_leaf_categories(request: Request):
     """Get only leaf categories (categories without children) - MUST come before {category_id} route"""
-    all_categories = await db.item_categories.find({}, {"_id": 0}).to_list(1000)
-    
-    # Get all parent category IDs
-    parent_ids = set()
-    for cat in all_categories:
-        if cat.get('parent_category'):
-            parent_ids.add(cat['parent_category'])
-    
-    # Add is_leaf flag to all categories
-    result = []
-    for cat in all_categories:
-        cat_copy = cat.copy()
-        cat_copy['is_leaf'] = cat['id'] not in parent_ids
-        if isinstance(cat_copy.get('created_at'), str):
-            cat_copy['created_at'] = datetime.fromisoformat(cat_copy['created_at'])
-        result.append(cat_copy)
-    
-    return result
+    cache = await get_category_cache()
+    return cached_category_response(request, cache, 'leaf_body')
 
 @api_router.get("/masters/item-categories/{category_id}", response_model=ItemCategory)
 async def get_item_category(category_id: str):
-    category = await db.item_categories.find_one({"id": category_id}, {"_id": 0})
+    category = await repos.item_categories.find_one({"id": category_id}, {"_id": 0})
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
-    if isinstance(category['created_at'], str):
-        category['created_at'] = datetime.fromisoformat(category['created_at'])
     return ItemCategory(**category)
 
 @api_router.put("/masters/item-categories/{category_id}", response_model=ItemCategory)
 async def update_item_category(category_id: str, category: ItemCategory):
     doc = category.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    print(f"🔧 Backend: Updating category {category_id}")
-    print(f"📦 Backend: allowed_uoms in request = {category.allowed_uoms}")
-    print(f"💾 Backend: Document to save = {doc.get('allowed_uoms')}")
-    await db.item_categories.update_one({"id": category_id}, {"$set": doc})
-    # Verify what was saved
-    saved = await db.item_categories.find_one({"id": category_id}, {"_id": 0})
-    print(f"✅ Backend: Saved allowed_uoms = {saved.get('allowed_uoms') if saved else 'NOT FOUND'}")
+    existing = await repos.item_categories.find_one({"id": category_id}, {"_id": 0, "parent_category": 1, "ancestors": 1})
+    if existing and existing.get('parent_category') != category.parent_category:
+        old_ancestors = existing.get('ancestors', [])
+        doc['ancestors'] = await get_category_ancestors(category.parent_category)
+        if category_id in doc['ancestors']:
+            raise HTTPException(status_code=400, detail="Cannot move category to its own descendant. This would create a circular reference.")
+        doc['level'] = len(doc['ancestors'])
+        await rebase_category_subtree(category_id, old_ancestors, doc['ancestors'])
+    await repos.item_categories.update_one({"id": category_id}, {"$set": doc})
+    invalidate_category_cache()
     return category
 
 # Pydantic model for bulk update request
@@ -715,100 +1951,72 @@ async def move_category(
     """
     try:
         # Get the category to move
-        category = await db.item_categories.find_one({"id": request.category_id}, {"_id": 0})
+        category = await repos.item_categories.find_one({"id": request.category_id}, {"_id": 0})
         if not category:
             raise HTTPException(status_code=404, detail="Category not found")
         
-        # Fetch all categories to perform validation
-        all_categories = await db.item_categories.find({}, {"_id": 0}).to_list(1000)
-        
-        # Helper function to get all descendants
-        def get_descendants(cat_id: str, categories: List[Dict]) -> List[str]:
-            descendants = []
-            children = [c for c in categories if c.get('parent_category') == cat_id]
-            for child in children:
-                descendants.append(child['id'])
-                descendants.extend(get_descendants(child['id'], categories))
-            return descendants
-        
-        # Validation 1: Prevent circular reference (can't move to own descendant)
-        if request.new_parent_id:
-            descendant_ids = get_descendants(request.category_id, all_categories)
-            if request.new_parent_id in descendant_ids:
-                raise HTTPException(
-                    status_code=400, 
-                    detail="Cannot move category to its own descendant. This would create a circular reference."
-                )
-            
-            # Validation 2: Prevent moving to self
-            if request.new_parent_id == request.category_id:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Cannot move category to itself."
-                )
+        # Validation 1: Prevent moving to self
+        if request.new_parent_id == request.category_id:
+            raise HTTPException(
+                status_code=400,
+                detail="Cannot move category to itself."
+            )
         
         # Get new parent and determine new item_type
         new_parent = None
         new_item_type = category.get('item_type', 'RM')
         
         if request.new_parent_id:
-            new_parent = await db.item_categories.find_one({"id": request.new_parent_id}, {"_id": 0})
+            new_parent = await repos.item_categories.find_one({"id": request.new_parent_id}, {"_id": 0})
             if not new_parent:
                 raise HTTPException(status_code=404, detail="New parent category not found")
             new_item_type = new_parent.get('item_type', 'RM')
+            
+            # Validation 2: Prevent circular reference (can't move to own descendant)
+            if request.category_id in new_parent.get('ancestors', []):
+                raise HTTPException(
+                    status_code=400, 
+                    detail="Cannot move category to its own descendant. This would create a circular reference."
+                )
         
         # Calculate impact
-        descendant_ids = get_descendants(request.category_id, all_categories)
-        affected_children_count = len(descendant_ids)
+        affected_children_count = await repos.item_categories.count_documents({"ancestors": request.category_id})
         
         # Count items in this category
-        items_count = await db.items.count_documents({"item_category_id": request.category_id})
+        items_count = await repos.items.count_documents({"item_category_id": request.category_id})
         
-        # Build category path for display
-        def get_category_path(cat_id: str, categories: List[Dict]) -> str:
-            cat = next((c for c in categories if c['id'] == cat_id), None)
-            if not cat:
-                return ""
-            path = cat.get('category_name', cat.get('name', ''))
-            if cat.get('parent_category'):
-                parent_path = get_category_path(cat['parent_category'], categories)
-                if parent_path:
-                    path = f"{parent_path} > {path}"
-            return path
+        old_ancestors = category.get('ancestors', [])
+        new_ancestors = new_parent.get('ancestors', []) + [request.new_parent_id] if new_parent else []
         
-        old_path = get_category_path(request.category_id, all_categories)
+        old_path = await get_category_path(request.category_id, old_ancestors)
         new_parent_name = new_parent.get('category_name', new_parent.get('name', 'Root Level')) if new_parent else 'Root Level'
         new_path = f"{new_parent_name} > {category.get('category_name', category.get('name', ''))}"
         
-        # Update the category's parent
+        # Update the category's parent and its place in the tree index
         update_data = {
             "parent_category": request.new_parent_id,
             "item_type": new_item_type,
-            "inventory_type": new_item_type
+            "inventory_type": new_item_type,
+            "ancestors": new_ancestors,
+            "level": len(new_ancestors)
         }
         
-        # Recalculate level
-        if request.new_parent_id and new_parent:
-            new_level = new_parent.get('level', 0) + 1
-            update_data["level"] = new_level
-        else:
-            update_data["level"] = 0
-        
-        await db.item_categories.update_one(
+        await repos.item_categories.update_one(
             {"id": request.category_id},
             {"$set": update_data}
         )
         
-        # Update all descendants' item_type if it changed
-        if descendant_ids and new_item_type != category.get('item_type'):
-            await db.item_categories.update_many(
-                {"id": {"$in": descendant_ids}},
-                {"$set": {
-                    "item_type": new_item_type,
-                    "inventory_type": new_item_type
-                }}
+        # Rebase all descendants, updating their item_type if it changed
+        if affected_children_count:
+            await rebase_category_subtree(
+                request.category_id,
+                old_ancestors,
+                new_ancestors,
+                new_item_type if new_item_type != category.get('item_type') else None
             )
         
+        invalidate_category_cache()
+        
         return MoveCategoryResponse(
             success=True,
             message=f"Category moved successfully from '{old_path}' to '{new_path}'",
@@ -831,13 +2039,14 @@ async def bulk_update_item_type(
 ):
     """Update item_type for multiple categories without affecting other fields"""
     try:
-        result = await db.item_categories.update_many(
+        result = await repos.item_categories.update_many(
             {"id": {"$in": request.category_ids}},
             {"$set": {
                 "item_type": request.item_type,
                 "inventory_type": request.item_type
             }}
         )
+        invalidate_category_cache()
         return {
             "updated_count": result.modified_count,
             "item_type": request.item_type
@@ -852,30 +2061,198 @@ async def patch_item_category(category_id: str, updates: Dict[str, Any]):
         raise HTTPException(status_code=400, detail="No updates provided")
     
     # Check if category exists
-    existing = await db.item_categories.find_one({"id": category_id}, {"_id": 0})
+    existing = await repos.item_categories.find_one({"id": category_id}, {"_id": 0})
     if not existing:
         raise HTTPException(status_code=404, detail="Category not found")
     
+    # Keep the tree index in step when the parent changes
+    if 'parent_category' in updates and updates['parent_category'] != existing.get('parent_category'):
+        new_ancestors = await get_category_ancestors(updates['parent_category'])
+        if category_id in new_ancestors or updates['parent_category'] == category_id:
+            raise HTTPException(status_code=400, detail="Cannot move category to its own descendant. This would create a circular reference.")
+        updates['ancestors'] = new_ancestors
+        updates['level'] = len(new_ancestors)
+        await rebase_category_subtree(category_id, existing.get('ancestors', []), new_ancestors)
+    
     # Update only the provided fields
-    result = await db.item_categories.update_one(
+    result = await repos.item_categories.update_one(
         {"id": category_id},
         {"$set": updates}
     )
     
     if result.modified_count == 0:
         return {"message": "No changes made", "category_id": category_id}
+    invalidate_category_cache()
     
     # Return updated category
-    updated = await db.item_categories.find_one({"id": category_id}, {"_id": 0})
+    updated = await repos.item_categories.find_one({"id": category_id}, {"_id": 0})
     return updated
 
 @api_router.delete("/masters/item-categories/{category_id}")
 async def delete_item_category(category_id: str):
-    result = await db.item_categories.delete_one({"id": category_id})
+    result = await repos.item_categories.delete_one({"id": category_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Category not found")
+    # Drop the deleted node from its descendants' materialized paths
+    await repos.item_categories.update_many(
+        {"ancestors": category_id},
+        [{"$set": {"ancestors": {"$filter": {"input": "$ancestors", "cond": {"$ne": ["$$this", category_id]}}}}},
+         {"$set": {"level": {"$size": "$ancestors"}}}]
+    )
+    invalidate_category_cache()
     return {"message": "Category deleted successfully"}
 
+# ============ Bulk Item Import ============
+IMPORT_BATCH_SIZE = 1000
+
+class ItemImportContext:
+    """Lookups loaded once per import and shared by every batch"""
+    def __init__(self, category_codes: Dict[str, str], uom_names: set):
+        self.category_codes = category_codes
+        self.uom_names = uom_names
+        self.seen_names: set = set()
+        self.inserted = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def fail(self, row_no: int, message: str):
+        self.errors.append({"row": row_no, "error": message})
+
+def read_import_rows(upload: UploadFile, fmt: str):
+    """Yield (row_no, dict) from a CSV or NDJSON upload without loading it whole"""
+    text = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    if fmt == "csv":
+        for row_no, row in enumerate(csv.DictReader(text), start=1):
+            yield row_no, {k.strip(): v.strip() for k, v in row.items() if k and v is not None and v.strip() != ''}
+    else:
+        for row_no, line in enumerate(text, start=1):
+            if line.strip():
+                try:
+                    yield row_no, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield row_no, e
+
+async def import_item_batch(batch: List[tuple], ctx: ItemImportContext):
+    valid = []
+    for row_no, row in batch:
+        if isinstance(row, Exception) or not isinstance(row, dict):
+            ctx.fail(row_no, f"Invalid row: {row}")
+            continue
+        if not row.get('category_id') and row.get('category_code'):
+            row['category_id'] = ctx.category_codes.get(row['category_code'])
+        if not row.get('category_id'):
+            ctx.fail(row_no, "Unknown or missing category")
+            continue
+        row.setdefault('item_code', 'AUTO')
+        try:
+            item = ItemMaster(**row)
+        except ValidationError as e:
+            ctx.fail(row_no, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        category = await get_category_code_info(item.category_id)
+        if not category:
+            ctx.fail(row_no, f"Category not found: {item.category_id}")
+            continue
+        if ctx.uom_names and item.uom not in ctx.uom_names:
+            ctx.fail(row_no, f"Unknown UOM: {item.uom}")
+            continue
+        if category['allowed_uoms'] and item.uom not in category['allowed_uoms']:
+            ctx.fail(row_no, f"UOM {item.uom} is not allowed for category {category['name']}")
+            continue
+        name_key = (item.category_id, item.item_name)
+        if name_key in ctx.seen_names:
+            ctx.fail(row_no, "Duplicate item name in this category within the upload")
+            continue
+        ctx.seen_names.add(name_key)
+        item.item_type = category['item_type']
+        item.category_name = category['name']
+        valid.append((row_no, item))
+    
+    # Name uniqueness against the database: one query for the whole batch
+    if valid:
+        existing = repos.items.find(
+            {"category_id": {"$in": list({i.category_id for _, i in valid})},
+             "item_name": {"$in": list({i.item_name for _, i in valid})}},
+            {"_id": 0, "category_id": 1, "item_name": 1}
+        )
+        taken = {(d['category_id'], d['item_name']) async for d in existing}
+        for row_no, item in valid:
+            if (item.category_id, item.item_name) in taken:
+                ctx.fail(row_no, "Item name already exists in this category")
+        valid = [(row_no, item) for row_no, item in valid if (item.category_id, item.item_name) not in taken]
+    
+    # Codes are reserved in one block per category
+    auto = {}
+    for _, item in valid:
+        if item.item_code.upper() == "AUTO":
+            auto.setdefault(item.category_id, []).append(item)
+    for category_id, items in auto.items():
+        for item, code in zip(items, await reserve_item_codes(category_id, len(items))):
+            item.item_code = code
+    
+    docs = []
+    for _, item in valid:
+        doc = item.model_dump()
+        doc['search_tokens'] = build_search_tokens(item.item_name, item.item_code)
+        # New items have no stock yet, so they start at or below any reorder level
+        doc['low_stock_alert'] = item.status == "Active" and item.reorder_level >= 0
+        docs.append(doc)
+    if not docs:
+        return
+    
+    failed = set()
+    try:
+        await repos.items.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for err in e.details.get('writeErrors', []):
+            failed.add(err['index'])
+            ctx.fail(valid[err['index']][0], err.get('errmsg', 'Insert failed'))
+    inserted = [doc for i, doc in enumerate(docs) if i not in failed]
+    ctx.inserted += len(inserted)
+    active = sum(1 for doc in inserted if doc['status'] == "Active")
+    if active:
+        await bump_dashboard_stat("total_items", active)
+    low = sum(1 for doc in inserted if doc['low_stock_alert'])
+    if low:
+        await bump_dashboard_stat("low_stock_alerts", low)
+
+@api_router.post("/masters/items/import")
+async def import_items(file: UploadFile = File(...), format: Optional[str] = None):
+    """Bulk-create items from a CSV or NDJSON upload
+    
+    Rows are streamed through validation (category by category_id or
+    category_code, UOM checks, name uniqueness per category) in batches; item
+    codes are reserved per category in blocks and each batch is written with an
+    unordered insert_many. Returns a per-row error report.
+    """
+    if not format:
+        format = "csv" if (file.filename or '').lower().endswith('.csv') else "ndjson"
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'ndjson'")
+    
+    category_codes = {c['code']: c['id'] async for c in repos.item_categories.find({}, {"_id": 0, "id": 1, "code": 1}) if c.get('code')}
+    uom_names = set()
+    async for uom in db.uoms.find({}, {"_id": 0, "uom_name": 1, "symbol": 1}):
+        uom_names.update(v for v in (uom.get('uom_name'), uom.get('symbol')) if v)
+    ctx = ItemImportContext(category_codes, uom_names)
+    
+    # The upload may be spooled to disk, so each batch is read and parsed in
+    # the threadpool rather than on the event loop
+    rows = read_import_rows(file, format)
+    total = 0
+    while True:
+        batch = await run_in_threadpool(lambda: list(islice(rows, IMPORT_BATCH_SIZE)))
+        if not batch:
+            break
+        total += len(batch)
+        await import_item_batch(batch, ctx)
+    
+    return {
+        "total_rows": total,
+        "inserted": ctx.inserted,
+        "failed": len(ctx.errors),
+        "errors": sorted(ctx.errors, key=lambda e: e['row'])
+    }
+
 # ============ Item Master Routes ============
 @api_router.post("/masters/items", response_model=ItemMaster)
 async def create_item(item: ItemMaster):
@@ -884,44 +2261,43 @@ async def create_item(item: ItemMaster):
         item.item_code = await generate_next_item_code(item.category_id)
     
     # Get category details for item_type and category_name
-    category = await db.item_categories.find_one({"id": item.category_id}, {"_id": 0})
+    category = await get_category_code_info(item.category_id)
     if category:
-        item.item_type = category.get('item_type', 'GENERAL')
-        item.category_name = category.get('name', '')
+        item.item_type = category['item_type']
+        item.category_name = category['name']
     
     doc = item.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    if doc.get('updated_at'):
-        doc['updated_at'] = doc['updated_at'].isoformat()
-    await db.items.insert_one(doc)
+    doc['search_tokens'] = build_search_tokens(item.item_name, item.item_code)
+    try:
+        await repos.items.insert_one(doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail=f"Item code '{item.item_code}' already exists")
+    if item.status == "Active":
+        await bump_dashboard_stat("total_items", 1)
+    await refresh_items_low_stock([item.id])
     return item
 
 @api_router.get("/masters/items", response_model=List[ItemMaster])
-async def get_items():
-    items = await db.items.find({}, {"_id": 0}).to_list(1000)
-    for item in items:
-        if isinstance(item['created_at'], str):
-            item['created_at'] = datetime.fromisoformat(item['created_at'])
-    return items
+async def get_items(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    items = await find_page(repos.items, {}, response, cursor, limit, "created_at", ITEM_PROJECTION)
+    return list_response(items, response, ItemMaster)
 
 @api_router.get("/masters/items/preview/next-code")
 async def preview_next_item_code(category_id: str):
     """Preview the next auto-generated item code for a category"""
     try:
         # Get category details
-        category = await db.item_categories.find_one({"id": category_id}, {"_id": 0})
-        if not category:
+        info = await get_category_code_info(category_id)
+        if not info:
             raise HTTPException(status_code=404, detail="Category not found")
         
-        item_type = category.get('item_type', 'GENERAL')
-        category_short_code = category.get('category_short_code') or category.get('code', 'GEN')
-        
-        # Get type code prefix
-        type_code = await get_item_type_code(item_type)
+        item_type = info['item_type']
+        category_short_code = info['category_short_code']
+        type_code = info['type_code']
         
         # Get next running number (without incrementing)
         counter_key = f"item_code_{category_id}"
-        counter = await db.counters.find_one({"key": counter_key})
+        counter = await repos.counters.find_one({"key": counter_key})
         next_num = (counter['value'] + 1) if counter else 1
         
         # Format preview code
@@ -948,7 +2324,7 @@ async def validate_item_name(item_name: str, category_id: str, item_id: Optional
     if item_id:
         query["id"] = {"$ne": item_id}
     
-    existing = await db.items.find_one(query, {"_id": 0})
+    existing = await repos.items.find_one(query, {"_id": 0})
     
     return {
         "is_unique": existing is None,
@@ -961,80 +2337,67 @@ async def validate_item_name(item_name: str, category_id: str, item_id: Optional
 @api_router.get("/masters/items/by-code/{item_code}")
 async def get_item_by_code(item_code: str):
     """Get item details by item code - Useful for Purchase/GRN modules"""
-    item = await db.items.find_one({"item_code": item_code}, {"_id": 0})
+    item = await repos.items.find_one({"item_code": item_code}, ITEM_PROJECTION)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
-    if isinstance(item.get('created_at'), str):
-        item['created_at'] = datetime.fromisoformat(item['created_at'])
-    if isinstance(item.get('updated_at'), str):
-        item['updated_at'] = datetime.fromisoformat(item['updated_at'])
     return item
 
 @api_router.get("/masters/items/by-category/{category_id}")
-async def get_items_by_category(category_id: str):
+async def get_items_by_category(category_id: str, response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
     """Get all items in a category - Useful for BOM/Production modules"""
-    items = await db.items.find({"category_id": category_id}, {"_id": 0}).to_list(1000)
-    for item in items:
-        if isinstance(item.get('created_at'), str):
-            item['created_at'] = datetime.fromisoformat(item['created_at'])
-        if isinstance(item.get('updated_at'), str):
-            item['updated_at'] = datetime.fromisoformat(item['updated_at'])
-    return items
+    items = await find_page(repos.items, {"category_id": category_id}, response, cursor, limit, "created_at", ITEM_PROJECTION)
+    return list_response(items, response)
 
 @api_router.get("/masters/items/by-type/{item_type}")
-async def get_items_by_type(item_type: str):
+async def get_items_by_type(item_type: str, response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
     """Get all items of a specific type - Useful for filtering RM, FG, etc."""
-    items = await db.items.find({"item_type": item_type, "is_active": True}, {"_id": 0}).to_list(1000)
-    for item in items:
-        if isinstance(item.get('created_at'), str):
-            item['created_at'] = datetime.fromisoformat(item['created_at'])
-        if isinstance(item.get('updated_at'), str):
-            item['updated_at'] = datetime.fromisoformat(item['updated_at'])
-    return items
+    items = await find_page(repos.items, {"item_type": item_type, "is_active": True}, response, cursor, limit, "created_at", ITEM_PROJECTION)
+    return list_response(items, response)
 
 @api_router.get("/masters/items/components")
-async def get_component_items():
+async def get_component_items(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
     """Get all items that can be used as components in BOM"""
-    items = await db.items.find({"is_component": True, "is_active": True}, {"_id": 0}).to_list(1000)
-    for item in items:
-        if isinstance(item.get('created_at'), str):
-            item['created_at'] = datetime.fromisoformat(item['created_at'])
-        if isinstance(item.get('updated_at'), str):
-            item['updated_at'] = datetime.fromisoformat(item['updated_at'])
-    return items
+    items = await find_page(repos.items, {"is_component": True, "is_active": True}, response, cursor, limit, "created_at", ITEM_PROJECTION)
+    return list_response(items, response)
 
 @api_router.get("/masters/items/finished-goods")
-async def get_finished_goods():
+async def get_finished_goods(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
     """Get all finished good items"""
-    items = await db.items.find({"is_finished_good": True, "is_active": True}, {"_id": 0}).to_list(1000)
-    for item in items:
-        if isinstance(item.get('created_at'), str):
-            item['created_at'] = datetime.fromisoformat(item['created_at'])
-        if isinstance(item.get('updated_at'), str):
-            item['updated_at'] = datetime.fromisoformat(item['updated_at'])
-    return items
+    items = await find_page(repos.items, {"is_finished_good": True, "is_active": True}, response, cursor, limit, "created_at", ITEM_PROJECTION)
+    return list_response(items, response)
 
 @api_router.get("/masters/items/low-stock")
-async def get_low_stock_items():
-    """Get items below reorder level - For Purchase Indent automation"""
-    items = await db.items.find({"is_active": True}, {"_id": 0}).to_list(1000)
-    low_stock_items = []
+async def get_low_stock_items(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    """Get items below reorder level - For Purchase Indent automation
     
-    for item in items:
-        # Get current stock from stock_balance
-        stock = await db.stock_balance.find_one({"item_id": item['id']}, {"_id": 0})
-        current_stock = sum([s.get('qty', 0) for s in await db.stock_balance.find({"item_id": item['id']}, {"_id": 0}).to_list(100)]) if stock else 0
-        
-        if current_stock <= item.get('reorder_level', 0):
-            item['current_stock'] = current_stock
-            item['shortage'] = item.get('reorder_level', 0) - current_stock
-            if isinstance(item.get('created_at'), str):
-                item['created_at'] = datetime.fromisoformat(item['created_at'])
-            if isinstance(item.get('updated_at'), str):
-                item['updated_at'] = datetime.fromisoformat(item['updated_at'])
-            low_stock_items.append(item)
+    One aggregation joins active items to their summed stock_balance rows and
+    returns shortages largest first, paged by an opaque (shortage, id) cursor.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    pipeline = [
+        {"$match": {"is_active": True}},
+        {"$project": ITEM_PROJECTION},
+        *STOCK_ON_HAND_STAGES,
+        {"$set": {"shortage": {"$subtract": [{"$ifNull": ["$reorder_level", 0]}, "$current_stock"]}}},
+        {"$match": {"shortage": {"$gte": 0}}},
+    ]
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 2:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        pipeline.append({"$match": {"$or": [
+            {"shortage": {"$lt": values[0]}},
+            {"shortage": values[0], "id": {"$gt": values[1]}}
+        ]}})
+    pipeline += [{"$sort": {"shortage": -1, "id": 1}}, {"$limit": limit + 1}]
     
-    return low_stock_items
+    low_stock_items = await repos.items.aggregate(pipeline, allowDiskUse=True).to_list(limit + 1)
+    if len(low_stock_items) > limit:
+        low_stock_items = low_stock_items[:limit]
+        last = low_stock_items[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor([last['shortage'], last['id']])
+    
+    return list_response(low_stock_items, response)
 
 @api_router.get("/masters/items/search")
 async def search_items(
@@ -1044,35 +2407,38 @@ async def search_items(
     limit: int = 50
 ):
     """Search items by name or code - Useful for all transaction modules"""
-    query = {
-        "$or": [
-            {"item_name": {"$regex": q, "$options": "i"}},
-            {"item_code": {"$regex": q, "$options": "i"}}
-        ],
-        "is_active": True
-    }
+    q_norm = q.strip().lower()
+    terms = [t[:SEARCH_MAX_PREFIX] for t in tokenize_search_text(q_norm)]
+    if not terms:
+        return []
     
+    filters = {"is_active": True}
     if item_type:
-        query["item_type"] = item_type
+        filters["item_type"] = item_type
     if category_id:
-        query["category_id"] = category_id
+        filters["category_id"] = category_id
     
-    items = await db.items.find(query, {"_id": 0}).limit(limit).to_list(limit)
-    for item in items:
-        if isinstance(item.get('created_at'), str):
-            item['created_at'] = datetime.fromisoformat(item['created_at'])
-        if isinstance(item.get('updated_at'), str):
-            item['updated_at'] = datetime.fromisoformat(item['updated_at'])
+    # Code prefix hits come first and ride the item_code index (codes are upper case); sorting
+    # on the index makes the `limit` codes kept the lowest ones, not whichever come back first
+    code_hits = await repos.items.find(
+        {"item_code": {"$regex": f"^{re.escape(q.strip().upper())}"}, **filters}, ITEM_PROJECTION
+    ).sort("item_code", 1).limit(limit).to_list(limit)
+    # Same for the capped token candidates, so which ones get ranked doesn't vary between calls
+    token_hits = await repos.items.find(
+        {"search_tokens": {"$all": terms}, **filters}, ITEM_PROJECTION
+    ).sort("item_code", 1).limit(SEARCH_CANDIDATES).to_list(SEARCH_CANDIDATES)
+    
+    hits = {item['id']: item for item in token_hits}
+    hits.update((item['id'], item) for item in code_hits)
+    items = sorted(hits.values(), key=lambda item: rank_search_hit(item, q_norm))[:limit]
     
     return items
 
 @api_router.get("/masters/items/{item_id}", response_model=ItemMaster)
 async def get_item(item_id: str):
-    item = await db.items.find_one({"id": item_id}, {"_id": 0})
+    item = await repos.items.find_one({"id": item_id}, {"_id": 0})
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
-    if isinstance(item['created_at'], str):
-        item['created_at'] = datetime.fromisoformat(item['created_at'])
     return ItemMaster(**item)
 
 @api_router.put("/masters/items/{item_id}", response_model=ItemMaster)
@@ -1081,23 +2447,31 @@ async def update_item(item_id: str, item: ItemMaster):
     item.updated_at = datetime.now(timezone.utc)
     
     # Get category details for item_type and category_name
-    category = await db.item_categories.find_one({"id": item.category_id}, {"_id": 0})
+    category = await get_category_code_info(item.category_id)
     if category:
-        item.item_type = category.get('item_type', 'GENERAL')
-        item.category_name = category.get('name', '')
+        item.item_type = category['item_type']
+        item.category_name = category['name']
     
     doc = item.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    if doc.get('updated_at'):
-        doc['updated_at'] = doc['updated_at'].isoformat()
-    await db.items.update_one({"id": item_id}, {"$set": doc})
+    doc['search_tokens'] = build_search_tokens(item.item_name, item.item_code)
+    try:
+        previous = await repos.items.find_one_and_update({"id": item_id}, {"$set": doc}, projection={"_id": 0, "status": 1})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail=f"Item code '{item.item_code}' already exists")
+    if previous and (previous.get('status') == "Active") != (item.status == "Active"):
+        await bump_dashboard_stat("total_items", 1 if item.status == "Active" else -1)
+    await refresh_items_low_stock([item_id])
     return item
 
 @api_router.delete("/masters/items/{item_id}")
 async def delete_item(item_id: str):
-    result = await db.items.delete_one({"id": item_id})
-    if result.deleted_count == 0:
+    deleted = await repos.items.find_one_and_delete({"id": item_id}, projection={"_id": 0, "status": 1, "low_stock_alert": 1})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Item not found")
+    if deleted.get('status') == "Active":
+        await bump_dashboard_stat("total_items", -1)
+    if deleted.get('low_stock_alert'):
+        await bump_dashboard_stat("low_stock_alerts", -1)
     return {"message": "Item deleted successfully"}
 
 @api_router.get("/masters/items/preview/next-code")
@@ -1105,19 +2479,17 @@ async def preview_next_item_code(category_id: str):
     """Preview the next auto-generated item code for a category"""
     try:
         # Get category details
-        category = await db.item_categories.find_one({"id": category_id}, {"_id": 0})
-        if not category:
+        info = await get_category_code_info(category_id)
+        if not info:
             raise HTTPException(status_code=404, detail="Category not found")
         
-        item_type = category.get('item_type', 'GENERAL')
-        category_short_code = category.get('category_short_code') or category.get('code', 'GEN')
-        
-        # Get type code prefix
-        type_code = await get_item_type_code(item_type)
+        item_type = info['item_type']
+        category_short_code = info['category_short_code']
+        type_code = info['type_code']
         
         # Get next running number (without incrementing)
         counter_key = f"item_code_{category_id}"
-        counter = await db.counters.find_one({"key": counter_key})
+        counter = await repos.counters.find_one({"key": counter_key})
         next_num = (counter['value'] + 1) if counter else 1
         
         # Format preview code
@@ -1144,7 +2516,7 @@ async def validate_item_name(item_name: str, category_id: str, item_id: Optional
     if item_id:
         query["id"] = {"$ne": item_id}
     
-    existing = await db.items.find_one(query, {"_id": 0})
+    existing = await repos.items.find_one(query, {"_id": 0})
     
     return {
         "is_unique": existing is None,
@@ -1166,8 +2538,8 @@ async def update_item_cost(
         updates['standard_cost'] = standard_cost
     
     if updates:
-        updates['updated_at'] = datetime.now(timezone.utc).isoformat()
-        result = await db.items.update_one({"id": item_id}, {"$set": updates})
+        updates['updated_at'] = datetime.now(timezone.utc)
+        result = await repos.items.update_one({"id": item_id}, {"$set": updates})
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Item not found or no changes made")
         return {"message": "Item cost updated successfully", "updates": updates}
@@ -1178,17 +2550,14 @@ async def update_item_cost(
 @api_router.post("/masters/uoms", response_model=UOMMaster)
 async def create_uom(uom: UOMMaster):
     doc = uom.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.uoms.insert_one(doc)
+    invalidate_uom_cache()
     return uom
 
 @api_router.get("/masters/uoms", response_model=List[UOMMaster])
-async def get_uoms():
-    uoms = await db.uoms.find({}, {"_id": 0}).to_list(1000)
-    for uom in uoms:
-        if isinstance(uom['created_at'], str):
-            uom['created_at'] = datetime.fromisoformat(uom['created_at'])
-    return uoms
+async def get_uoms(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    uoms = await find_page(db.uoms, {}, response, cursor, limit, "created_at")
+    return list_response(uoms, response, UOMMaster)
 
 @api_router.get("/masters/uoms/convert")
 async def convert_uom_quantity(
@@ -1210,75 +2579,79 @@ async def convert_uom_quantity(
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@api_router.post("/masters/uoms/convert/batch")
+async def convert_uom_quantities(conversions: List[UOMConversion]):
+    """Convert a list of quantities in one call, e.g. every line of a GRN"""
+    cache = await get_uom_matrix()
+    results = []
+    for line, conversion in enumerate(conversions):
+        try:
+            converted_qty = convert_with_matrix(cache, conversion.qty, conversion.from_uom_id, conversion.to_uom_id)
+        except HTTPException as e:
+            raise HTTPException(status_code=e.status_code, detail=f"Line {line + 1}: {e.detail}")
+        results.append({
+            "original_qty": conversion.qty,
+            "from_uom_id": conversion.from_uom_id,
+            "converted_qty": converted_qty,
+            "to_uom_id": conversion.to_uom_id
+        })
+    return results
+
 # ============ Supplier Master Routes ============
 @api_router.post("/masters/suppliers", response_model=SupplierMaster)
 async def create_supplier(supplier: SupplierMaster):
     doc = supplier.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.suppliers.insert_one(doc)
+    if supplier.status == "Active":
+        await bump_dashboard_stat("total_suppliers", 1)
     return supplier
 
 @api_router.get("/masters/suppliers", response_model=List[SupplierMaster])
-async def get_suppliers():
-    suppliers = await db.suppliers.find({}, {"_id": 0}).to_list(1000)
-    for supplier in suppliers:
-        if isinstance(supplier['created_at'], str):
-            supplier['created_at'] = datetime.fromisoformat(supplier['created_at'])
-    return suppliers
+async def get_suppliers(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    suppliers = await find_page(db.suppliers, {}, response, cursor, limit, "created_at")
+    return list_response(suppliers, response, SupplierMaster)
 
 # ============ Warehouse Master Routes ============
 @api_router.post("/masters/warehouses", response_model=WarehouseMaster)
 async def create_warehouse(warehouse: WarehouseMaster):
     doc = warehouse.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.warehouses.insert_one(doc)
     return warehouse
 
 @api_router.get("/masters/warehouses", response_model=List[WarehouseMaster])
-async def get_warehouses():
-    warehouses = await db.warehouses.find({}, {"_id": 0}).to_list(1000)
-    for warehouse in warehouses:
-        if isinstance(warehouse['created_at'], str):
-            warehouse['created_at'] = datetime.fromisoformat(warehouse['created_at'])
-    return warehouses
+async def get_warehouses(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    warehouses = await find_page(db.warehouses, {}, response, cursor, limit, "created_at")
+    return list_response(warehouses, response, WarehouseMaster)
 
 # ============ BIN Location Routes ============
 @api_router.post("/masters/bin-locations", response_model=BINLocationMaster)
 async def create_bin_location(bin_loc: BINLocationMaster):
     doc = bin_loc.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.bin_locations.insert_one(doc)
     return bin_loc
 
 @api_router.get("/masters/bin-locations", response_model=List[BINLocationMaster])
-async def get_bin_locations():
-    bins = await db.bin_locations.find({}, {"_id": 0}).to_list(1000)
-    for bin_loc in bins:
-        if isinstance(bin_loc['created_at'], str):
-            bin_loc['created_at'] = datetime.fromisoformat(bin_loc['created_at'])
-    return bins
+async def get_bin_locations(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    bins = await find_page(db.bin_locations, {}, response, cursor, limit, "created_at")
+    return list_response(bins, response, BINLocationMaster)
 
 # ============ Tax/HSN Master Routes ============
 @api_router.post("/masters/tax-hsn", response_model=TaxHSNMaster)
 async def create_tax_hsn(tax: TaxHSNMaster):
     doc = tax.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.tax_hsn.insert_one(doc)
     return tax
 
 @api_router.get("/masters/tax-hsn", response_model=List[TaxHSNMaster])
-async def get_tax_hsn():
-    taxes = await db.tax_hsn.find({}, {"_id": 0}).to_list(1000)
-    for tax in taxes:
-        if isinstance(tax['created_at'], str):
-            tax['created_at'] = datetime.fromisoformat(tax['created_at'])
-    return taxes
+async def get_tax_hsn(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    taxes = await find_page(db.tax_hsn, {}, response, cursor, limit, "created_at")
+    return list_response(taxes, response, TaxHSNMaster)
 
 # ============ Color Master Routes ============
 @api_router.get("/masters/colors")
-async def get_colors():
-    colors = await db.colors.find({}, {"_id": 0}).to_list(1000)
-    return colors
+async def get_colors(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    colors = await find_page(db.colors, {}, response, cursor, limit, "_id")
+    return list_response(colors, response)
 
 @api_router.post("/masters/colors")
 async def create_color(data: Dict[str, Any]):
@@ -1287,9 +2660,9 @@ async def create_color(data: Dict[str, Any]):
 
 # ============ Size Master Routes ============
 @api_router.get("/masters/sizes")
-async def get_sizes():
-    sizes = await db.sizes.find({}, {"_id": 0}).to_list(1000)
-    return sizes
+async def get_sizes(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    sizes = await find_page(db.sizes, {}, response, cursor, limit, "_id")
+    return list_response(sizes, response)
 
 @api_router.post("/masters/sizes")
 async def create_size(data: Dict[str, Any]):
@@ -1298,9 +2671,9 @@ async def create_size(data: Dict[str, Any]):
 
 # ============ Brand Master Routes ============
 @api_router.get("/masters/brands")
-async def get_brands():
-    brands = await db.brands.find({}, {"_id": 0}).to_list(1000)
-    return brands
+async def get_brands(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    brands = await find_page(db.brands, {}, response, cursor, limit, "_id")
+    return list_response(brands, response)
 
 @api_router.post("/masters/brands")
 async def create_brand(data: Dict[str, Any]):
@@ -1313,22 +2686,13 @@ async def create_indent(indent: PurchaseIndent):
     if not indent.indent_no:
         indent.indent_no = await get_next_number("Purchase_Indent")
     doc = indent.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    for item in doc['items']:
-        item['required_date'] = item['required_date'].isoformat()
     await db.purchase_indents.insert_one(doc)
     return indent
 
 @api_router.get("/purchase/indents", response_model=List[PurchaseIndent])
-async def get_indents():
-    indents = await db.purchase_indents.find({}, {"_id": 0}).to_list(1000)
-    for indent in indents:
-        if isinstance(indent['created_at'], str):
-            indent['created_at'] = datetime.fromisoformat(indent['created_at'])
-        for item in indent['items']:
-            if isinstance(item['required_date'], str):
-                item['required_date'] = datetime.fromisoformat(item['required_date'])
-    return indents
+async def get_indents(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    indents = await find_page(db.purchase_indents, {}, response, cursor, limit, "created_at")
+    return list_response(indents, response, PurchaseIndent)
 
 # ============ Purchase Order Routes ============
 @api_router.post("/purchase/orders", response_model=PurchaseOrder)
@@ -1336,46 +2700,48 @@ async def create_po(po: PurchaseOrder):
     if not po.po_no:
         po.po_no = await get_next_number("Purchase_Order")
     doc = po.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    if doc.get('approved_at'):
-        doc['approved_at'] = doc['approved_at'].isoformat()
     await db.purchase_orders.insert_one(doc)
+    if po.status == ApprovalStatus.PENDING:
+        await bump_dashboard_stat("pending_pos", 1)
     return po
 
 @api_router.get("/purchase/orders", response_model=List[PurchaseOrder])
-async def get_pos():
-    pos = await db.purchase_orders.find({}, {"_id": 0}).to_list(1000)
-    for po in pos:
-        if isinstance(po['created_at'], str):
-            po['created_at'] = datetime.fromisoformat(po['created_at'])
-        if po.get('approved_at') and isinstance(po['approved_at'], str):
-            po['approved_at'] = datetime.fromisoformat(po['approved_at'])
-    return pos
+async def get_pos(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    pos = await find_page(db.purchase_orders, {}, response, cursor, limit, "created_at")
+    return list_response(pos, response, PurchaseOrder)
 
 @api_router.put("/purchase/orders/{po_id}/approve")
-async def approve_po(po_id: str, remarks: Optional[str] = None):
-    await db.purchase_orders.update_one(
+async def approve_po(po_id: str, remarks: Optional[str] = None,
+                     current_user: Optional[Dict] = Depends(get_optional_user)):
+    previous = await db.purchase_orders.find_one_and_update(
         {"id": po_id},
         {"$set": {
             "status": ApprovalStatus.APPROVED,
-            "approved_by": current_user['user_id'],
-            "approved_at": datetime.now(timezone.utc).isoformat(),
+            "approved_by": current_user['user_id'] if current_user else None,
+            "approved_at": datetime.now(timezone.utc),
             "remarks": remarks
-        }}
+        }},
+        projection={"_id": 0, "status": 1}
     )
+    if previous and previous.get('status') == ApprovalStatus.PENDING:
+        await bump_dashboard_stat("pending_pos", -1)
     return {"message": "PO approved successfully"}
 
 @api_router.put("/purchase/orders/{po_id}/reject")
-async def reject_po(po_id: str, remarks: Optional[str] = None):
-    await db.purchase_orders.update_one(
+async def reject_po(po_id: str, remarks: Optional[str] = None,
+                    current_user: Optional[Dict] = Depends(get_optional_user)):
+    previous = await db.purchase_orders.find_one_and_update(
         {"id": po_id},
         {"$set": {
             "status": ApprovalStatus.REJECTED,
-            "approved_by": current_user['user_id'],
-            "approved_at": datetime.now(timezone.utc).isoformat(),
+            "approved_by": current_user['user_id'] if current_user else None,
+            "approved_at": datetime.now(timezone.utc),
             "remarks": remarks
-        }}
+        }},
+        projection={"_id": 0, "status": 1}
     )
+    if previous and previous.get('status') == ApprovalStatus.PENDING:
+        await bump_dashboard_stat("pending_pos", -1)
     return {"message": "PO rejected successfully"}
 
 # ============ GRN Routes ============
@@ -1384,21 +2750,18 @@ async def create_grn(grn: GRN):
     if not grn.grn_no:
         grn.grn_no = await get_next_number("GRN")
     doc = grn.model_dump()
-    doc['received_at'] = doc['received_at'].isoformat()
-    if doc.get('invoice_date'):
-        doc['invoice_date'] = doc['invoice_date'].isoformat()
     await db.grn.insert_one(doc)
     return grn
 
 @api_router.get("/inventory/grn", response_model=List[GRN])
-async def get_grns():
-    grns = await db.grn.find({}, {"_id": 0}).to_list(1000)
-    for grn in grns:
-        if isinstance(grn['received_at'], str):
-            grn['received_at'] = datetime.fromisoformat(grn['received_at'])
-        if grn.get('invoice_date') and isinstance(grn['invoice_date'], str):
-            grn['invoice_date'] = datetime.fromisoformat(grn['invoice_date'])
-    return grns
+async def get_grns(response: Response, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                   supplier_id: Optional[str] = None, po_id: Optional[str] = None, item_id: Optional[str] = None,
+                   warehouse_id: Optional[str] = None, status: Optional[str] = None,
+                   cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    query = report_query("grn", start_date, end_date, item_id, supplier_id=supplier_id, po_id=po_id,
+                         warehouse_id=warehouse_id, status=status)
+    grns = await find_page(db.grn, query, response, cursor, limit, "received_at")
+    return list_response(grns, response, GRN)
 
 # ============ Quality Check Routes ============
 @api_router.post("/quality/checks", response_model=QualityCheck)
@@ -1406,7 +2769,6 @@ async def create_qc(qc: QualityCheck):
     if not qc.qc_no:
         qc.qc_no = await get_next_number("QC")
     doc = qc.model_dump()
-    doc['inspected_at'] = doc['inspected_at'].isoformat()
     await db.quality_checks.insert_one(doc)
     
     # Update GRN status
@@ -1418,12 +2780,9 @@ async def create_qc(qc: QualityCheck):
     return qc
 
 @api_router.get("/quality/checks", response_model=List[QualityCheck])
-async def get_qcs():
-    qcs = await db.quality_checks.find({}, {"_id": 0}).to_list(1000)
-    for qc in qcs:
-        if isinstance(qc['inspected_at'], str):
-            qc['inspected_at'] = datetime.fromisoformat(qc['inspected_at'])
-    return qcs
+async def get_qcs(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    qcs = await find_page(db.quality_checks, {}, response, cursor, limit, "inspected_at")
+    return list_response(qcs, response, QualityCheck)
 
 # ============ Stock Inward Routes ============
 @api_router.post("/inventory/stock-inward", response_model=StockInward)
@@ -1431,40 +2790,16 @@ async def create_stock_inward(inward: StockInward):
     if not inward.inward_no:
         inward.inward_no = await get_next_number("INWARD")
     doc = inward.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.stock_inward.insert_one(doc)
-    
-    # Update stock balance
-    stock = await db.stock_balance.find_one({"item_id": inward.item_id, "warehouse_id": inward.warehouse_id})
-    if stock:
-        new_qty = stock['qty'] + inward.qty
-        await db.stock_balance.update_one(
-            {"item_id": inward.item_id, "warehouse_id": inward.warehouse_id},
-            {"$set": {"qty": new_qty, "last_updated": datetime.now(timezone.utc).isoformat()}}
-        )
-    else:
-        warehouse = await db.warehouses.find_one({"id": inward.warehouse_id})
-        stock_doc = {
-            "id": str(uuid.uuid4()),
-            "item_id": inward.item_id,
-            "item_name": inward.item_name,
-            "warehouse_id": inward.warehouse_id,
-            "warehouse_name": warehouse['warehouse_name'] if warehouse else "",
-            "qty": inward.qty,
-            "uom": inward.uom,
-            "last_updated": datetime.now(timezone.utc).isoformat()
-        }
-        await db.stock_balance.insert_one(stock_doc)
+    
+    # Insert the inward with its ledger rows and stock balance deltas
+    await post_stock_document(db.stock_inward, doc, "INWARD", inward.inward_no, document_stock_lines(inward))
     
     return inward
 
 @api_router.get("/inventory/stock-inward", response_model=List[StockInward])
-async def get_stock_inwards():
-    inwards = await db.stock_inward.find({}, {"_id": 0}).to_list(1000)
-    for inward in inwards:
-        if isinstance(inward['created_at'], str):
-            inward['created_at'] = datetime.fromisoformat(inward['created_at'])
-    return inwards
+async def get_stock_inwards(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    inwards = await find_page(db.stock_inward, {}, response, cursor, limit, "created_at")
+    return list_response(inwards, response, StockInward)
 
 # ============ Stock Transfer Routes ============
 @api_router.post("/inventory/stock-transfer", response_model=StockTransfer)
@@ -1472,21 +2807,13 @@ async def create_stock_transfer(transfer: StockTransfer):
     if not transfer.transfer_no:
         transfer.transfer_no = await get_next_number("TRANSFER")
     doc = transfer.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    if doc.get('approved_at'):
-        doc['approved_at'] = doc['approved_at'].isoformat()
     await db.stock_transfer.insert_one(doc)
     return transfer
 
 @api_router.get("/inventory/stock-transfer", response_model=List[StockTransfer])
-async def get_stock_transfers():
-    transfers = await db.stock_transfer.find({}, {"_id": 0}).to_list(1000)
-    for transfer in transfers:
-        if isinstance(transfer['created_at'], str):
-            transfer['created_at'] = datetime.fromisoformat(transfer['created_at'])
-        if transfer.get('approved_at') and isinstance(transfer['approved_at'], str):
-            transfer['approved_at'] = datetime.fromisoformat(transfer['approved_at'])
-    return transfers
+async def get_stock_transfers(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    transfers = await find_page(db.stock_transfer, {}, response, cursor, limit, "created_at")
+    return list_response(transfers, response, StockTransfer)
 
 # ============ Issue to Department Routes ============
 @api_router.post("/inventory/issue", response_model=IssueToDepartment)
@@ -1494,31 +2821,21 @@ async def create_issue(issue: IssueToDepartment):
     if not issue.issue_no:
         issue.issue_no = await get_next_number("ISSUE")
     
-    # Check stock availability
-    stock = await db.stock_balance.find_one({"item_id": issue.item_id, "warehouse_id": issue.warehouse_id})
-    if not stock or stock['qty'] < issue.qty:
-        raise HTTPException(status_code=400, detail="Insufficient stock")
-    
     doc = issue.model_dump()
-    doc['issued_at'] = doc['issued_at'].isoformat()
-    await db.issues.insert_one(doc)
-    
-    # Update stock balance
-    new_qty = stock['qty'] - issue.qty
-    await db.stock_balance.update_one(
-        {"item_id": issue.item_id, "warehouse_id": issue.warehouse_id},
-        {"$set": {"qty": new_qty, "last_updated": datetime.now(timezone.utc).isoformat()}}
-    )
+    
+    # Stock availability is checked by the same writes that take it out
+    await post_stock_document(db.issues, doc, "ISSUE", issue.issue_no, document_stock_lines(issue, sign=-1))
     
     return issue
 
 @api_router.get("/inventory/issue", response_model=List[IssueToDepartment])
-async def get_issues():
-    issues = await db.issues.find({}, {"_id": 0}).to_list(1000)
-    for issue in issues:
-        if isinstance(issue['issued_at'], str):
-            issue['issued_at'] = datetime.fromisoformat(issue['issued_at'])
-    return issues
+async def get_issues(response: Response, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                     department: Optional[str] = None, item_id: Optional[str] = None,
+                     warehouse_id: Optional[str] = None, cursor: Optional[str] = None,
+                     limit: int = DEFAULT_PAGE_SIZE):
+    query = report_query("issues", start_date, end_date, item_id, department=department, warehouse_id=warehouse_id)
+    issues = await find_page(db.issues, query, response, cursor, limit, "issued_at")
+    return list_response(issues, response, IssueToDepartment)
 
 # ============ Return from Department Routes ============
 @api_router.post("/inventory/return", response_model=ReturnFromDepartment)
@@ -1526,28 +2843,25 @@ async def create_return(ret: ReturnFromDepartment):
     if not ret.return_no:
         ret.return_no = await get_next_number("RETURN")
     doc = ret.model_dump()
-    doc['returned_at'] = doc['returned_at'].isoformat()
-    await db.returns.insert_one(doc)
     
     # Update stock balance if condition is good
     if ret.condition == "Good":
-        stock = await db.stock_balance.find_one({"item_id": ret.item_id, "warehouse_id": ret.warehouse_id})
-        if stock:
-            new_qty = stock['qty'] + ret.qty_returned
-            await db.stock_balance.update_one(
-                {"item_id": ret.item_id, "warehouse_id": ret.warehouse_id},
-                {"$set": {"qty": new_qty, "last_updated": datetime.now(timezone.utc).isoformat()}}
-            )
+        await post_stock_document(db.returns, doc, "RETURN", ret.return_no,
+                                  document_stock_lines(ret, qty_field="qty_returned"))
+    else:
+        await db.returns.insert_one(doc)
     
     return ret
 
 @api_router.get("/inventory/return", response_model=List[ReturnFromDepartment])
-async def get_returns():
-    returns = await db.returns.find({}, {"_id": 0}).to_list(1000)
-    for ret in returns:
-        if isinstance(ret['returned_at'], str):
-            ret['returned_at'] = datetime.fromisoformat(ret['returned_at'])
-    return returns
+async def get_returns(response: Response, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                      department: Optional[str] = None, item_id: Optional[str] = None,
+                      warehouse_id: Optional[str] = None, condition: Optional[str] = None,
+                      cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    query = report_query("returns", start_date, end_date, item_id, department=department,
+                         warehouse_id=warehouse_id, condition=condition)
+    returns = await find_page(db.returns, query, response, cursor, limit, "returned_at")
+    return list_response(returns, response, ReturnFromDepartment)
 
 # ============ Stock Adjustment Routes ============
 @api_router.post("/inventory/adjustment", response_model=StockAdjustment)
@@ -1555,83 +2869,438 @@ async def create_adjustment(adjustment: StockAdjustment):
     if not adjustment.adjustment_no:
         adjustment.adjustment_no = await get_next_number("ADJUSTMENT")
     doc = adjustment.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    if doc.get('approved_at'):
-        doc['approved_at'] = doc['approved_at'].isoformat()
     await db.adjustments.insert_one(doc)
     return adjustment
 
 @api_router.get("/inventory/adjustment", response_model=List[StockAdjustment])
-async def get_adjustments():
-    adjustments = await db.adjustments.find({}, {"_id": 0}).to_list(1000)
-    for adj in adjustments:
-        if isinstance(adj['created_at'], str):
-            adj['created_at'] = datetime.fromisoformat(adj['created_at'])
-        if adj.get('approved_at') and isinstance(adj['approved_at'], str):
-            adj['approved_at'] = datetime.fromisoformat(adj['approved_at'])
-    return adjustments
+async def get_adjustments(response: Response, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                          item_id: Optional[str] = None, warehouse_id: Optional[str] = None,
+                          reason: Optional[str] = None, status: Optional[str] = None,
+                          cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    query = report_query("adjustments", start_date, end_date, item_id, warehouse_id=warehouse_id,
+                         reason=reason, status=status)
+    adjustments = await find_page(db.adjustments, query, response, cursor, limit, "created_at")
+    return list_response(adjustments, response, StockAdjustment)
 
 # ============ Stock Balance Routes ============
 @api_router.get("/inventory/stock-balance", response_model=List[StockBalance])
-async def get_stock_balance():
-    stocks = await db.stock_balance.find({}, {"_id": 0}).to_list(1000)
-    for stock in stocks:
-        if isinstance(stock['last_updated'], str):
-            stock['last_updated'] = datetime.fromisoformat(stock['last_updated'])
-    return stocks
+async def get_stock_balance(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    stocks = await find_page(repos.stock_balance, {}, response, cursor, limit, "id")
+    return list_response(stocks, response, StockBalance)
+
+# ============ Stock Movement Routes ============
+@api_router.get("/inventory/stock-movements", response_model=List[StockMovement])
+async def get_stock_movements(response: Response, item_id: Optional[str] = None, warehouse_id: Optional[str] = None,
+                              cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    query = {}
+    if item_id:
+        query['item_id'] = item_id
+    if warehouse_id:
+        query['warehouse_id'] = warehouse_id
+    movements = await find_page(repos.stock_movements, query, response, cursor, limit, "posted_at")
+    return list_response(movements, response, StockMovement)
+
+@api_router.post("/inventory/stock-balance/rebuild")
+async def rebuild_stock_balance_route(item_id: str, warehouse_id: str):
+    """Recompute one balance from its latest snapshot and the movements after it"""
+    qty = await rebuild_stock_balance(item_id, warehouse_id)
+    return {"item_id": item_id, "warehouse_id": warehouse_id, "qty": qty}
+
+# ============ System Routes ============
+@api_router.get("/system/indexes")
+async def get_index_report():
+    """Missing, undeclared and unused indexes per collection"""
+    return await index_report()
 
 # ============ Dashboard Stats ============
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats():
-    total_items = await db.items.count_documents({"status": "Active"})
-    total_suppliers = await db.suppliers.count_documents({"status": "Active"})
-    pending_pos = await db.purchase_orders.count_documents({"status": ApprovalStatus.PENDING})
-    pending_approvals = await db.purchase_orders.count_documents({"status": ApprovalStatus.PENDING})
-    
-    # Low stock items
-    items = await db.items.find({"status": "Active"}, {"_id": 0}).to_list(1000)
-    low_stock_count = 0
-    for item in items:
-        stock = await db.stock_balance.find_one({"item_id": item['id']})
-        total_stock = stock['qty'] if stock else 0
-        if total_stock <= item['reorder_level']:
-            low_stock_count += 1
+    stats = await db.dashboard_stats.find_one({"id": DASHBOARD_STATS_ID}, {"_id": 0})
+    if not stats or 'reconciled_at' not in stats:
+        stats = await reconcile_dashboard_stats()
     
     return {
-        "total_items": total_items,
-        "total_suppliers": total_suppliers,
-        "low_stock_alerts": low_stock_count,
-        "pending_pos": pending_pos,
-        "pending_approvals": pending_approvals
+        "total_items": stats.get('total_items', 0),
+        "total_suppliers": stats.get('total_suppliers', 0),
+        "low_stock_alerts": stats.get('low_stock_alerts', 0),
+        "pending_pos": stats.get('pending_pos', 0),
+        "pending_approvals": stats.get('pending_pos', 0)
     }
 
 # ============ Reports ============
 @api_router.get("/reports/stock-ledger")
-async def stock_ledger_report(item_id: Optional[str] = None, warehouse_id: Optional[str] = None):
+async def stock_ledger_report(item_id: Optional[str] = None, warehouse_id: Optional[str] = None,
+                              start_date: Optional[str] = None, end_date: Optional[str] = None,
+                              format: str = "ndjson"):
+    """Movements with opening and running balances, streamed as NDJSON or CSV"""
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
     query = {}
     if item_id:
         query['item_id'] = item_id
     if warehouse_id:
         query['warehouse_id'] = warehouse_id
+    date_range = report_date_range(start_date, end_date)
+    start = date_range.get("$gte")
+    opening = await stock_opening_balances(query, start)
+    if date_range:
+        query['posted_at'] = date_range
     
-    stocks = await db.stock_balance.find(query, {"_id": 0}).to_list(1000)
-    return stocks
+    return StreamingResponse(
+        stream_export(stock_ledger_rows(query, opening, start), format, STOCK_LEDGER_COLUMNS),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson"
+    )
 
 @api_router.get("/reports/issue-register")
-async def issue_register_report(start_date: Optional[str] = None, end_date: Optional[str] = None):
-    issues = await db.issues.find({}, {"_id": 0}).to_list(1000)
-    for issue in issues:
-        if isinstance(issue['issued_at'], str):
-            issue['issued_at'] = datetime.fromisoformat(issue['issued_at'])
-    return issues
+async def issue_register_report(response: Response, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                                department: Optional[str] = None, item_id: Optional[str] = None,
+                                warehouse_id: Optional[str] = None, cursor: Optional[str] = None,
+                                limit: int = DEFAULT_PAGE_SIZE):
+    query = report_query("issues", start_date, end_date, item_id, department=department, warehouse_id=warehouse_id)
+    issues = await find_page(report_db.issues, query, response, cursor, limit, "issued_at")
+    return list_response(issues, response)
 
 @api_router.get("/reports/pending-po")
-async def pending_po_report():
-    pos = await db.purchase_orders.find({"status": {"$in": [ApprovalStatus.PENDING, ApprovalStatus.DRAFT]}}, {"_id": 0}).to_list(1000)
-    for po in pos:
-        if isinstance(po['created_at'], str):
-            po['created_at'] = datetime.fromisoformat(po['created_at'])
-    return pos
+async def pending_po_report(response: Response, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    pos = await find_page(report_db.purchase_orders, {"status": {"$in": [ApprovalStatus.PENDING, ApprovalStatus.DRAFT]}}, response, cursor, limit, "created_at")
+    return list_response(pos, response)
+
+# ============ Streaming Export ============
+# Bulk consumers (nightly sync etc.) read whole collections through a Motor
+# cursor and get NDJSON or CSV streamed back, so memory stays flat regardless
+# of collection size. Filters mirror the query params of the list routes; the
+# transaction registers also take start_date/end_date and match item_id on
+# their lines, through the same report_query as their list routes.
+
+EXPORT_BATCH_SIZE = 2000
+EXPORT_CHUNK_ROWS = 500
+
+# export name -> collection, model whose fields become the CSV columns, the
+# query params accepted as equality filters and an optional projection
+EXPORT_COLLECTIONS: Dict[str, Dict[str, Any]] = {
+    "items": {"collection": "items", "model": ItemMaster, "projection": ITEM_PROJECTION,
+              "filters": ["category_id", "item_type", "is_active", "is_component", "is_finished_good", "status"]},
+    "item-categories": {"collection": "item_categories", "model": ItemCategory, "filters": ["parent_category", "item_type"]},
+    "uoms": {"collection": "uoms", "model": UOMMaster, "filters": ["uom_category"]},
+    "suppliers": {"collection": "suppliers", "model": SupplierMaster, "filters": ["status"]},
+    "warehouses": {"collection": "warehouses", "model": WarehouseMaster, "filters": ["status"]},
+    "bin-locations": {"collection": "bin_locations", "model": BINLocationMaster, "filters": ["warehouse_id"]},
+    "tax-hsn": {"collection": "tax_hsn", "model": TaxHSNMaster, "filters": []},
+    "purchase-orders": {"collection": "purchase_orders", "model": PurchaseOrder, "filters": ["status", "supplier_id"]},
+    "grn": {"collection": "grn", "model": GRN, "filters": ["po_id", "supplier_id", "item_id", "warehouse_id", "status"]},
+    "quality-checks": {"collection": "quality_checks", "model": QualityCheck, "filters": ["grn_id", "item_id", "qc_status"]},
+    "stock-inward": {"collection": "stock_inward", "model": StockInward, "filters": ["item_id", "warehouse_id"]},
+    "stock-transfer": {"collection": "stock_transfer", "model": StockTransfer, "filters": ["item_id", "from_warehouse_id", "to_warehouse_id"]},
+    "issues": {"collection": "issues", "model": IssueToDepartment, "filters": ["department", "item_id", "warehouse_id"]},
+    "returns": {"collection": "returns", "model": ReturnFromDepartment,
+                "filters": ["department", "item_id", "warehouse_id", "condition"]},
+    "adjustments": {"collection": "adjustments", "model": StockAdjustment,
+                    "filters": ["item_id", "warehouse_id", "reason", "status"]},
+    "stock-balance": {"collection": "stock_balance", "model": StockBalance, "filters": ["item_id", "warehouse_id"]},
+    "stock-movements": {"collection": "stock_movements", "model": StockMovement, "filters": ["item_id", "warehouse_id", "txn_type"]},
+}
+
+def export_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def parse_export_filter(value: str) -> Any:
+    if value in ("true", "false"):
+        return value == "true"
+    return value
+
+def csv_cell(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=export_default)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+async def stream_export(cursor, fmt: str, columns: List[str]):
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        rows = 0
+        async for doc in cursor:
+            writer.writerow({k: csv_cell(doc.get(k)) for k in columns})
+            rows += 1
+            if rows % EXPORT_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        lines = []
+        async for doc in cursor:
+            lines.append(json.dumps(doc, default=export_default))
+            if len(lines) >= EXPORT_CHUNK_ROWS:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+@api_router.get("/export/{collection}")
+async def export_collection(collection: str, request: Request, format: str = "ndjson"):
+    """Stream a whole collection as NDJSON or CSV, e.g. /export/items?format=csv&item_type=RM"""
+    spec = EXPORT_COLLECTIONS.get(collection)
+    if not spec:
+        raise HTTPException(status_code=404, detail=f"Unknown export collection: {collection}")
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+
+    query = {
+        field: parse_export_filter(request.query_params[field])
+        for field in spec["filters"] if field in request.query_params
+    }
+    name = spec["collection"]
+    if name in REPORT_FILTERS:
+        query = report_query(name, request.query_params.get("start_date"), request.query_params.get("end_date"),
+                             query.pop("item_id", None), **query)
+    source = getattr(report_repos, name) if name in REPOSITORY_COLLECTIONS else report_db[name]
+    cursor = source.find(query, spec.get("projection", {"_id": 0})).batch_size(EXPORT_BATCH_SIZE)
+    columns = list(spec["model"].model_fields)
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"{collection}.{'csv' if format == 'csv' else 'ndjson'}"
+    return StreamingResponse(
+        stream_export(cursor, format, columns),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# ============ Request Metrics ============
+# A plain ASGI middleware (no per-request task or body buffering) that keeps
+# per-route counters and histograms in process memory; /metrics renders them
+# in the Prometheus text format. Routes are labelled by their path template,
+# so /masters/items/{item_id} is one series whatever the id.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RESPONSE_SIZE_BUCKETS = (256, 1024, 10_240, 102_400, 1_048_576, 10_485_760)
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+def metric_label_value(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def metric_labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{k}="{metric_label_value(v)}"' for k, v in labels.items()) + "}"
+
+class RequestMetrics:
+    def __init__(self):
+        self.requests: Dict[tuple, int] = {}  # (method, route, status) -> count
+        self.exceptions: Dict[tuple, int] = {}  # (method, route) -> unhandled exceptions
+        self.latency: Dict[tuple, Histogram] = {}
+        self.response_size: Dict[tuple, Histogram] = {}
+        self.in_progress: Dict[str, int] = {}
+
+    def observe(self, method: str, route: str, status_code: int, seconds: float, size: int, failed: bool):
+        key = (method, route)
+        self.requests[(method, route, status_code)] = self.requests.get((method, route, status_code), 0) + 1
+        if failed:
+            self.exceptions[key] = self.exceptions.get(key, 0) + 1
+        if key not in self.latency:
+            self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.response_size[key] = Histogram(RESPONSE_SIZE_BUCKETS)
+        self.latency[key].observe(seconds)
+        self.response_size[key].observe(size)
+
+    def render_histogram(self, name: str, histograms: Dict[tuple, Histogram]) -> List[str]:
+        lines = []
+        for (method, route), histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.bounds + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{metric_labels(method=method, route=route, le=bound)} {cumulative}")
+            lines.append(f"{name}_sum{metric_labels(method=method, route=route)} {histogram.total}")
+            lines.append(f"{name}_count{metric_labels(method=method, route=route)} {histogram.count}")
+        return lines
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_requests_total Completed HTTP requests.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status_code), count in sorted(self.requests.items()):
+            lines.append(f"http_requests_total{metric_labels(method=method, route=route, status=status_code)} {count}")
+        lines += [
+            "# HELP http_request_exceptions_total Requests that raised an unhandled exception.",
+            "# TYPE http_request_exceptions_total counter",
+        ]
+        for (method, route), count in sorted(self.exceptions.items()):
+            lines.append(f"http_request_exceptions_total{metric_labels(method=method, route=route)} {count}")
+        lines += [
+            "# HELP http_requests_in_progress Requests currently being served.",
+            "# TYPE http_requests_in_progress gauge",
+        ]
+        for method, count in sorted(self.in_progress.items()):
+            lines.append(f"http_requests_in_progress{metric_labels(method=method)} {count}")
+        lines += [
+            "# HELP http_request_duration_seconds Time from request start to the last response byte.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        lines += self.render_histogram("http_request_duration_seconds", self.latency)
+        lines += [
+            "# HELP http_response_size_bytes Response body size.",
+            "# TYPE http_response_size_bytes histogram",
+        ]
+        lines += self.render_histogram("http_response_size_bytes", self.response_size)
+        return "\n".join(lines) + "\n"
+
+request_metrics = RequestMetrics()
+
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        response = {"status": 500, "size": 0}
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        request_metrics.in_progress[method] = request_metrics.in_progress.get(method, 0) + 1
+        started = time.perf_counter()
+        failed = False
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            request_metrics.in_progress[method] -= 1
+            # The router records the matched route in the scope; unmatched paths share one series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            request_metrics.observe(method, route, response["status"], time.perf_counter() - started,
+                                    response["size"], failed)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(request_metrics.render(), media_type="text/plain; version=0.0.4")
+
+# ============ Query Profiler ============
+# A pymongo command listener charges every command to the request that issued
+# it through a context variable (Motor copies the context into the executor
+# thread that runs the command). Each request logs its query count, database
+# time and slowest commands; DB_PROFILE_HEADER=true also returns them in an
+# X-DB-Profile header for debugging.
+
+DB_PROFILE_HEADER = os.environ.get('DB_PROFILE_HEADER', 'false').lower() == 'true'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '100'))
+# Requests issuing at least this many commands are logged as warnings (likely N+1 patterns)
+QUERY_COUNT_WARNING = int(os.environ.get('QUERY_COUNT_WARNING', '50'))
+DB_PROFILE_SLOWEST = 5
+
+class QueryProfile:
+    def __init__(self):
+        # Commands of one request can run on several executor threads at once
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total_ms = 0.0
+        self.slowest: List[tuple] = []  # min-heap of (ms, seq, command, collection)
+        self.targets: Dict[int, Optional[str]] = {}
+
+    def start(self, request_id: int, collection: Optional[str]):
+        with self.lock:
+            self.targets[request_id] = collection
+
+    def record(self, request_id: int, ms: float, command: str) -> Optional[str]:
+        """Charge a finished command to the request; returns the collection it ran on"""
+        with self.lock:
+            collection = self.targets.pop(request_id, None)
+            self.count += 1
+            self.total_ms += ms
+            heapq.heappush(self.slowest, (ms, self.count, command, collection))
+            if len(self.slowest) > DB_PROFILE_SLOWEST:
+                heapq.heappop(self.slowest)
+        return collection
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "queries": self.count,
+            "db_ms": round(self.total_ms, 2),
+            "slowest": [{"command": command, "collection": collection, "ms": round(ms, 2)}
+                        for ms, _, command, collection in sorted(self.slowest, reverse=True)]
+        }
+
+current_query_profile: ContextVar[Optional[QueryProfile]] = ContextVar("current_query_profile", default=None)
+
+class QueryProfiler(monitoring.CommandListener):
+    def started(self, event):
+        profile = current_query_profile.get()
+        if profile is not None:
+            target = event.command.get(event.command_name)
+            # getMore names its collection separately; the command value is the cursor id
+            profile.start(event.request_id, target if isinstance(target, str) else event.command.get("collection"))
+
+    def succeeded(self, event):
+        self.finished(event)
+
+    def failed(self, event):
+        self.finished(event)
+
+    def finished(self, event):
+        profile = current_query_profile.get()
+        if profile is None:
+            return
+        ms = event.duration_micros / 1000
+        collection = profile.record(event.request_id, ms, event.command_name)
+        if ms >= SLOW_QUERY_MS:
+            logger.warning(json.dumps({
+                "event": "slow_query", "command": event.command_name, "collection": collection,
+                "database": event.database_name, "ms": round(ms, 2)
+            }))
+
+class QueryProfileMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile = QueryProfile()
+        token = current_query_profile.set(profile)
+
+        async def send_with_profile(message):
+            if DB_PROFILE_HEADER and message["type"] == "http.response.start":
+                header = json.dumps(profile.summary(), separators=(",", ":")).encode()
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-db-profile", header)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            current_query_profile.reset(token)
+            if profile.count:
+                summary = profile.summary()
+                slow = summary['slowest'] and summary['slowest'][0]['ms'] >= SLOW_QUERY_MS
+                level = logging.WARNING if slow or profile.count >= QUERY_COUNT_WARNING else logging.DEBUG
+                logger.log(level, json.dumps({"event": "request_queries", "method": scope["method"],
+                                              "path": scope["path"], **summary}))
+
+query_profiler = QueryProfiler()
+command_listeners.listeners.append(query_profiler)
 
 # Include router
 app.include_router(api_router)
@@ -1642,7 +3311,10 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-DB-Profile"],
 )
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(QueryProfileMiddleware)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -1650,6 +3322,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_index_registry():
+    app.state.index_registry_task = asyncio.create_task(ensure_index_registry())
+
+@app.on_event("startup")
+async def startup_backfills():
+    await ensure_category_tree_index()
+    await ensure_item_search_index()
+    await ensure_stock_ledger()
+
+@app.on_event("startup")
+async def start_dashboard_reconcile():
+    app.state.dashboard_reconcile_task = asyncio.create_task(dashboard_reconcile_loop())
+
+@app.on_event("startup")
+async def start_datetime_migration():
+    app.state.datetime_migration_task = asyncio.create_task(migrate_datetimes())
+
+@app.on_event("startup")
+async def start_stock_snapshots():
+    app.state.stock_snapshot_task = asyncio.create_task(stock_snapshot_loop())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    app.state.dashboard_reconcile_task.cancel()
+    app.state.stock_snapshot_task.cancel()
+    app.state.datetime_migration_task.cancel()
+    app.state.index_registry_task.cancel()
     client.close()
+    report_client.close()
@@ -0,0 +1,256 @@
+"""
+Micro-benchmark the hot API endpoints in-process.
+
+Seeds a throwaway database with realistic volumes (10k items, 1M stock
+movements by default), drives the FastAPI app through the httpx ASGI transport
+(no network, no uvicorn) and records ops/sec and p50/p95/p99 latency per
+endpoint into a JSON results file. Pass an earlier results file with
+--baseline to print the change per endpoint.
+
+Usage:
+    pip install httpx
+    BENCH_DB_NAME=erp_benchmark python scripts/benchmark_endpoints.py [--requests 200] [--output results.json]
+
+    # No mongod: every collection lives in process memory (server.use_memory_backend)
+    python scripts/benchmark_endpoints.py --backend memory --movements 100000
+
+With --backend mongod, MONGO_URL comes from backend/.env as usual; the
+benchmark database is dropped at the end, so never point BENCH_DB_NAME at
+real data.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ['DB_NAME'] = os.environ.get('BENCH_DB_NAME', 'erp_benchmark')
+
+import server  # noqa: E402
+
+# One INFO line per request would swamp the results
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+WAREHOUSES = [("WH-1", "Main Store"), ("WH-2", "Trims Store")]
+ITEM_TYPES = ["FAB", "RM", "ACC", "PKG", "FG"]
+WORDS = ["Cotton", "Poly", "Denim", "Button", "Zipper", "Thread", "Label", "Carton", "Lining", "Elastic",
+         "Shirt", "Trouser", "Twill", "Satin", "Hook", "Tape", "Poplin", "Fleece", "Canvas", "Lycra"]
+SEED_BATCH = 10000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["mongod", "memory"], default="mongod")
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--movements", type=int, default=1000000)
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=10, help="untimed requests per endpoint")
+    parser.add_argument("--only", nargs="*", help="endpoint names to run (default: all)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+
+# ============ Seeding ============
+
+async def seed(repos, items_count, movements_count, rng):
+    """Items with search tokens, two warehouses of balances and a year of movements that sum to them"""
+    now = datetime.now(timezone.utc)
+    items = []
+    for n in range(items_count):
+        name = f"{rng.choice(WORDS)} {rng.choice(WORDS)} {n}"
+        item = server.ItemMaster(
+            item_code=f"BENCH-{n:06d}", item_name=name, item_type=rng.choice(ITEM_TYPES),
+            category_id="bench", category_name="Bench", uom="PCS", reorder_level=rng.choice([0, 50, 500])
+        ).model_dump()
+        item['search_tokens'] = server.build_search_tokens(item['item_name'], item['item_code'])
+        items.append(item)
+    for start in range(0, len(items), SEED_BATCH):
+        await repos.items.insert_many(items[start:start + SEED_BATCH])
+
+    # Movements mirror StockMovement; built as plain dicts because a million models is slow
+    totals = {}
+    batch = []
+    span = timedelta(days=365).total_seconds()
+    for n in range(movements_count):
+        item = items[n % items_count]
+        warehouse_id, _ = WAREHOUSES[(n // items_count) % len(WAREHOUSES)]
+        key = (item['id'], warehouse_id)
+        if key not in totals:
+            txn_type, qty = "OPENING", 100000.0
+        elif rng.random() < 0.5:
+            txn_type, qty = "INWARD", float(rng.randint(1, 100))
+        else:
+            txn_type, qty = "ISSUE", -float(rng.randint(1, 100))
+        totals[key] = totals.get(key, 0.0) + qty
+        batch.append({
+            "id": f"bench-mv-{n}", "txn_type": txn_type, "txn_id": None, "txn_no": f"{txn_type}-{n}",
+            "item_id": item['id'], "item_name": item['item_name'], "warehouse_id": warehouse_id,
+            "qty": qty, "uom": "PCS", "posted_at": now - timedelta(seconds=span * (1 - n / movements_count))
+        })
+        if len(batch) >= SEED_BATCH:
+            await repos.stock_movements.insert_many(batch)
+            batch = []
+    if batch:
+        await repos.stock_movements.insert_many(batch)
+
+    warehouse_names = dict(WAREHOUSES)
+    by_id = {item['id']: item for item in items}
+    balances = [server.StockBalance(
+        item_id=item_id, item_name=by_id[item_id]['item_name'], warehouse_id=warehouse_id,
+        warehouse_name=warehouse_names[warehouse_id], qty=qty, uom="PCS"
+    ).model_dump() for (item_id, warehouse_id), qty in totals.items()]
+    for start in range(0, len(balances), SEED_BATCH):
+        await repos.stock_balance.insert_many(balances[start:start + SEED_BATCH])
+    return items
+
+
+# ============ Endpoints ============
+
+def build_endpoints(items, rng):
+    """name -> (method, request factory); factories return (path, params, body)"""
+    def item():
+        return rng.choice(items)
+
+    def issue():
+        line = item()
+        return "/api/inventory/issue", None, {
+            "issue_no": "", "department": "Cutting", "item_id": line['id'], "item_name": line['item_name'],
+            "qty": 1, "uom": "PCS", "warehouse_id": "WH-1", "warehouse_name": "Main Store", "issued_by": "bench"
+        }
+
+    def inward():
+        lines = [item() for _ in range(3)]
+        return "/api/inventory/stock-inward", None, {
+            "inward_no": f"BENCH-IN-{rng.randrange(10 ** 9)}", "qc_id": "bench", "warehouse_id": "WH-1",
+            "created_by": "bench",
+            "items": [{"item_id": line['id'], "item_name": line['item_name'], "qty": 5, "uom": "PCS"} for line in lines]
+        }
+
+    def grn():
+        line = item()
+        return "/api/inventory/grn", None, {
+            "grn_no": "", "po_id": "bench", "po_no": "PO-BENCH", "supplier_id": "bench", "supplier_name": "Bench",
+            "item_id": line['id'], "item_name": line['item_name'], "qty": 10, "uom": "PCS",
+            "warehouse_id": "WH-1", "received_by": "bench"
+        }
+
+    return {
+        "items_list": ("GET", lambda: ("/api/masters/items", {"limit": 50}, None)),
+        "items_search": ("GET", lambda: ("/api/masters/items/search", {"q": rng.choice(WORDS)[:4]}, None)),
+        "item_get": ("GET", lambda: (f"/api/masters/items/{item()['id']}", None, None)),
+        "items_low_stock": ("GET", lambda: ("/api/masters/items/low-stock", None, None)),
+        "stock_balance": ("GET", lambda: ("/api/inventory/stock-balance", {"limit": 50}, None)),
+        "stock_movements_by_item": ("GET", lambda: ("/api/inventory/stock-movements", {"item_id": item()['id']}, None)),
+        "stock_ledger": ("GET", lambda: ("/api/reports/stock-ledger", {"item_id": item()['id'], "warehouse_id": "WH-1"}, None)),
+        "dashboard_stats": ("GET", lambda: ("/api/dashboard/stats", None, None)),
+        "issue_post": ("POST", issue),
+        "stock_inward_post": ("POST", inward),
+        "grn_post": ("POST", grn),
+    }
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list"""
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+async def measure(client, method, factory, requests, warmup):
+    for _ in range(warmup):
+        path, params, body = factory()
+        (await client.request(method, path, params=params, json=body)).raise_for_status()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        path, params, body = factory()
+        request_started = time.perf_counter()
+        response = await client.request(method, path, params=params, json=body)
+        latencies.append((time.perf_counter() - request_started) * 1000)
+        response.raise_for_status()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "ops_per_sec": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
+
+
+def print_results(results, baseline):
+    print("=" * 96)
+    print(f"ENDPOINT BENCHMARK ({results['backend']}, {results['items']} items, {results['movements']} movements)")
+    print("=" * 96)
+    header = f"{'endpoint':<26}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header + (f"{'base ops/s':>14}{'change':>10}" if baseline else ""))
+    previous = (baseline or {}).get("endpoints", {})
+    for name, stats in results['endpoints'].items():
+        line = f"{name:<26}{stats['ops_per_sec']:>10.1f}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+        if name in previous:
+            base = previous[name]['ops_per_sec']
+            line += f"{base:>14.1f}{(stats['ops_per_sec'] - base) / base:>+10.1%}"
+        print(line)
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    if args.backend == "memory":
+        server.use_memory_backend()
+    db = server.db
+
+    seed_started = time.perf_counter()
+    items = await seed(server.repos, args.items, args.movements, rng)
+    seed_seconds = time.perf_counter() - seed_started
+    await server.app.router.startup()
+    await server.app.state.index_registry_task
+
+    endpoints = build_endpoints(items, rng)
+    results = {
+        "backend": args.backend,
+        "items": args.items,
+        "movements": args.movements,
+        "requests_per_endpoint": args.requests,
+        "seed_seconds": round(seed_seconds, 1),
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "endpoints": {},
+    }
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name, (method, factory) in endpoints.items():
+                if args.only and name not in args.only:
+                    continue
+                results['endpoints'][name] = await measure(client, method, factory, args.requests, args.warmup)
+    finally:
+        if args.backend == "mongod":
+            await db.client.drop_database(db.name)
+        await server.app.router.shutdown()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,105 @@
+"""
+Benchmark list endpoints with and without FAST_LIST_RESPONSES.
+
+Seeds a throwaway database with ROWS documents per collection, then drives
+the FastAPI app in-process (httpx ASGI transport, no network) and reports
+requests/second for full pages of each list endpoint in both response modes.
+
+Usage:
+    pip install httpx
+    BENCH_DB_NAME=erp_benchmark python scripts/benchmark_list_responses.py [rows] [requests]
+
+MONGO_URL comes from backend/.env as usual; the benchmark database is dropped
+at the end, so never point BENCH_DB_NAME at real data.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND_DIR))
+os.environ['DB_NAME'] = os.environ.get('BENCH_DB_NAME', 'erp_benchmark')
+
+import server  # noqa: E402
+
+ENDPOINTS = [
+    "/api/masters/items",
+    "/api/masters/suppliers",
+    "/api/inventory/stock-balance",
+    "/api/inventory/issue",
+    "/api/inventory/stock-movements",
+]
+
+
+async def seed(db, rows):
+    items = [server.ItemMaster(
+        item_code=f"BENCH-{n:05d}", item_name=f"Bench item {n}", item_type="RM", category_id="bench",
+        category_name="Bench", uom="PCS", reorder_level=10, description="Seeded by benchmark_list_responses"
+    ) for n in range(rows)]
+    await db.items.insert_many([item.model_dump() for item in items])
+    await db.suppliers.insert_many([server.SupplierMaster(
+        supplier_code=f"SUP-{n:05d}", name=f"Bench supplier {n}", address="Industrial Area", status="Active"
+    ).model_dump() for n in range(rows)])
+    await db.stock_balance.insert_many([server.StockBalance(
+        item_id=item.id, item_name=item.item_name, warehouse_id="WH-1", warehouse_name="Main Store", qty=100, uom="PCS"
+    ).model_dump() for item in items])
+    await db.issues.insert_many([server.IssueToDepartment(
+        issue_no=f"ISS-{n:05d}", department="Cutting", item_id=item.id, item_name=item.item_name, qty=1, uom="PCS",
+        warehouse_id="WH-1", warehouse_name="Main Store", issued_by="bench"
+    ).model_dump() for n, item in enumerate(items)])
+    await db.stock_movements.insert_many([server.StockMovement(
+        txn_type="ISSUE", txn_id=str(n), txn_no=f"ISS-{n:05d}", item_id=item.id, item_name=item.item_name,
+        warehouse_id="WH-1", qty=-1, uom="PCS"
+    ).model_dump() for n, item in enumerate(items)])
+
+
+async def measure(client, path, rows, requests):
+    params = {"limit": rows}
+    await client.get(path, params=params)  # warm-up
+    started = time.perf_counter()
+    for _ in range(requests):
+        response = await client.get(path, params=params)
+        response.raise_for_status()
+    elapsed = time.perf_counter() - started
+    return requests / elapsed, response.content
+
+
+async def run(rows=1000, requests=50):
+    db = server.db
+    await server.app.router.startup()
+    await seed(db, rows)
+
+    results = []
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for path in ENDPOINTS:
+            server.FAST_LIST_RESPONSES = False
+            default_rps, default_body = await measure(client, path, rows, requests)
+            server.FAST_LIST_RESPONSES = True
+            fast_rps, fast_body = await measure(client, path, rows, requests)
+            if json.loads(default_body) != json.loads(fast_body):
+                raise RuntimeError(f"{path}: response modes returned different JSON")
+            results.append((path, default_rps, fast_rps))
+
+    print("=" * 80)
+    print(f"LIST RESPONSE BENCHMARK ({rows} rows per page, {requests} requests per mode)")
+    print("=" * 80)
+    print(f"{'endpoint':<36}{'default req/s':>14}{'fast req/s':>14}{'speedup':>10}")
+    for path, default_rps, fast_rps in results:
+        print(f"{path:<36}{default_rps:>14.1f}{fast_rps:>14.1f}{fast_rps / default_rps:>9.2f}x")
+
+    await db.client.drop_database(db.name)
+    await server.app.router.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    asyncio.run(run(rows, requests))
@@ -0,0 +1,353 @@
+"""
+Concurrent load generator for realistic ERP workloads.
+
+Runs a weighted mix of item searches, GRN posts, issues, stock inwards and
+dashboard polls with many requests in flight, then reports throughput and
+latency percentiles per operation and checks the data for correctness:
+
+- no duplicate grn_no / issue_no values (number series allocation)
+- no negative stock balances
+- every touched balance moved by exactly the net of the accepted postings
+  (no lost updates)
+
+Issues hit a small set of hot balances on purpose so they contend with each
+other and run stock down to zero; "insufficient stock" rejections are counted
+separately from errors.
+
+Two arrival models:
+    closed loop (default)  --concurrency workers each send the next request as
+                           soon as the previous one returns
+    open loop (--rate N)   N requests/second with Poisson arrivals, at most
+                           --concurrency in flight; latency is measured from the
+                           scheduled arrival so queueing is not hidden
+
+Usage:
+    pip install httpx
+    # In-process against a throwaway database (seeded, dropped afterwards)
+    BENCH_DB_NAME=erp_loadtest python scripts/load_test.py --duration 30 --concurrency 50
+    python scripts/load_test.py --backend memory --duration 10
+    # Against a running server and its existing data (nothing is dropped)
+    python scripts/load_test.py --url http://localhost:8001 --rate 200 --mix search=60,issue=20,dashboard=20
+
+Exits with status 1 when a correctness check fails.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import httpx
+
+# One INFO line per request would swamp the report
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+BACKEND_DIR = Path(__file__).parent.parent / 'backend'
+WORDS = ["Cotton", "Poly", "Denim", "Button", "Zipper", "Thread", "Label", "Carton", "Lining", "Elastic"]
+DEFAULT_MIX = "search=40,grn=15,issue=25,inward=5,dashboard=15"
+PAGE_SIZE = 1000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running server; default runs the app in-process")
+    parser.add_argument("--backend", choices=["mongod", "memory"], default="mongod",
+                        help="database for in-process runs (memory: every collection in process memory)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--concurrency", type=int, default=20, help="workers, or max in flight with --rate")
+    parser.add_argument("--rate", type=float, help="open-loop arrival rate in requests/second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--items", type=int, default=2000, help="items seeded for in-process runs")
+    parser.add_argument("--opening-qty", type=float, default=200, help="opening balance per seeded item")
+    parser.add_argument("--hot-balances", type=int, default=10, help="balances that issues contend on")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args()
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPERATIONS:
+            sys.exit(f"unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+# ============ In-process target ============
+
+def load_server(backend):
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.environ['DB_NAME'] = os.environ.get('BENCH_DB_NAME', 'erp_loadtest')
+    import server
+    if backend == "memory":
+        server.use_memory_backend()
+    return server
+
+
+async def seed(server, items_count, opening_qty, rng):
+    """Items with search tokens and one opening balance each in the main store"""
+    items = []
+    for n in range(items_count):
+        item = server.ItemMaster(
+            item_code=f"LOAD-{n:06d}", item_name=f"{rng.choice(WORDS)} {rng.choice(WORDS)} {n}",
+            category_id="load", category_name="Load", uom="PCS", reorder_level=20
+        ).model_dump()
+        item['search_tokens'] = server.build_search_tokens(item['item_name'], item['item_code'])
+        items.append(item)
+    await server.repos.items.insert_many(items)
+    await server.repos.stock_balance.insert_many([server.StockBalance(
+        item_id=item['id'], item_name=item['item_name'], warehouse_id="WH-1", warehouse_name="Main Store",
+        qty=opening_qty, uom="PCS"
+    ).model_dump() for item in items])
+
+
+# ============ Operations ============
+
+class LoadState:
+    def __init__(self, balances, hot_count, rng):
+        self.rng = rng
+        self.balances = balances
+        self.hot = rng.sample(balances, min(hot_count, len(balances)))
+        self.words = sorted({row['item_name'].split()[0] for row in balances}) or WORDS
+        # Net quantity accepted per (item_id, warehouse_id), from successful postings
+        self.net = defaultdict(float)
+        self.numbers = Counter()
+
+    def key(self, row):
+        return row['item_id'], row['warehouse_id']
+
+
+async def op_search(client, state):
+    return await client.get("/api/masters/items/search", params={"q": state.rng.choice(state.words)[:4]}), None
+
+
+async def op_dashboard(client, state):
+    return await client.get("/api/dashboard/stats"), None
+
+
+async def op_grn(client, state):
+    row = state.rng.choice(state.balances)
+    response = await client.post("/api/inventory/grn", json={
+        "grn_no": "", "po_id": "load", "po_no": "PO-LOAD", "supplier_id": "load", "supplier_name": "Load test",
+        "item_id": row['item_id'], "item_name": row['item_name'], "qty": 10, "uom": row['uom'],
+        "warehouse_id": row['warehouse_id'], "received_by": "load"
+    })
+    if response.status_code == 200:
+        state.numbers[response.json()['grn_no']] += 1
+    return response, None
+
+
+async def op_issue(client, state):
+    row = state.rng.choice(state.hot)
+    qty = state.rng.randint(1, 5)
+    response = await client.post("/api/inventory/issue", json={
+        "issue_no": "", "department": "Cutting", "item_id": row['item_id'], "item_name": row['item_name'],
+        "qty": qty, "uom": row['uom'], "warehouse_id": row['warehouse_id'],
+        "warehouse_name": row.get('warehouse_name', ''), "issued_by": "load"
+    })
+    if response.status_code == 200:
+        state.net[state.key(row)] -= qty
+        state.numbers[response.json()['issue_no']] += 1
+    # Running a balance dry is expected under contention, not an error
+    rejected = response.status_code == 400 and "Insufficient stock" in response.text
+    return response, rejected
+
+
+async def op_inward(client, state):
+    row = state.rng.choice(state.hot)
+    qty = state.rng.randint(5, 20)
+    response = await client.post("/api/inventory/stock-inward", json={
+        "inward_no": f"LOAD-IN-{state.rng.randrange(10 ** 9)}", "qc_id": "load", "warehouse_id": row['warehouse_id'],
+        "created_by": "load",
+        "items": [{"item_id": row['item_id'], "item_name": row['item_name'], "qty": qty, "uom": row['uom']}]
+    })
+    if response.status_code == 200:
+        state.net[state.key(row)] += qty
+    return response, None
+
+
+OPERATIONS = {
+    "search": op_search,
+    "grn": op_grn,
+    "issue": op_issue,
+    "inward": op_inward,
+    "dashboard": op_dashboard,
+}
+
+
+# ============ Driver ============
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.ok = Counter()
+        self.rejected = Counter()
+        self.errors = Counter()
+        self.error_samples = {}
+
+    async def call(self, name, client, state, scheduled=None):
+        started = scheduled if scheduled is not None else time.perf_counter()
+        try:
+            response, rejected = await OPERATIONS[name](client, state)
+        except httpx.HTTPError as exc:
+            self.errors[name] += 1
+            self.error_samples.setdefault(name, repr(exc))
+            return
+        self.latencies[name].append((time.perf_counter() - started) * 1000)
+        if rejected:
+            self.rejected[name] += 1
+        elif response.status_code >= 400:
+            self.errors[name] += 1
+            self.error_samples.setdefault(name, f"{response.status_code} {response.text[:200]}")
+        else:
+            self.ok[name] += 1
+
+
+async def closed_loop(client, state, recorder, mix, args):
+    names, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + args.duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await recorder.call(state.rng.choices(names, weights)[0], client, state)
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+
+async def open_loop(client, state, recorder, mix, args):
+    names, weights = list(mix), list(mix.values())
+    slots = asyncio.Semaphore(args.concurrency)
+    tasks = set()
+
+    async def fire(name, scheduled):
+        async with slots:
+            await recorder.call(name, client, state, scheduled)
+
+    started = time.perf_counter()
+    next_at = started
+    while next_at < started + args.duration:
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        task = asyncio.create_task(fire(state.rng.choices(names, weights)[0], next_at))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        next_at += state.rng.expovariate(args.rate)
+    await asyncio.gather(*tasks)
+
+
+async def fetch_all(client, path):
+    """Every row of a paginated list endpoint, following X-Next-Cursor"""
+    rows, cursor = [], None
+    while True:
+        params = {"limit": PAGE_SIZE, **({"cursor": cursor} if cursor else {})}
+        response = await client.get(path, params=params)
+        response.raise_for_status()
+        rows.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return rows
+
+
+async def check_correctness(client, state, opening):
+    failures = []
+    for path, field in [("/api/inventory/grn", "grn_no"), ("/api/inventory/issue", "issue_no")]:
+        counts = Counter(row.get(field) for row in await fetch_all(client, path) if row.get(field))
+        duplicates = {number: n for number, n in counts.items() if n > 1}
+        if duplicates:
+            failures.append(f"duplicate {field}: {sorted(duplicates)[:10]} ({len(duplicates)} total)")
+    returned = {number: n for number, n in state.numbers.items() if n > 1}
+    if returned:
+        failures.append(f"numbers handed out twice in responses: {sorted(returned)[:10]}")
+
+    balances = {state.key(row): row['qty'] for row in await fetch_all(client, "/api/inventory/stock-balance")}
+    negative = {key: qty for key, qty in balances.items() if qty < -1e-9}
+    if negative:
+        failures.append(f"negative balances: {list(negative.items())[:10]} ({len(negative)} total)")
+    drifted = [(key, opening.get(key, 0.0) + net, balances.get(key, 0.0))
+               for key, net in state.net.items() if abs(opening.get(key, 0.0) + net - balances.get(key, 0.0)) > 1e-6]
+    if drifted:
+        failures.append(f"balances not matching accepted postings (key, expected, actual): {drifted[:10]}")
+    return failures
+
+
+def percentile(sorted_values, pct):
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def print_report(recorder, elapsed, args, failures):
+    mode = f"open loop {args.rate:g} req/s" if args.rate else "closed loop"
+    print("=" * 100)
+    print(f"LOAD TEST ({mode}, concurrency {args.concurrency}, {elapsed:.1f}s)")
+    print("=" * 100)
+    print(f"{'operation':<12}{'ok':>8}{'rejected':>10}{'errors':>8}{'req/s':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    total = 0
+    for name in OPERATIONS:
+        latencies = sorted(recorder.latencies.get(name, []))
+        if not latencies and not recorder.errors[name]:
+            continue
+        total += len(latencies)
+        stats = [percentile(latencies, p) for p in (50, 95, 99)] + [latencies[-1]] if latencies else [0.0] * 4
+        print(f"{name:<12}{recorder.ok[name]:>8}{recorder.rejected[name]:>10}{recorder.errors[name]:>8}"
+              f"{len(latencies) / elapsed:>10.1f}" + "".join(f"{value:>10.1f}" for value in stats))
+    print(f"{'total':<12}{'':>26}{total / elapsed:>10.1f}")
+    for name, sample in recorder.error_samples.items():
+        print(f"first {name} error: {sample}")
+    print("-" * 100)
+    if failures:
+        for failure in failures:
+            print(f"FAIL {failure}")
+    else:
+        print("PASS no duplicate document numbers, no negative balances, no lost stock updates")
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    server = None
+    if args.url:
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=args.concurrency))
+        base_url = args.url.rstrip("/")
+    else:
+        server = load_server(args.backend)
+        await seed(server, args.items, args.opening_qty, rng)
+        await server.app.router.startup()
+        transport = httpx.ASGITransport(app=server.app)
+        base_url = "http://load"
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=args.timeout) as client:
+            balance_rows = await fetch_all(client, "/api/inventory/stock-balance")
+            if not balance_rows:
+                sys.exit("no stock balances to work with; seed the target first")
+            state = LoadState(balance_rows, args.hot_balances, rng)
+            opening = {state.key(row): row['qty'] for row in balance_rows}
+
+            recorder = Recorder()
+            started = time.perf_counter()
+            if args.rate:
+                await open_loop(client, state, recorder, mix, args)
+            else:
+                await closed_loop(client, state, recorder, mix, args)
+            elapsed = time.perf_counter() - started
+
+            failures = await check_correctness(client, state, opening)
+    finally:
+        if server:
+            if args.backend == "mongod":
+                await server.db.client.drop_database(server.db.name)
+            await server.app.router.shutdown()
+
+    print_report(recorder, elapsed, args, failures)
+    return not failures
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(run(parse_args())) else 1)
@@ -0,0 +1,37 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+def issue(n, issued_at, item_ids):
+    return {
+        "id": f"iss-{n}", "issue_no": f"ISS{n:04d}", "department": "Cutting", "warehouse_id": "WH-1",
+        "warehouse_name": "Main Store", "issued_by": "test", "issued_at": issued_at,
+        "items": [{"item_id": item_id, "item_name": item_id, "qty": 1, "uom": "PCS"} for item_id in item_ids]
+    }
+
+
+async def test_register_export_filters_like_the_list_route(client, memory):
+    await memory.issues.insert_many([
+        issue(1, datetime(2026, 2, 1, 9, tzinfo=timezone.utc), ["i1"]),
+        issue(2, datetime(2026, 2, 15, 9, tzinfo=timezone.utc), ["i2", "i1"]),
+        issue(3, datetime(2026, 2, 20, 9, tzinfo=timezone.utc), ["i2"]),
+        issue(4, datetime(2026, 3, 2, 9, tzinfo=timezone.utc), ["i1"]),
+    ])
+    params = {"start_date": "2026-02-10", "end_date": "2026-02-28", "item_id": "i1"}
+
+    exported = await client.get("/api/export/issues", params=params)
+    listed = await client.get("/api/inventory/issue", params=params)
+
+    assert exported.status_code == 200
+    ids = [json.loads(line)['id'] for line in exported.text.splitlines()]
+    assert ids == ["iss-2"]
+    assert [row['id'] for row in listed.json()] == ids
+
+
+async def test_register_export_rejects_a_bad_date(client, memory):
+    response = await client.get("/api/export/grn", params={"start_date": "last week"})
+    assert response.status_code == 400
@@ -0,0 +1,31 @@
+import pytest
+from pymongo.errors import OperationFailure
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+SPEC = {"collection": "items", "keys": [("item_code", 1)], "unique": True}
+
+
+def failing_create_index(calls, code):
+    async def create_index(keys, unique=False):
+        calls.append(unique)
+        if unique:
+            raise OperationFailure("index build failed", code)
+    return create_index
+
+
+async def test_duplicate_rows_fall_back_to_a_plain_index(memory, monkeypatch):
+    calls = []
+    monkeypatch.setattr(memory.items, "create_index", failing_create_index(calls, 11000))
+    await server.ensure_index(SPEC)
+    assert calls == [True, False]
+
+
+async def test_index_conflicts_are_not_retried(memory, monkeypatch):
+    calls = []
+    monkeypatch.setattr(memory.items, "create_index", failing_create_index(calls, 85))
+    with pytest.raises(OperationFailure):
+        await server.ensure_index(SPEC)
+    assert calls == [True]
@@ -0,0 +1,31 @@
+import threading
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_upload_is_parsed_off_the_event_loop_in_batches(client, memory, monkeypatch):
+    await memory.item_categories.insert_one({"id": "c", "code": "LBL", "name": "Labels", "item_type": "RM",
+                                             "allowed_uoms": ["PCS"]})
+    reader_threads = set()
+    read_import_rows = server.read_import_rows
+
+    def tracked_rows(upload, fmt):
+        for row in read_import_rows(upload, fmt):
+            reader_threads.add(threading.get_ident())
+            yield row
+    monkeypatch.setattr(server, "read_import_rows", tracked_rows)
+    monkeypatch.setattr(server, "IMPORT_BATCH_SIZE", 2)
+
+    data = "item_name,category_code,uom\n" + "".join(f"Label {n},LBL,PCS\n" for n in range(5)) + "Bad,LBL,KG\n"
+    response = await client.post("/api/masters/items/import", files={"file": ("items.csv", data, "text/csv")})
+
+    assert response.status_code == 200
+    result = response.json()
+    assert (result['total_rows'], result['inserted'], result['failed']) == (6, 5, 1)
+    assert result['errors'][0]['row'] == 6
+    assert await memory.items.count_documents({}) == 5
+    assert reader_threads and threading.get_ident() not in reader_threads
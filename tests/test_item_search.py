@@ -0,0 +1,18 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_capped_token_candidates_are_the_lowest_codes(client, memory, monkeypatch):
+    monkeypatch.setattr(server, "SEARCH_CANDIDATES", 3)
+    await memory.items.insert_many([
+        {"id": f"i{n}", "item_code": f"RM-LBL-{n:04d}", "item_name": f"Woven label {n}", "is_active": True,
+         "search_tokens": server.build_search_tokens(f"Woven label {n}", f"RM-LBL-{n:04d}")}
+        for n in range(10, 0, -1)
+    ])
+
+    response = await client.get("/api/masters/items/search", params={"q": "woven label"})
+
+    assert [item['item_code'] for item in response.json()] == ["RM-LBL-0001", "RM-LBL-0002", "RM-LBL-0003"]
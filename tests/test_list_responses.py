@@ -0,0 +1,26 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_fast_list_responses_match_the_response_model(client, memory, monkeypatch):
+    await memory.stock_balance.insert_many([
+        {"id": "sb-1", "item_id": "i1", "item_name": "Thread", "warehouse_id": "WH-1", "warehouse_name": "Main Store",
+         "qty": 4.5, "uom": "PCS", "last_updated": datetime(2026, 3, 1, 10, tzinfo=timezone.utc)},
+        # Legacy row: no qty, plus a field the model doesn't declare
+        {"id": "sb-2", "item_id": "i2", "item_name": "Button", "warehouse_id": "WH-1", "warehouse_name": "Main Store",
+         "uom": "PCS", "last_updated": datetime(2026, 3, 2, 10, tzinfo=timezone.utc), "legacy_bin": "A-1"},
+    ])
+
+    default = await client.get("/api/inventory/stock-balance")
+    monkeypatch.setattr(server, "FAST_LIST_RESPONSES", True)
+    fast = await client.get("/api/inventory/stock-balance")
+
+    assert default.status_code == fast.status_code == 200
+    assert fast.json() == default.json()
+    assert [row['qty'] for row in fast.json()] == [4.5, 0.0]
+    assert all("legacy_bin" not in row for row in fast.json())
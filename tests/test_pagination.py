@@ -0,0 +1,26 @@
+from datetime import datetime, timezone, timedelta
+
+import pytest
+from fastapi import Response
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_pages_cross_rows_whose_sort_key_is_not_a_date(memory):
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    rows = [{"id": "missing"}, {"id": "null", "created_at": None}, {"id": "unparsed", "created_at": "01/02/2026"},
+            {"id": "stale", "created_at": "2026-01-03T00:00:00"}]
+    rows += [{"id": f"date-{n}", "created_at": start + timedelta(days=n)} for n in range(4)]
+    await memory.warehouses.insert_many(rows)
+
+    seen, cursor = [], None
+    while True:
+        response = Response()
+        page = await server.find_page(memory.warehouses, {}, response, cursor, 1)
+        seen += [row['id'] for row in page]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == ["missing", "null", "unparsed", "stale", "date-0", "date-1", "date-2", "date-3"]
@@ -0,0 +1,44 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_pending_po(client):
+    response = await client.post("/api/purchase/orders", json={
+        "po_no": "", "supplier_id": "s1", "supplier_name": "Supplier", "items": [], "subtotal": 0,
+        "tax_amount": 0, "total_amount": 0, "status": "Pending", "created_by": "test"
+    })
+    assert response.status_code == 200
+    return response.json()['id']
+
+
+async def pending_pos(memory):
+    stats = await memory.dashboard_stats.find_one({"id": server.DASHBOARD_STATS_ID})
+    return stats['pending_pos']
+
+
+async def test_approve_without_a_token_updates_status_and_counter(client, memory):
+    po_id = await create_pending_po(client)
+    assert await pending_pos(memory) == 1
+
+    response = await client.put(f"/api/purchase/orders/{po_id}/approve")
+
+    assert response.status_code == 200
+    po = await memory.purchase_orders.find_one({"id": po_id})
+    assert (po['status'], po['approved_by']) == ("Approved", None)
+    assert await pending_pos(memory) == 0
+
+
+async def test_reject_records_the_token_user(client, memory):
+    po_id = await create_pending_po(client)
+    user = server.User(id="u1", email="buyer@example.com", name="Buyer", role="Purchase")
+    headers = {"Authorization": f"Bearer {server.create_jwt_token(user)}"}
+
+    response = await client.put(f"/api/purchase/orders/{po_id}/reject", headers=headers)
+
+    assert response.status_code == 200
+    po = await memory.purchase_orders.find_one({"id": po_id})
+    assert (po['status'], po['approved_by']) == ("Rejected", "u1")
+    assert await pending_pos(memory) == 0
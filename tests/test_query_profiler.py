@@ -0,0 +1,37 @@
+import asyncio
+import json
+import types
+
+import httpx
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def event(request_id, command, duration_micros=0):
+    return types.SimpleNamespace(request_id=request_id, command_name="find", command=command,
+                                 duration_micros=duration_micros, database_name="erp_test")
+
+
+async def test_commands_on_executor_threads_are_charged_to_their_request(monkeypatch):
+    monkeypatch.setattr(server, "DB_PROFILE_HEADER", True)
+
+    def run_command(request_id):
+        server.command_listeners.started(event(request_id, {"find": "items"}))
+        server.command_listeners.succeeded(event(request_id, {}, 1500))
+
+    async def app(scope, receive, send):
+        # Motor runs commands on executor threads, which see the request's context
+        await asyncio.gather(*(asyncio.to_thread(run_command, n) for n in range(40)))
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    transport = httpx.ASGITransport(app=server.QueryProfileMiddleware(app))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.get("/")
+
+    profile = json.loads(response.headers["x-db-profile"])
+    assert (profile['queries'], profile['db_ms']) == (40, 60.0)
+    assert {row['collection'] for row in profile['slowest']} == {"items"}
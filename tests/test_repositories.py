@@ -0,0 +1,84 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def inward(item_id, qty, warehouse_id="WH-1"):
+    return {
+        "inward_no": "", "qc_id": "qc", "warehouse_id": warehouse_id, "created_by": "test",
+        "items": [{"item_id": item_id, "item_name": item_id.upper(), "qty": qty, "uom": "PCS"}]
+    }
+
+
+def issue(item_id, qty, warehouse_id="WH-1"):
+    return {
+        "issue_no": "", "department": "Cutting", "item_id": item_id, "item_name": item_id.upper(), "qty": qty,
+        "uom": "PCS", "warehouse_id": warehouse_id, "warehouse_name": "Main Store", "issued_by": "test"
+    }
+
+
+async def test_datetimes_are_stored_and_compared_like_bson(memory):
+    posted_at = datetime(2026, 3, 1, 10, 0, 0, 123456)
+    await memory.stock_movements.insert_one({"id": "m1", "posted_at": posted_at})
+
+    stored = await memory.stock_movements.find_one({"id": "m1"})
+    assert stored['posted_at'] == datetime(2026, 3, 1, 10, 0, 0, 123000, tzinfo=timezone.utc)
+    # Naive values in queries are UTC, as json_util.loads returns them for cursors
+    assert await memory.stock_movements.count_documents({"posted_at": {"$gt": datetime(2026, 3, 1, 9)}}) == 1
+    assert await memory.stock_movements.count_documents({"posted_at": datetime(2026, 3, 1, 10, 0, 0, 123000)}) == 1
+
+
+async def test_collections_outside_the_repositories_are_held_in_memory(memory):
+    assert server.db is memory
+    await server.db.warehouses.insert_one({"id": "WH-1", "warehouse_name": "Main Store"})
+    assert await memory["warehouses"].find_one({"id": "WH-1"}, {"_id": 0}) == {
+        "id": "WH-1", "warehouse_name": "Main Store"
+    }
+    with pytest.raises(server.DuplicateKeyError):
+        await server.db.warehouses.insert_one({"id": "WH-1"})
+
+
+async def test_stock_posting_moves_balance_and_ledger(client, memory):
+    assert (await client.post("/api/inventory/stock-inward", json=inward("i1", 10))).status_code == 200
+    assert (await client.post("/api/inventory/issue", json=issue("i1", 4))).status_code == 200
+
+    response = await client.post("/api/inventory/issue", json=issue("i1", 100))
+    assert response.status_code == 400
+
+    balance = await memory.stock_balance.find_one({"item_id": "i1", "warehouse_id": "WH-1"})
+    assert balance['qty'] == 6
+    assert await server.derive_stock_qty("i1", "WH-1") == 6
+    assert await memory.issues.count_documents({}) == 1
+
+
+async def test_number_leasing_hands_out_each_number_once(memory, monkeypatch):
+    monkeypatch.setattr(server, "NUMBER_SERIES_BLOCK_SIZE", 5)
+    numbers = await asyncio.gather(*(server.get_next_number("ISSUE") for _ in range(12)))
+
+    assert sorted(numbers) == [f"ISS{n:04d}" for n in range(1, 13)]
+    series = await memory.number_series.find_one({"series_type": "ISSUE"})
+    assert series['current_number'] == 15
+
+
+async def test_paginated_list_walks_every_row_once(client, memory):
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    await memory.issues.insert_many([{
+        **issue("i1", 1), "id": f"iss-{n:02d}", "issue_no": f"ISS{n:04d}",
+        # Pairs share a timestamp so pages also break ties on id
+        "issued_at": start + timedelta(minutes=n // 2, microseconds=n * 7)
+    } for n in range(25)])
+
+    seen, cursor = [], None
+    while True:
+        response = await client.get("/api/inventory/issue", params={"limit": 10, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        seen += [row['id'] for row in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == [f"iss-{n:02d}" for n in range(25)]
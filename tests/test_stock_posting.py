@@ -0,0 +1,64 @@
+import uuid
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def line(item_id, qty, warehouse_id="WH-1"):
+    return {"item_id": item_id, "item_name": item_id.upper(), "warehouse_id": warehouse_id, "qty": qty, "uom": "PCS"}
+
+
+async def post(collection, txn_type, *lines):
+    doc = {"id": str(uuid.uuid4())}
+    await server.post_stock_document(collection, doc, txn_type, f"{txn_type}-1", list(lines))
+    return doc
+
+
+async def balances(memory):
+    return {row['item_id']: row['qty'] async for row in memory.stock_balance.find({}, {"_id": 0})}
+
+
+async def test_insufficient_stock_leaves_nothing_decremented(memory):
+    await post(memory.stock_inward, "INWARD", line("i1", 10), line("i2", 1))
+
+    with pytest.raises(server.HTTPException) as raised:
+        await post(memory.issues, "ISSUE", line("i1", -5), line("i2", -5))
+
+    assert raised.value.status_code == 400
+    assert await balances(memory) == {"i1": 10, "i2": 1}
+    assert await memory.issues.count_documents({}) == 0
+    assert await memory.stock_movements.count_documents({"txn_type": "ISSUE"}) == 0
+
+
+async def test_failed_write_reverts_the_decrements(memory, monkeypatch):
+    await post(memory.stock_inward, "INWARD", line("i1", 10), line("i2", 10))
+
+    async def insert_one(*args, **kwargs):
+        raise RuntimeError("connection lost")
+    monkeypatch.setattr(memory.issues, "insert_one", insert_one)
+
+    with pytest.raises(RuntimeError):
+        await post(memory.issues, "ISSUE", line("i1", -4), line("i2", -3))
+
+    assert await balances(memory) == {"i1": 10, "i2": 10}
+
+
+@pytest.mark.parametrize("txn_type,sign", [("INWARD", 1), ("ISSUE", -1)])
+async def test_failed_ledger_write_keeps_ledger_and_balances_in_step(memory, monkeypatch, txn_type, sign):
+    await post(memory.stock_inward, "INWARD", line("i1", 10), line("i2", 10))
+    insert_many = memory.stock_movements.insert_many
+
+    async def insert_first_row_then_fail(documents, *args, **kwargs):
+        await insert_many(documents[:1])
+        raise RuntimeError("connection lost")
+    monkeypatch.setattr(memory.stock_movements, "insert_many", insert_first_row_then_fail)
+
+    with pytest.raises(RuntimeError):
+        await post(memory.issues, txn_type, line("i1", sign * 4), line("i2", sign * 3))
+
+    assert await balances(memory) == {"i1": 10, "i2": 10}
+    for item_id in ("i1", "i2"):
+        assert await server.derive_stock_qty(item_id, "WH-1") == 10
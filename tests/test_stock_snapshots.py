@@ -0,0 +1,61 @@
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+PAIRS = [("i1", "WH-1"), ("i2", "WH-1"), ("i1", "WH-2")]
+
+
+def movement(n, item_id, warehouse_id, qty, posted_at):
+    return {"id": f"mv-{n}", "txn_type": "INWARD", "item_id": item_id, "item_name": item_id,
+            "warehouse_id": warehouse_id, "qty": qty, "uom": "PCS", "posted_at": posted_at}
+
+
+async def test_rerun_after_crash_does_not_roll_pairs_twice(memory, monkeypatch):
+    now = datetime.now(timezone.utc)
+    await memory.stock_movements.insert_many([
+        movement(n, item_id, warehouse_id, 10 * (n + 1), now - timedelta(hours=2))
+        for n, (item_id, warehouse_id) in enumerate(PAIRS)
+    ])
+
+    # The first run writes its snapshots, then dies before moving the watermark
+    async def crash(*args, **kwargs):
+        raise RuntimeError("worker killed")
+    monkeypatch.setattr(server, "STOCK_SNAPSHOT_LAG_SECONDS", 3600)
+    monkeypatch.setattr(memory.counters, "update_one", crash)
+    with pytest.raises(RuntimeError):
+        await server.roll_stock_snapshots()
+    monkeypatch.undo()
+    # ...and only some of its unordered batch had landed
+    await memory.stock_snapshots.delete_one({"item_id": "i1", "warehouse_id": "WH-2"})
+    await memory.stock_movements.insert_one(movement(9, "i2", "WH-1", 5, now - timedelta(minutes=30)))
+
+    await server.roll_stock_snapshots()
+    await server.roll_stock_snapshots()
+
+    snapshots = {(row['item_id'], row['warehouse_id']): row
+                 async for row in memory.stock_snapshots.find({}, {"_id": 0})}
+    assert {pair: row['qty'] for pair, row in snapshots.items()} == {
+        ("i1", "WH-1"): 10, ("i2", "WH-1"): 25, ("i1", "WH-2"): 30
+    }
+    state = await memory.counters.find_one({"key": server.STOCK_SNAPSHOT_STATE_KEY})
+    assert all(row['as_of'] <= state['value'] for row in snapshots.values())
+    for (item_id, warehouse_id), expected in [(("i1", "WH-1"), 10), (("i2", "WH-1"), 25), (("i1", "WH-2"), 30)]:
+        assert await server.derive_stock_qty(item_id, warehouse_id) == expected
+
+
+async def test_opening_balance_takes_the_latest_item_name(memory):
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    rows = [movement(n, "i1", "WH-1", 5, start + timedelta(days=n)) for n in range(3)]
+    for row, name in zip(rows, ["Old", "Older", "Renamed"]):
+        row['item_name'] = name
+    # Stored newest first, so storage order alone would pick the wrong name
+    await memory.stock_movements.insert_many(rows[::-1])
+
+    opening = await server.stock_opening_balances({}, start + timedelta(days=10))
+
+    assert opening[("i1", "WH-1")]['item_name'] == "Renamed"
+    assert opening[("i1", "WH-1")]['qty'] == 15
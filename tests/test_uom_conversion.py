@@ -0,0 +1,37 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def uom(uom_id, factor, category="WEIGHT", **extra):
+    return {"id": uom_id, "uom_name": uom_id.upper(), "uom_type": "Weight", "uom_category": category,
+            "decimal_precision": 3, "conversion_factor": factor, **extra}
+
+
+async def test_a_zero_factor_unit_only_breaks_its_own_conversions(client, memory):
+    await memory.uoms.insert_many([
+        uom("kg", 1000), uom("g", 1), uom("bad", 0), uom("blank", None),
+        uom("lb", 0, conversions={"G": 453.592})
+    ])
+
+    converted = await client.get("/api/masters/uoms/convert", params={"qty": 2, "from_uom_id": "kg", "to_uom_id": "g"})
+    batch = await client.post("/api/masters/uoms/convert/batch", json=[
+        {"qty": 1, "from_uom_id": "g", "to_uom_id": "kg"}, {"qty": 1, "from_uom_id": "lb", "to_uom_id": "g"}
+    ])
+    assert converted.json()['converted_qty'] == 2000
+    assert [row['converted_qty'] for row in batch.json()] == [0.001, 453.592]
+
+    for from_uom_id, to_uom_id in [("kg", "bad"), ("bad", "g"), ("blank", "kg"), ("lb", "kg")]:
+        params = {"qty": 1, "from_uom_id": from_uom_id, "to_uom_id": to_uom_id}
+        assert (await client.get("/api/masters/uoms/convert", params=params)).status_code == 400
+        response = await client.post("/api/masters/uoms/convert/batch", json=[params])
+        assert response.status_code == 400
+
+
+async def test_uoms_need_positive_factors(client, memory):
+    for body in [uom("bad", 0), uom("neg", 1, conversions={"G": -2})]:
+        response = await client.post("/api/masters/uoms", json=body)
+        assert response.status_code == 422
+    assert await memory.uoms.count_documents({}) == 0